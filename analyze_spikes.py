@@ -0,0 +1,164 @@
+'''Finds and saves the spikes in recordings without playing them through
+Maxine. Each data directory (with poredata.bin and meta.json) gets the same
+separate_spikes.arff/.csv/.npz files that maxine.py --datadir saves, and
+there's a summary of all of them in one CSV file.
+
+python3 analyze_spikes.py DIR [DIR ...] [--processes N] [--detector NAME]
+    [--conductance] [--shard-seconds SECONDS] [--summary FILE]
+
+Every recording is split into shards of --shard-seconds, and the shards of
+all the recordings are shared between a pool of processes, so it uses all
+the cores even for one long recording.'''
+import argparse
+import csv
+import logging
+import math
+import multiprocessing
+import os
+
+import numpy as np
+
+import constants
+import data
+import spike_writer
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_COLUMNS = ['data_dir', 'seconds', 'spikes', 'spikes_per_second',
+                   'mean_peak', 'mean_duration', 'median_duration']
+
+def count_frames(data_dir, samples_per_frame):
+    '''Returns the number of frames in a recording, including a partial
+    frame at the end.'''
+    num_samples = os.path.getsize(os.path.join(data_dir, 'poredata.bin')) // 2
+
+    return math.ceil(num_samples / samples_per_frame)
+
+def make_shards(data_dirs, frames_per_shard, samples_per_frame):
+    '''Returns a list of (data_dir, start_frame, end_frame) tuples covering
+    every frame of the recordings, in order.'''
+    shards = []
+    for data_dir in data_dirs:
+        num_frames = count_frames(data_dir, samples_per_frame)
+        for start in range(0, num_frames, frames_per_shard):
+            shards.append((data_dir, start, min(start + frames_per_shard, num_frames)))
+
+    return shards
+
+def analyze_shard(data_dir, start_frame, end_frame, conductance = False, detector = 'threshold'):
+    '''Finds the spikes that start in the frames from start_frame to
+    end_frame (or the end of the recording if end_frame is None). Returns
+    (records, samples) from spike_writer.make_records().
+
+    The detector is primed with the frames before start_frame (see
+    Data._run_spike_detector()), which go through its own rules but whose
+    spikes are thrown away. By the end of priming its baseline is the same
+    as if the recording had been played from the start, and the CUSUM's
+    sums have settled the same way (they go back to 0 after every spike),
+    so the shard finds the same spikes. It begins a frame early and carries on past end_frame
+    until any spike in progress ends, and keeps only the spikes that start
+    in its own frames, so a spike on the border between two shards is found
+    once and in full.'''
+    d = data.PrerecordedData(constants.NUM_BOXES, 0, conductance, detector)
+    d.load_files(data_dir)
+    num_frames = count_frames(data_dir, d.samples_per_frame)
+    if end_frame is None:
+        end_frame = num_frames
+
+    spikes = []
+    frame = max(0, start_frame - 1)
+    while frame < num_frames and (frame < end_frame or d.spike_detector.in_spike):
+        d.latest_frame = frame
+        spikes += d.detect_spikes()
+        frame += 1
+
+    if frame == num_frames:
+        spikes += d.finish_spike_detection()
+
+    start_index = start_frame * d.samples_per_frame
+    end_index = end_frame * d.samples_per_frame
+    spikes = [s for s in spikes if start_index <= s.start_index < end_index]
+
+    records, samples = spike_writer.make_records(spikes)
+
+    return records, samples
+
+def _analyze_shard(args):
+    '''analyze_shard() for Pool.imap(), which passes one argument.'''
+    shard, options = args
+
+    return analyze_shard(*shard, **options)
+
+def summarize(data_dir, records, num_frames, samples_per_frame, sample_rate):
+    '''Returns a row of the summary file for one recording.'''
+    seconds = num_frames * samples_per_frame / sample_rate
+    num_spikes = len(records)
+
+    if num_spikes == 0:
+        return [data_dir, seconds, 0, 0.0, '', '', '']
+
+    return [data_dir, seconds, num_spikes, num_spikes / seconds,
+            np.mean(records['peak']), np.mean(records['duration']),
+            np.median(records['duration'])]
+
+def analyze(data_dirs, processes = None, conductance = False, detector = 'threshold',
+            shard_seconds = 600, summary_filename = 'spike_summary.csv'):
+    '''Analyzes every recording in data_dirs with a pool of processes (one
+    per core if processes is None), saves the spike files in each
+    directory and writes the summary to summary_filename.'''
+    samples_per_frame = constants.PRERECORDED_SAMPLES_PER_FRAME
+    sample_rate = constants.SAMPLE_RATE
+    frames_per_shard = max(1, round(shard_seconds * sample_rate / samples_per_frame))
+
+    shards = make_shards(data_dirs, frames_per_shard, samples_per_frame)
+    options = {'conductance': conductance, 'detector': detector}
+    logger.info('Analyzing %s recordings in %s shards', len(data_dirs), len(shards))
+
+    summary = []
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.imap(_analyze_shard, [(shard, options) for shard in shards])
+
+        # The results come back in order, so each recording's shards are
+        # written one after another.
+        shards_left = list(shards)
+        for data_dir in data_dirs:
+            # Replace the spike files from an earlier run
+            writer = spike_writer.SpikeWriter(data_dir, append = False)
+            all_records = []
+            num_frames = 0
+            while shards_left and shards_left[0][0] == data_dir:
+                shard = shards_left.pop(0)
+                records, samples = next(results)
+                writer.write_records(records, samples)
+                all_records.append(records)
+                num_frames = shard[2]
+            writer.close()
+
+            records = np.concatenate(all_records) if all_records else np.zeros(0, spike_writer.RECORD_DTYPE)
+            summary.append(summarize(data_dir, records, num_frames, samples_per_frame, sample_rate))
+            logger.info('%s: %s spikes', data_dir, len(records))
+
+    with open(summary_filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS)
+        writer.writerows(summary)
+
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the spikes in recordings.')
+    parser.add_argument('data_dirs', nargs='+')
+    parser.add_argument('--processes', action='store', type=int)
+    parser.add_argument('--conductance', action='store_true')
+    parser.add_argument('--detector', action='store', default='threshold',
+                        choices=list(data.DETECTORS))
+    parser.add_argument('--shard-seconds', action='store', type=float, default=600)
+    parser.add_argument('--summary', action='store', default='spike_summary.csv')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    analyze(args.data_dirs, args.processes, args.conductance, args.detector,
+            args.shard_seconds, args.summary)
+
+if __name__ == '__main__':
+    main()
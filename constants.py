@@ -41,5 +41,11 @@ MACS = ['04e9e50c6a0b', '04e9e50cc5b9', '04e9e50cc5ba',
 # The number of samples Lilith sends per message.
 LIVE_SAMPLES_PER_MESSAGE = 5120
 
+# The number of samples in each frame of prerecorded data.
+PRERECORDED_SAMPLES_PER_FRAME = 1667
+
+# The number of samples per second, in live and prerecorded data.
+SAMPLE_RATE = 10**5
+
 # Whether or not to send signals to the pump.
 USE_PUMP = False
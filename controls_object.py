@@ -23,6 +23,11 @@ class Controls:
         # LCD font
         pygame.font.init()
         self.font = pygame.font.Font('ds-digi.ttf', 40)
+        # The last text drawn at each position and its rendered surface
+        self.rendered_text = {}
+        # The surface of each static control the last time it was drawn,
+        # and a static layer made from it
+        self.static_layers = {}
         
         self.voltage_knob = Actor('voltage_knob')
         #self.voltage_knob.left = 10
@@ -253,24 +258,55 @@ class Controls:
             self.syringe_value = 1
 
     def draw_text(self, text, coords):
-        surface = self.font.render(text, False, colors.RED)
-        self.screen.blit(surface, coords)
+        '''Draws text at coords. It's only rendered again when the text at
+        coords changes.'''
+        rendered = self.rendered_text.get(coords)
+        if rendered is None or rendered[0] != text:
+            surface = self.font.render(text, False, colors.RED)
+            rendered = (text, graphs.make_static_layer(surface))
+            self.rendered_text[coords] = rendered
+        
+        self.screen.blit(rendered[1], coords)
+
+    def draw_static(self, actor):
+        '''Draws an Actor whose image only changes when it's scaled (like the
+        panel or the TV frame) from a static layer. The Actor makes a new
+        surface each time it's scaled, so then the layer is made again.'''
+        surface = actor._surf
+        layer = self.static_layers.get(id(actor))
+        if layer is None or layer[0] is not surface:
+            layer = (surface, graphs.make_static_layer(surface))
+            self.static_layers[id(actor)] = layer
+        
+        self.screen.blit(layer[1], actor.topleft)
+
+    def get_control_scale(self, index):
+        '''Returns the scale to draw a control at. The control that's
+        presently selected is a bit bigger.'''
+        scale = 1
+        if index == self.control_index:
+            scale = 1.1 if index == self.tv_index else 1.2
+        
+        if index == self.drop_index:
+            scale *= 0.5
+        elif index == self.tv_index:
+            scale *= 1.1
+        
+        return scale
 
     def draw(self):
         '''In game mode, this draws all the controls and the corner display.
         In DataView mode, it draws the controls for Live with no TV, and
         simply isn't called for Prerecorded.'''
-        self.panel.draw()
+        self.draw_static(self.panel)
     
-        # Set the control that's presently selected to be a bit bigger.
-        for control in self.controls:
-            control.scale = 1
-        if self.control_index == self.tv_index:
-            self.tv.scale = 1.1
-        else:
-            self.controls[self.control_index].scale = 1.2
-        self.drop_button.scale *= 0.5
-        self.tv.scale *= 1.1
+        # Set the control that's presently selected to be a bit bigger. An
+        # Actor scales its image again whenever scale is set, so it's only
+        # set when it changes.
+        for index, control in enumerate(self.controls):
+            scale = self.get_control_scale(index)
+            if getattr(control, 'scale', None) != scale:
+                control.scale = scale
      
         self.voltage_knob.draw()
         
@@ -314,7 +350,7 @@ class Controls:
                 self.cg.draw()
 
             # Draw the TV frame after the graph so it is on top of the graph.
-            self.tv.draw()
+            self.draw_static(self.tv)
 
         for box in pgzero_textbox.input_boxes:
             box.draw()
@@ -566,11 +602,13 @@ class PotionHolder:
         self.potions[(2 - self.selected) % 4] = self.actors[2]
         self.potions[(3 - self.selected) % 4] = self.actors[3]
         
-        self.holder.scale = self.scale
-        # Draw the top potion bigger
-        for i in range(0, 4):
-            self.potions[i].scale = 0.5 * self.scale
-        self.potions[0].scale = 0.7 * self.scale
+        # An Actor scales its image again whenever scale is set, so it's
+        # only set when it changes. Draw the top potion bigger.
+        scales = [(self.holder, self.scale), (self.potions[0], 0.7 * self.scale)]
+        scales += [(potion, 0.5 * self.scale) for potion in self.potions[1:]]
+        for actor, scale in scales:
+            if getattr(actor, 'scale', None) != scale:
+                actor.scale = scale
         
         # Move them all to the correct position
         self.potions[0].pos = (1602, 680)
@@ -6,11 +6,13 @@ import os
 import math
 import time
 import logging
+import collections
 
 import lilith_client
 import util
 import constants
 import spike_object
+from ring_buffer import RingBuffer
 
 # Set up logger for this module
 logger = logging.getLogger('data')
@@ -21,14 +23,470 @@ handler.formatter = logging.Formatter('%(asctime)s  %(name)s %(levelname)s: %(me
 logger.addHandler(handler)
 
 
+class RollingStatistics:
+    '''Keeps the mean and standard deviation of the samples in a sliding
+    window of whole frames. Adding a frame costs O(frame) and reading the
+    statistics costs O(1), instead of rescanning the whole window.
+    
+    Integer samples are summed exactly with Python ints, so the results
+    match np.mean() and np.std() over the same samples. Floating point
+    samples (conductance) are summed relative to the mean of the first
+    frame to limit rounding errors.'''
+    def __init__(self, max_frames):
+        self.max_frames = max_frames
+        self.clear()
+    
+    def clear(self):
+        # (count, total, total_squares, start_index) for each frame in the
+        # window
+        self._frames = collections.deque()
+        self.count = 0
+        self._total = 0
+        self._total_squares = 0
+        self._shift = None
+        self._evictions = 0
+    
+    def add_frame(self, frame, start_index = None):
+        '''Adds a frame to the window, removing the oldest frame if the
+        window already has max_frames frames. start_index is the absolute
+        sample index of the frame, if it's a whole frame of the signal (see
+        window).'''
+        frame = np.asarray(frame)
+        
+        if np.issubdtype(frame.dtype, np.integer):
+            wide = frame.astype('int64')
+            total = int(wide.sum())
+            total_squares = int(np.dot(wide, wide))
+        else:
+            if self._shift is None:
+                self._shift = float(np.mean(frame)) if len(frame) else 0.0
+            shifted = frame - self._shift
+            total = float(shifted.sum())
+            total_squares = float(np.dot(shifted, shifted))
+        
+        self._frames.append((len(frame), total, total_squares, start_index))
+        self.count += len(frame)
+        self._total += total
+        self._total_squares += total_squares
+        
+        if len(self._frames) > self.max_frames:
+            count, total, total_squares, start = self._frames.popleft()
+            self.count -= count
+            self._total -= total
+            self._total_squares -= total_squares
+            self._evictions += 1
+            
+            # Floating point totals drift as frames are added and removed, so
+            # recalculate them whenever the whole window has been replaced.
+            if self._evictions % self.max_frames == 0:
+                self._total = sum(f[1] for f in self._frames)
+                self._total_squares = sum(f[2] for f in self._frames)
+    
+    @property
+    def window(self):
+        '''The absolute sample indexes (start, end) of the samples in the
+        window, or None if they aren't one contiguous stretch of the signal
+        (e.g. because a detector left its spikes out).'''
+        if not self._frames:
+            return None
+        
+        end = self._frames[0][3]
+        for count, total, total_squares, start in self._frames:
+            if start is None or start != end:
+                return None
+            end = start + count
+        
+        return (self._frames[0][3], end)
+    
+    def mean(self):
+        if self.count == 0:
+            return math.nan
+        
+        return (self._shift or 0) + self._total / self.count
+    
+    def sd(self):
+        '''The population standard deviation, like np.std().'''
+        n = self.count
+        if n == 0:
+            return math.nan
+        
+        if isinstance(self._total, int):
+            variance = (n * self._total_squares - self._total ** 2) / n ** 2
+        else:
+            variance = self._total_squares / n - (self._total / n) ** 2
+        
+        return math.sqrt(max(variance, 0))
+
+class SpikeDetector:
+    '''Finds spikes in a signal that arrives one frame at a time. This is
+    the threshold detector, and the base class for the other detectors in
+    DETECTORS.
+    
+    Every detector follows the same contract:
+    * process_frame() costs O(len(frame)), however long the recording or
+      the baseline window is.
+    * It returns the spikes completed by that frame, in order, as
+      spike_object.Spike objects whose start_index is the absolute sample
+      index where they start. A spike that straddles frames is one spike.
+    * frame_triggered says whether the frame counts as a spike for the
+      game.
+    
+    The threshold detector's spike is a run of samples more than
+    SDS_FOR_SPIKE standard deviations above or below the mean of the
+    baseline_frames frames before the present one (the same rule as
+    Data.find_spikes_in_last_frame()).
+    
+    Like the game's spike test, a spike is only kept if the frame it starts
+    in also jumps by more than spike_threshold compared with the previous
+    frame (see Data.end_spike_exists()). That filters out the slow drift
+    after a bias change. Set spike_threshold to None to keep every
+    excursion.'''
+    SDS_FOR_SPIKE = 3
+    # Need several seconds of baseline
+    MIN_BASELINE_SAMPLES = 20000
+
+    def __init__(self, baseline_frames, spike_threshold = 500):
+        self.baseline = RollingStatistics(baseline_frames)
+        self.spike_threshold = spike_threshold
+        self.reset()
+    
+    def reset(self, next_index = 0):
+        '''Forgets all the frames so far. The next frame starts at absolute
+        sample index next_index.'''
+        self.baseline.clear()
+        self.next_index = next_index
+        self.frame_triggered = False
+        self._previous_max = None
+        self._previous_min = None
+        
+        # The spike that reached the end of the last frame, if any. The sign
+        # is 1 for a positive spike, -1 for a negative one and 0 for none.
+        self._open_sign = 0
+        self._open_start = None
+        self._open_mean = None
+        self._open_keep = False
+        self._open_parts = []
+    
+    @property
+    def in_spike(self):
+        '''Whether a spike reached the end of the last frame.'''
+        return self._open_sign != 0
+    
+    def set_bias_changes(self, bias_change_indexes):
+        '''Tells the detector the sample indexes where the bias changes.
+        The threshold detector doesn't use them.'''
+        pass
+    
+    def prime(self, frame):
+        '''Looks at a frame without reporting its spikes, e.g. for the frames
+        before a --start-at position or a shard. The baseline (and a
+        subclass's own state, like the CUSUM sums) is updated the same way
+        as process_frame() does it, so spikes are left out of it if the
+        detector does that.'''
+        self.process_frame(frame)
+        self.frame_triggered = False
+    
+    def process_frame(self, frame):
+        '''Looks for spikes in the next frame of samples. Returns a list of
+        the spikes that were completed by this frame. frame_triggered is set
+        to whether this frame counts as a spike for the game, i.e. it jumped
+        and goes beyond the thresholds.'''
+        frame = np.asarray(frame)
+        completed = []
+        self.frame_triggered = False
+        
+        excursions = self.find_excursions(frame)
+        if excursions is None:
+            self._close_open_spike(completed)
+            no_excursions = np.zeros(len(frame), dtype=bool)
+            self._end_frame(frame, no_excursions, no_excursions)
+            return completed
+        
+        above, below, mean = excursions
+        
+        runs = []
+        for sign, mask in [(1, above), (-1, below)]:
+            starts, ends = Data.find_runs(mask)
+            runs += [(start, end, sign) for start, end in zip(starts, ends)]
+        runs.sort()
+        
+        jumped = self._frame_jumped(frame)
+        self.frame_triggered = jumped and len(runs) > 0
+        
+        # Continue the spike from the last frame if it's still going
+        if self._open_sign:
+            if runs and runs[0][0] == 0 and runs[0][2] == self._open_sign:
+                start, end, sign = runs.pop(0)
+                self._open_parts.append(frame[start : end] - self._open_mean)
+                
+                if end < len(frame):
+                    self._close_open_spike(completed)
+            else:
+                self._close_open_spike(completed)
+        
+        for start, end, sign in runs:
+            self._open_sign = sign
+            self._open_start = self.next_index + start
+            self._open_mean = mean
+            self._open_keep = jumped
+            self._open_parts = [frame[start : end] - mean]
+            
+            if end < len(frame):
+                self._close_open_spike(completed)
+        
+        self._end_frame(frame, above, below)
+        
+        return completed
+    
+    def flush(self):
+        '''Ends any spike that is still open (e.g. at the end of the data).
+        Returns a list containing it if it's being kept.'''
+        completed = []
+        self._close_open_spike(completed)
+        
+        return completed
+    
+    def find_excursions(self, frame):
+        '''Returns boolean arrays marking the samples of the frame that are
+        in a positive and a negative spike, and the mean that the spikes'
+        data is measured from. Returns None if there isn't enough baseline
+        to look for spikes yet.'''
+        mean = self.baseline.mean()
+        sd = self.baseline.sd()
+        
+        if self.baseline.count < self.MIN_BASELINE_SAMPLES or not sd > 0:
+            return None
+        
+        above = frame > mean + sd * self.SDS_FOR_SPIKE
+        below = frame < mean - sd * self.SDS_FOR_SPIKE
+        
+        return (above, below, mean)
+    
+    def update_baseline(self, frame, above, below):
+        '''Adds a frame that has been looked at to the baseline.'''
+        self.baseline.add_frame(frame, self.next_index)
+    
+    def _frame_jumped(self, frame):
+        if self.spike_threshold is None:
+            return True
+        
+        if self._previous_max is None or len(frame) == 0:
+            return False
+        
+        maxes_mins = ([self._previous_max, np.max(frame)],
+                      [self._previous_min, np.min(frame)])
+        
+        return Data.end_spike_exists(maxes_mins, self.spike_threshold)
+    
+    def _end_frame(self, frame, above, below):
+        self.update_baseline(frame, above, below)
+        self.next_index += len(frame)
+        
+        if len(frame):
+            self._previous_max = float(np.max(frame))
+            self._previous_min = float(np.min(frame))
+    
+    def _close_open_spike(self, completed):
+        '''Ends the open spike, if there is one, and adds it to completed if
+        it's being kept.'''
+        if self._open_sign and self._open_keep:
+            spike = spike_object.Spike(
+                np.concatenate(self._open_parts),
+                self._open_mean,
+                self._open_start)
+            completed.append(spike)
+        
+        self._open_sign = 0
+        self._open_parts = []
+
+class CusumDetector(SpikeDetector):
+    '''A two-sided CUSUM detector. Each sample is standardized with the
+    baseline mean and standard deviation, and the cumulative sums
+
+        S+ = min(ALARM_LEVEL, max(0, S+ + z - DRIFT))
+        S- = min(ALARM_LEVEL, max(0, S- - z - DRIFT))
+
+    are carried from frame to frame. A spike starts when a sum reaches
+    ALARM_LEVEL and lasts until it gets back to 0. A run of moderately
+    raised samples adds up, so it finds smaller but longer-lasting blockades
+    than the threshold detector, at the cost of a little more CPU and ending
+    each spike a few samples after the signal returns to baseline (capping
+    the sums keeps that short).'''
+    # Both in standard deviations. With these a false alarm in Gaussian
+    # noise takes tens of millions of samples.
+    DRIFT = 1
+    ALARM_LEVEL = 8
+
+    def reset(self, next_index = 0):
+        super().reset(next_index)
+        self._clear_sums()
+
+    def _clear_sums(self):
+        # The sums and whether they've alarmed since they were last 0
+        self._positive_sum = 0.0
+        self._negative_sum = 0.0
+        self._positive_alarmed = False
+        self._negative_alarmed = False
+
+    def find_excursions(self, frame):
+        mean = self.baseline.mean()
+        sd = self.baseline.sd()
+        
+        if self.baseline.count < self.MIN_BASELINE_SAMPLES or not sd > 0:
+            self._clear_sums()
+            return None
+        
+        z = (frame - mean) / sd
+        
+        positive = self.cumulative_sum(z - self.DRIFT, self._positive_sum, self.ALARM_LEVEL)
+        negative = self.cumulative_sum(-z - self.DRIFT, self._negative_sum, self.ALARM_LEVEL)
+        above = self.alarms(positive, self._positive_sum, self._positive_alarmed)
+        below = self.alarms(negative, self._negative_sum, self._negative_alarmed)
+        
+        if len(frame):
+            self._positive_sum = positive[-1]
+            self._negative_sum = negative[-1]
+            self._positive_alarmed = bool(above[-1])
+            self._negative_alarmed = bool(below[-1])
+        
+        return (above, below, mean)
+
+    def update_baseline(self, frame, above, below):
+        # Keep the spikes out of the baseline, or a long blockade would
+        # become the baseline and end its own alarm.
+        self.baseline.add_frame(frame[~(above | below)])
+
+    def alarms(self, sums, previous_sum, alarmed):
+        '''Returns a mask of the samples from where sums reaches ALARM_LEVEL
+        until it's back to 0. previous_sum and alarmed are the sum and alarm
+        state at the end of the last frame.'''
+        nonzero = sums > 0
+        reached = sums >= self.ALARM_LEVEL
+        
+        # Number the runs of nonzero sums. Run 0 is the one carried over
+        # from the last frame (if there is one).
+        started = nonzero & ~np.concatenate([[previous_sum > 0], nonzero[:-1]])
+        run = np.cumsum(started)
+        
+        # How many times each sample's run has reached the alarm level so far
+        count = np.cumsum(reached)
+        run_starts = np.concatenate([[0], np.flatnonzero(started)])
+        count_before_run = (count - reached)[run_starts]
+        count_before_run[0] = -1 if alarmed else 0
+        
+        return nonzero & (count > count_before_run[run])
+
+    @staticmethod
+    def cumulative_sum(increments, initial, limit = np.inf):
+        '''Vectorized S[n] = min(limit, max(0, S[n-1] + increments[n])),
+        starting from S[-1] = initial.
+
+        While S stays below the limit it's the usual running sum
+        S[n] = C[n] - min(0, min(C[0..n])) with C = S + cumsum(increments),
+        and while it stays above 0 it's S[n] = C[n] - max(0, max(C[0..n]) - limit).
+        Each time it hits the other bound we switch formulas, which only
+        happens around spikes.'''
+        increments = np.asarray(increments, dtype='float64')
+        result = np.empty(len(increments))
+        start = 0
+        value = initial
+        at_limit = False
+        
+        while start < len(increments):
+            c = value + np.cumsum(increments[start:])
+            if at_limit:
+                run = c - np.maximum(np.maximum.accumulate(c) - limit, 0)
+                crossings = np.flatnonzero(run < 0)
+            else:
+                run = c - np.minimum(np.minimum.accumulate(c), 0)
+                crossings = np.flatnonzero(run > limit)
+            
+            if len(crossings) == 0:
+                result[start:] = run
+                break
+            
+            k = int(crossings[0])
+            result[start : start + k] = run[:k]
+            value = 0 if at_limit else limit
+            result[start + k] = value
+            start += k + 1
+            at_limit = not at_limit
+        
+        return result
+
+class AdaptiveBaselineDetector(SpikeDetector):
+    '''A threshold detector whose baseline only learns from samples that
+    aren't in a spike, so long runs of events don't inflate the standard
+    deviation. The baseline is thrown away whenever the bias changes, and
+    detection waits until MIN_BASELINE_SAMPLES of the new baseline have
+    been seen, so a bias change isn't counted as hundreds of spikes.'''
+    def __init__(self, baseline_frames, spike_threshold = 500):
+        self.bias_change_indexes = np.zeros(0, dtype='int64')
+        super().__init__(baseline_frames, spike_threshold)
+
+    def set_bias_changes(self, bias_change_indexes):
+        self.bias_change_indexes = np.asarray(bias_change_indexes, dtype='int64')
+
+    def find_excursions(self, frame):
+        # Don't look for spikes across a bias change
+        if self._bias_change_offset(frame) is not None:
+            return None
+        
+        return super().find_excursions(frame)
+
+    def update_baseline(self, frame, above, below):
+        offset = self._bias_change_offset(frame)
+        if offset is not None:
+            # Start again with the samples after the bias change
+            self.baseline.clear()
+            frame = frame[offset:]
+            above = above[offset:]
+            below = below[offset:]
+        
+        self.baseline.add_frame(frame[~(above | below)])
+
+    def _bias_change_offset(self, frame):
+        '''Returns the offset within the frame of the last bias change in
+        it, or None if the bias doesn't change during the frame.'''
+        end_index = self.next_index + len(frame)
+        i = np.searchsorted(self.bias_change_indexes, end_index, side='left')
+        
+        if i > 0 and self.bias_change_indexes[i - 1] >= self.next_index:
+            return int(self.bias_change_indexes[i - 1] - self.next_index)
+        
+        return None
+
+# The spike detectors that can be chosen with --detector
+DETECTORS = {
+    'threshold': SpikeDetector,
+    'cusum': CusumDetector,
+    'adaptive': AdaptiveBaselineDetector,
+}
+
+def make_spike_detector(name, baseline_frames):
+    '''Creates the spike detector called name (a key of DETECTORS).'''
+    return DETECTORS[name](baseline_frames)
+
 class Data:
+    # The required difference between a box and the previous box to count
+    # as a spike (in current units)
+    SPIKE_THRESHOLD = 500
+
     def __init__(self):
         self.sample_data = []
         self.joystick_data = []
-        self.sample_rate = 10**5
+        self.sample_rate = constants.SAMPLE_RATE
         self.latest_frame = -1
         #self.amplifier_min = -10000
         self.amplifier_max = 20000
+        # Subclasses set this to a SpikeDetector whose baseline covers the
+        # frames before the last box of their spike detection window.
+        self.spike_detector = None
+        # The frame after the last one the detector has seen
+        self._detector_end = 0
+        self._completed_spikes = []
+        # Whether a frame that detect_spikes() looked at was a spike
+        self.frame_triggered = False
         
     def get_absolute_scaled_boxes(self):
         boxes = self.get_boxes()
@@ -76,45 +534,50 @@ class Data:
         if not len(samples):
             return ([], [])
 
+        samples = np.asarray(samples)
+
         # This represents the number of lines used by the present data
         num_used_lines = int(len(samples) / samples_to_show * constants.NUM_BOXES)
-        min_ = int(np.min(samples))
-        max_ = int(np.max(samples))
-        range_ = max_ - min_ + 1
-
-        maxes = np.zeros(num_used_lines)
-        mins = np.zeros(num_used_lines)
-        # Used for diagnostics
-        averages = np.zeros(num_used_lines)
-        
         box_width = samples_to_show // constants.NUM_BOXES
         
-        #for i in range(0, box_width):
-        for i in range(0, num_used_lines):
-            box_start = box_width * i
-            box_end = box_width * (i + 1)
-            values = samples[box_start : box_end]
-            
-            maxes[i] = values.max()
-            mins[i] = values.min()
-            averages[i] = values.mean()
+        boxes = Data.reshape_into_boxes(samples, num_used_lines, box_width)
+        
+        maxes = boxes.max(axis=1).astype('float64')
+        mins = boxes.min(axis=1).astype('float64')
             
         if util.all_zeros(samples):
             logger.info('Somehow samples is all 0s in give_samples')
 
-        logger.debug('means: %s', averages)
-        logger.debug('maxes: %s', maxes)
-        logger.debug('mins: %s', mins)
+        if logger.isEnabledFor(logging.DEBUG):
+            # Used for diagnostics
+            averages = boxes.mean(axis=1)
+            logger.debug('means: %s', averages)
+            logger.debug('maxes: %s', maxes)
+            logger.debug('mins: %s', mins)
         
         return (maxes, mins)
 
     @staticmethod
-    def end_spike_exists(maxes_mins):
+    def split_into_frames(samples, frame_size):
+        '''Returns a list of views of samples, frame_size samples each (the
+        last may be shorter).'''
+        return [samples[start : start + frame_size] for start in range(0, max(1, len(samples)), frame_size)]
+
+    @staticmethod
+    def reshape_into_boxes(samples, num_boxes, box_width):
+        '''Returns a (num_boxes, box_width) view of the first
+        num_boxes * box_width samples, so each box can be reduced with one
+        NumPy call along axis 1. Samples after the last whole box are left
+        out.'''
+        num_boxes = min(num_boxes, len(samples) // box_width)
+        
+        return samples[: num_boxes * box_width].reshape(num_boxes, box_width)
+
+    @staticmethod
+    def end_spike_exists(maxes_mins, spike_threshold = SPIKE_THRESHOLD):
         '''Detects whether the final box is a spike (positive or negative)
-        based on a threshold.'''
-        # The required difference between a box and the previous box to count
-        # as a spike
-        SPIKE_THRESHOLD = 500
+        based on a threshold. The threshold defaults to one for current data;
+        conductance data needs a threshold scaled by the bias.'''
         maxes, mins = maxes_mins
         
         if len(maxes) < 2:
@@ -123,21 +586,28 @@ class Data:
         # We don't want this to be the absolute difference, or we'd detect
         # returns to baseline after a spike as well
         diff_maxes = maxes[-1] - maxes[-2]
-        if diff_maxes > SPIKE_THRESHOLD:
+        if diff_maxes > spike_threshold:
             return True
         
         diff_mins = -(mins[-1] - mins[-2])
-        if diff_mins > SPIKE_THRESHOLD:
+        if diff_mins > spike_threshold:
             return True
         
         return False
 
     @staticmethod
-    def statistical_end_spike_exists(last_samples, num_boxes):
+    def statistical_end_spike_exists(last_samples, num_boxes, baseline = None, start_index = None):
         '''Uses the mean and standard deviation of the recent samples to
         calculate whether the last 'box' contains a spike. The last box is
         the last len(last_samples)/num_boxes worth of samples.
         
+        baseline is an optional RollingStatistics object that holds the
+        samples before the last box (see get_baseline_statistics()), and
+        start_index is the absolute sample index of last_samples. If the
+        baseline's window is exactly those samples, its mean and standard
+        deviation are used instead of recalculating them over the whole
+        window.
+        
         WARNING: This method also counts bias changes as hundreds of spikes,
         so Jade added a requirement for the change between two frames to be
         large enough as well (the code that calls this will also call
@@ -150,10 +620,8 @@ class Data:
 
         index = - len(last_samples) // num_boxes
         last_box = last_samples[index:]
-        earlier_samples = last_samples[:index]
         
-        mean = np.mean(earlier_samples)
-        sd = np.std(earlier_samples)
+        mean, sd = Data.baseline_mean_and_sd(last_samples, index, baseline, start_index)
         
         logger.debug('mean, sd: %s %s', mean, sd)
         
@@ -174,9 +642,24 @@ class Data:
         return False
 
     @staticmethod
-    def find_spikes_in_last_frame(last_samples, num_boxes):
-        '''Iterate through the whole box, finding contiguous segments that
-        are above the mean.'''
+    def baseline_mean_and_sd(last_samples, index, baseline, start_index = None):
+        '''Returns the mean and standard deviation of last_samples[:index],
+        taking them from baseline if its window is the same samples
+        (last_samples starts at absolute sample index start_index).'''
+        if (baseline is not None and start_index is not None and
+                baseline.window == (start_index, start_index + len(last_samples) + index)):
+            return (baseline.mean(), baseline.sd())
+        
+        earlier_samples = last_samples[:index]
+        
+        return (np.mean(earlier_samples), np.std(earlier_samples))
+
+    @staticmethod
+    def find_spikes_in_last_frame(last_samples, num_boxes, baseline = None, start_index = None):
+        '''Finds the contiguous segments of the last box that are more than
+        SDS_FOR_SPIKE standard deviations above or below the mean. baseline
+        and start_index work the same way as in
+        statistical_end_spike_exists().'''
 
         spikes = []
     
@@ -186,67 +669,113 @@ class Data:
         SDS_FOR_SPIKE = 3
      
         index = - len(last_samples) // num_boxes
-        last_box = last_samples[index:]
-        earlier_samples = last_samples[:index]
+        last_box = np.asarray(last_samples[index:])
 
-        mean = np.mean(earlier_samples)
-        sd = np.std(earlier_samples)
+        mean, sd = Data.baseline_mean_and_sd(last_samples, index, baseline, start_index)
 
         # TODO HACK why does this happen?
         if sd == 0:
             return spikes
         
-        # Find positive spikes
-        spike_start_index = None
-        j = 0
+        # Find positive spikes, then negative spikes. Each spike is a run of
+        # samples beyond the threshold.
+        above = last_box > mean + sd * SDS_FOR_SPIKE
+        below = last_box < mean - sd * SDS_FOR_SPIKE
         
-        while j < len(last_box):
-            sample = last_box[j]
-            
-            if sample > mean + sd * SDS_FOR_SPIKE:
-                # Find the rest of the spike
-                spike_start_index = j
-                j += 1
-                while j < len(last_box):
-                    sample = last_box[j]
+        for mask in [above, below]:
+            starts, ends = Data.find_runs(mask)
             
-                    if sample > mean + sd * SDS_FOR_SPIKE:
-                        j += 1
-                    else:
-                        break
+            for start, end in zip(starts, ends):
                 spike = spike_object.Spike(
-                    last_box[spike_start_index : j] - mean,
+                    last_box[start : end] - mean,
                     mean)
                 spikes.append(spike)
-                
-            j += 1
 
-        # Find negative spikes
-        spike_start_index = None
-        j = 0
+        return spikes
+
+    def get_baseline_statistics(self):
+        '''Returns the RollingStatistics for the frames just before
+        latest_frame, i.e. the part of the spike detection window before the
+        last box. It's brought up to date one frame at a time as the data
+        advances, and rebuilt from scratch after a jump.'''
+        self._run_spike_detector(self.latest_frame)
+        
+        return self.spike_detector.baseline
+    
+    def detect_spikes(self):
+        '''Runs the spike detector up to and including the present frame.
+        Returns a list of the spikes completed since the last call.'''
+        self.frame_triggered = self._run_spike_detector(self.latest_frame + 1)
+        
+        completed = self._completed_spikes
+        self._completed_spikes = []
         
-        while j < len(last_box):
-            sample = last_box[j]
+        return completed
+    
+    def finish_spike_detection(self):
+        '''Like detect_spikes(), but also ends a spike that's still going at
+        the end of the data.'''
+        completed = self.detect_spikes()
+        
+        return completed + self.spike_detector.flush()
+    
+    def detection_start_frame(self):
+        '''The first frame the spike detector looks at when it's reset.
+        Spikes that start before it aren't found again unless the data jumps
+        back.
+        
+        Priming starts two baseline windows back, so that the baseline it
+        ends up with was learned by the detector's own rules (e.g. leaving
+        out spikes) rather than while it was still starting up.'''
+        return max(0, self.latest_frame - 2 * self.spike_detector.baseline.max_frames)
+    
+    def reset_spike_detector(self):
+        '''Makes the spike detector start again from the baseline window
+        before the present frame, e.g. after a frame arrives late.'''
+        self._detector_end = -1
+    
+    def _run_spike_detector(self, end_frame):
+        '''Feeds the spike detector the frames up to end_frame that it hasn't
+        seen. After a jump (or at the start) it's reset, and the frames
+        before the present one are only used to prime it. Returns whether
+        any of the frames it looked at triggered.'''
+        detector = self.spike_detector
+        start_frame = self.detection_start_frame()
+        
+        if not (start_frame <= self._detector_end <= end_frame):
+            detector.reset(start_frame * self.samples_per_frame)
             
-            if sample < mean - sd * SDS_FOR_SPIKE:
-                # Find the rest of the spike
-                spike_start_index = j
-                j += 1
-                while j < len(last_box):
-                    sample = last_box[j]
+            prime_end = min(end_frame, self.latest_frame)
+            for i in range(start_frame, prime_end):
+                detector.prime(self.get_frame_samples(i))
             
-                    if sample < mean - sd * SDS_FOR_SPIKE:
-                        j += 1
-                    else:
-                        break
-                spike = spike_object.Spike(
-                    last_box[spike_start_index : j] - mean,
-                    mean)
-                spikes.append(spike)
-                
-            j += 1
+            self._detector_end = prime_end
+        
+        triggered = False
+        for i in range(self._detector_end, end_frame):
+            self.before_detecting_frame(i)
+            spikes = detector.process_frame(self.get_frame_samples(i))
+            self._completed_spikes += spikes
+            triggered = triggered or detector.frame_triggered
+        
+        self._detector_end = end_frame
+        
+        return triggered
+    
+    def before_detecting_frame(self, frame_index):
+        '''Called before the spike detector sees each frame, so subclasses
+        can adjust its settings.'''
+        pass
 
-        return spikes
+    @staticmethod
+    def find_runs(mask):
+        '''Returns arrays of the start and end indexes of each run of True
+        values in a boolean array, so that run i is mask[starts[i]:ends[i]].'''
+        padded = np.concatenate([[False], mask, [False]]).astype('int8')
+        # +1 where a run starts and -1 after it ends
+        edges = np.flatnonzero(np.diff(padded))
+        
+        return (edges[0::2], edges[1::2])
 
     @staticmethod
     def rms(samples):
@@ -255,115 +784,168 @@ class Data:
         return ret
 
 class LiveData(Data):
-    def __init__(self, num_boxes):
+    def __init__(self, num_boxes, detector = 'threshold'):
+        '''detector is the name of the spike detector in DETECTORS.'''
         super().__init__()
         self.num_boxes = num_boxes
-        # A dictionary mapping from frame index to a SampleData object 
-        self.data_frames = {}
-        self.pressed = []
         self.latest_spike_frame = None
         self.num_frames_just_received = 0
         self.recent_frames_contain_spikes = []
+        self.received_frames = []
+        self.samples_per_frame = constants.LIVE_SAMPLES_PER_MESSAGE
+        # Spikes are detected in a window of 100 frames (5 seconds)
+        self.window_frames = 20 * 5
+        # The samples of the last minute, by absolute sample index (frame
+        # index * samples_per_frame). Frames that haven't arrived are 0s.
+        self.frames_to_keep = 20 * 60
+        self.samples = RingBuffer(self.frames_to_keep * self.samples_per_frame, dtype='int16')
+        # Frames in the ring that were skipped and haven't arrived yet
+        self.missing_frames = set()
+        self.spike_detector = make_spike_detector(detector, self.window_frames - 1)
+        self._num_bias_changes = 0
         
-    def load_received_samples_and_count_spikes(self):
+    def load_received_samples_and_count_spikes(self, d_list = None):
+        '''Processes the sample messages from Lilith in d_list, or the ones
+        waiting on lilith_client.q if it's None. Returns the number of frames
+        with spikes. The joystick messages are left to the caller
+        (live_worker.summarize_packets()).'''
         spikes = 0
         prev_frame = self.latest_frame
         self.recent_frames_contain_spikes = []
+        self.received_frames = []
     
-        d_list = lilith_client.consume_latest_samples(lilith_client.q)
+        if d_list is None:
+            d_list = lilith_client.consume_latest_samples(lilith_client.q)
+        self.update_bias_changes()
         
         for data in d_list:
             if isinstance(data, lilith_client.SampleData):
-                sd_frame_index = data.start // constants.LIVE_SAMPLES_PER_MESSAGE
-                self.data_frames[sd_frame_index] = data
-                
-                # Update the latest frame index. There may be missing frames in
-                # between if the frames arrive in the wrong order.
-                
-                # See if it skips frames (it doesn't)
-                if sd_frame_index > self.latest_frame + 1:
-                    logger.info('Skipping %s frames', sd_frame_index - self.latest_frame + 1)
-                
-                if util.all_zeros(data.samples):
-                    logger.info('Received frame with all 0s')
-                
-                if sd_frame_index > self.latest_frame:
-                    self.latest_frame = sd_frame_index
-                    
-                # If we process multiple frames of current data during a frame of animation,
-                # we want to notice all the spikes
-                #if self.middle_spike_exists():
-                #    spikes += 1
-                #    self.latest_spike_frame = data.samples
-                last_n_frames = self.get_last_n_frames(20 * 5)
-                maxes_mins = Data.calculate_maxes_and_mins(last_n_frames, constants.LIVE_SAMPLES_PER_MESSAGE)
-                big_change = Data.end_spike_exists(maxes_mins)
-                deviation = Data.statistical_end_spike_exists(last_n_frames, 20 * 5)
-                spike_exists = big_change and deviation
-                if spike_exists:
-                    spikes += 1
-                    self.latest_spike_frame = data.samples
-                    self.recent_frames_contain_spikes.append(True)
-                else:
-                    self.recent_frames_contain_spikes.append(False)
-                    
-            elif isinstance(data, lilith_client.JoystickData):
-                self.pressed = data.pressed
+                # A SampleData holds more than one frame if the queue
+                # coalesced them. Each one is checked for a spike, which
+                # only looks at the new frame.
+                first_frame = data.start // constants.LIVE_SAMPLES_PER_MESSAGE
+                frames = Data.split_into_frames(data.samples, constants.LIVE_SAMPLES_PER_MESSAGE)
+                for i, samples in enumerate(frames):
+                    if self.receive_frame(first_frame + i, samples):
+                        spikes += 1
+                        self.latest_spike_frame = samples
+                        self.recent_frames_contain_spikes.append(True)
+                    else:
+                        self.recent_frames_contain_spikes.append(False)
 
         self.num_frames_just_received = self.latest_frame - prev_frame
 
         return spikes
 
+    def receive_frame(self, sd_frame_index, samples):
+        '''Stores a frame that has arrived. Returns whether it has a spike.'''
+        self.store_frame(sd_frame_index, samples)
+        self.received_frames.append(samples)
+        
+        # A late frame that was already counted as empty by the
+        # spike detector.
+        if sd_frame_index < self._detector_end:
+            self.reset_spike_detector()
+        
+        # Update the latest frame index. There may be missing frames in
+        # between if the frames arrive in the wrong order.
+        
+        # See if it skips frames (it doesn't). The missing frames are 0s, so
+        # they only go into the baseline rather than counting as spikes.
+        if sd_frame_index > self.latest_frame + 1 and self.latest_frame >= 0:
+            logger.info('Skipping %s frames', sd_frame_index - self.latest_frame + 1)
+            self.reset_spike_detector()
+        
+        if util.all_zeros(samples):
+            logger.info('Received frame with all 0s')
+        
+        # A late frame isn't checked for spikes. The frames after it are
+        # only used as baseline when the detector starts again, so they
+        # aren't counted twice.
+        if sd_frame_index < self.latest_frame:
+            return False
+        
+        self.latest_frame = sd_frame_index
+        
+        # The spike detector chosen with --detector decides whether the new
+        # frame is a spike, the same as in prerecorded mode. It only looks
+        # at the new frame (or the frames since it started again).
+        return self._run_spike_detector(self.latest_frame + 1)
+
     def get_one_frame_joystick(self):
         '''This isn't called by Live Mode.'''
         return 65535
 
+    def store_frame(self, frame_index, samples):
+        '''Puts a frame's samples in the ring and keeps track of the frames
+        that were skipped.'''
+        ring = self.samples
+        next_frame = ring.end_index // self.samples_per_frame
+        
+        if len(ring) > 0 and frame_index > next_frame:
+            self.missing_frames.update(range(max(next_frame, frame_index - self.frames_to_keep),
+                                             frame_index))
+        self.missing_frames.discard(frame_index)
+        
+        ring.write(frame_index * self.samples_per_frame, samples)
+        
+        # Forget the frames that have dropped out of the ring
+        oldest_frame = ring.start_index // self.samples_per_frame
+        if any(i < oldest_frame for i in self.missing_frames):
+            self.missing_frames = {i for i in self.missing_frames if i >= oldest_frame}
+    
     def get_frame(self):
-        if self.latest_frame in self.data_frames:
-            ret = self.data_frames[self.latest_frame].samples
-            return ret
-        else:
+        if self.latest_frame < 0:
             return None
+        
+        return self.get_frame_samples(self.latest_frame)
+
+    def update_bias_changes(self):
+        '''Passes the bias changes Lilith has told us about on to the spike
+        detector.'''
+        history = lilith_client.metadata.get('bias_settings_history', [])
+        
+        if len(history) != self._num_bias_changes:
+            self._num_bias_changes = len(history)
+            indexes = sorted(index for index, bias in history)
+            self.spike_detector.set_bias_changes(indexes)
+
+    def get_frame_samples(self, frame_index):
+        '''Returns the samples for a frame (a view of the ring), or 0s if it
+        hasn't arrived.'''
+        start = frame_index * self.samples_per_frame
+        samples = self.samples.window(start, start + self.samples_per_frame)
+        if len(samples) == self.samples_per_frame:
+            return samples
+        
+        return np.zeros(self.samples_per_frame, dtype='int16')
 
     def get_latest_spike_frame(self):
         '''This is only called when there has been a spike'''
         return self.latest_spike_frame
 
     def get_last_n_frames(self, n):
-        '''Returns a Numpy array containing the samples from the last n frames.
-        If latest_frame is less than n, return latest_frame frames. Put 0s in
-        any empty frames.'''
-        # latest_frame + 1 == the number of frames so far
-        n = min(n, self.latest_frame + 1)
-        frame_size = constants.LIVE_SAMPLES_PER_MESSAGE
-        num_samples = n * frame_size
-        
-        end_frame = self.latest_frame
-        start_frame = max(0, end_frame - n + 1)
-        
-        samples = np.zeros(num_samples, dtype='int16')
-        empty_frame = np.zeros(frame_size, dtype='int16')
-        
-        # samples has indexes from 1667*0 to 1667*NUM_BOXES,
-        # i goes from say 7 to 106
-        for i in range(start_frame, end_frame):
-            #import pdb; pdb.set_trace()
-            start = (i - start_frame) * frame_size
-            end = (i - start_frame + 1) * frame_size
-                        
-            if i in self.data_frames:
-                data = self.data_frames[i].samples
-            else:
-                data = empty_frame
-                #logger.info('Used empty_frame')
-            
-            samples[start:end] = data
-            #logger.info('%s %s %s', samples[start:end].shape, data.shape, (start, end))
-        
-        if util.all_zeros(samples):
-            logger.info('Somehow samples is all 0s in get_last_n_frames')
-            logger.info('%s %s %s', num_samples, start_frame, end_frame)
+        '''Returns a Numpy array containing the samples from the last n frames,
+        up to and including latest_frame. If latest_frame is less than n,
+        return latest_frame + 1 frames. Put 0s in any empty frames. It's a
+        view of the ring unless some of the frames are too old to be in it.'''
+        return self.get_last_n_samples(n * self.samples_per_frame)
 
+    def get_last_n_samples(self, n):
+        '''Returns the last n samples up to the end of latest_frame, by
+        absolute sample index, so a frame that arrives late is in its own
+        place and a frame that hasn't arrived is 0s. Returns fewer samples
+        at the start. It's a view of the ring unless some of the samples
+        are too old to be in it.'''
+        end = (self.latest_frame + 1) * self.samples_per_frame
+        start = max(0, end - n)
+        
+        samples = self.samples.window(start, end)
+        if len(samples) < end - start:
+            padded = np.zeros(end - start, dtype='int16')
+            padded[len(padded) - len(samples) : ] = samples
+            samples = padded
+        
         return samples
 
     def get_num_frames_just_received(self):
@@ -372,16 +954,34 @@ class LiveData(Data):
     def get_recent_frames_contain_spikes(self):
         return self.recent_frames_contain_spikes
 
+    def get_received_frames(self):
+        '''Returns the samples of the frames received by the last call to
+        load_received_samples_and_count_spikes(), in the order they
+        arrived.'''
+        return self.received_frames
+
 class PrerecordedData(Data):
-    def __init__(self, num_boxes, start_at):
+    def __init__(self, num_boxes, start_at, conductance = False, detector = 'threshold'):
+        '''If conductance is True, spikes are detected in the conductance
+        instead of the current. detector is the name of the spike detector
+        in DETECTORS.'''
         super().__init__()
         self.num_boxes = num_boxes
         self.init_boxes()
         self.no_more_data = False
         #self.latest_frame_current = []
-        self.samples_per_frame = 1667
-        self.conductance = []
+        self.samples_per_frame = constants.PRERECORDED_SAMPLES_PER_FRAME
+        # Conductance history for the frames played so far. It's sized for
+        # the largest window that's requested: the whole signal ring, or one
+        # second of samples.
+        capacity = max(self.samples_per_frame * num_boxes, self.sample_rate)
+        self.conductance = RingBuffer(capacity)
         self._data_dir = None
+        # Spikes are detected in a window of num_boxes frames
+        self.spike_detector = make_spike_detector(detector, num_boxes - 1)
+        self.use_conductance = conductance
+        self.set_voltage_data([[0, 0]])
+        self.set_joystick_data([])
         
         # Set self.latest_frame according to the number of seconds we start at
         frame_rate = 60
@@ -393,9 +993,11 @@ class PrerecordedData(Data):
     def load_files(self, data_dir):
         self._data_dir = data_dir
     
-        # Load current data
+        # Map the current data rather than reading it all in. Multi-hour
+        # recordings are gigabytes, so only the pages that a frame actually
+        # uses are read from disk (and the OS can drop them again later).
         filename = os.path.join(data_dir, 'poredata.bin')
-        self.sample_data = np.fromfile(filename, 'int16')
+        self.sample_data = PrerecordedData.map_sample_file(filename)
 
         meta_filename = os.path.join(data_dir, 'meta.json')    
         # Handle missing meta.json file. Lilith sometimes doesn't create one,
@@ -408,13 +1010,23 @@ class PrerecordedData(Data):
             settings = json.load(meta_file)
         
         if 'joystick' in settings:
-            self.joystick_data = settings['joystick']
+            self.set_joystick_data(settings['joystick'])
         
         if 'bias_settings_history' in settings:
-            self.voltage_data = settings['bias_settings_history']
+            self.set_voltage_data(settings['bias_settings_history'])
         else:
-            self.voltage_data = [[0, 0]]
+            self.set_voltage_data([[0, 0]])
             
+    @staticmethod
+    def map_sample_file(filename):
+        '''Returns a read-only memory-mapped int16 array of the samples in a
+        poredata.bin file. np.memmap can't map an empty file, so that case
+        returns an empty in-memory array instead.'''
+        if os.path.getsize(filename) < np.dtype('int16').itemsize:
+            return np.zeros(0, dtype='int16')
+        
+        return np.memmap(filename, dtype='int16', mode='r')
+
     def get_data_dir(self):
         return self._data_dir
             
@@ -434,107 +1046,181 @@ class PrerecordedData(Data):
         #self.latest_frame_current = cd
         return None
     
-    # TODO not the most efficient algorithm
+    def set_voltage_data(self, voltage_data):
+        '''Stores the bias settings history, a list of [sample_index, bias]
+        pairs, along with a breakpoint index used to look up the bias at
+        any sample. Each bias applies from its sample index until the next
+        bias change.'''
+        self.voltage_data = voltage_data
+        
+        history = np.array(voltage_data, dtype='float64').reshape(-1, 2)
+        # A stable sort keeps the later of two settings at the same index
+        # last, so it wins the lookup.
+        order = np.argsort(history[:, 0], kind='stable')
+        self.bias_change_indexes = history[order, 0].astype('int64')
+        self.biases = history[order, 1]
+        
+        self.spike_detector.set_bias_changes(self.bias_change_indexes)
+    
     def get_voltage_at_sample_index(self, sample_index):
-        voltage = None
+        '''Returns the bias that was set at sample_index. Samples before the
+        first bias change use the first bias.'''
+        i = np.searchsorted(self.bias_change_indexes, sample_index, side='right') - 1
         
-        for index, bias in self.voltage_data:
-            if sample_index <= index:
-                voltage = bias
+        return self.biases[max(i, 0)]
+    
+    def get_voltages_for_range(self, start, end):
+        '''Returns an array with the bias for every sample from start to end.
+        Only the bias changes inside the range are looked up, and each run of
+        samples between them is filled in one go.'''
+        if end <= start:
+            return np.zeros(0)
+        
+        indexes = self.bias_change_indexes
+        # The bias changes strictly inside the range
+        lo = np.searchsorted(indexes, start, side='right')
+        hi = np.searchsorted(indexes, end, side='left')
+        
+        segment_biases = self.biases[max(lo - 1, 0) : hi]
+        if lo == 0:
+            # The start of the range is before the first bias change
+            segment_biases = np.concatenate([self.biases[:1], segment_biases])
         
-        assert(voltage is not None)
-        return voltage
+        boundaries = np.concatenate([[start], indexes[lo:hi], [end]])
+        lengths = np.diff(boundaries)
+        
+        return np.repeat(segment_biases, lengths)
         
     def get_conductance_for_range(self, start, end):
-        voltages = [self.get_voltage_at_sample_index(index) for index in range(start, end)]
+        '''Returns the conductance (current / bias) for each sample from
+        start to end. Where the bias is 0 the conductance is undefined, so it
+        is reported as 0 instead of inf or nan.'''
         currents = self.sample_data[start : end]
         
         if len(currents) == 0:
-            return []
-
-        conductances = currents / voltages
+            return np.zeros(0)
+        
+        voltages = self.get_voltages_for_range(start, start + len(currents))
+        conductances = np.zeros(len(currents))
+        np.divide(currents, voltages, out=conductances, where=voltages != 0)
     
         return conductances
         
-    # Solves the memory leak but too slow
     def get_conductance_at_sample_index(self, index):
         voltage = self.get_voltage_at_sample_index(index)
         current = self.sample_data[index]
         
-        conductance = current / voltage
+        if voltage == 0:
+            return 0.0
         
-        return conductance
+        return current / voltage
         
-    # Fast but doesn't solve the memory leak. You can't store the conductance,
-    # it just breaks Python and causes a memory leak.
-#    @profile
-    def get_one_frame_conductance(self):    
+    def get_one_frame_conductance(self):
+        '''Appends the conductance for the present frame to the conductance
+        history. If the history doesn't end right before this frame (at the
+        start, or after jumping to a different place in the data), it is
+        refilled with the window before this frame first.'''
         start = self.samples_per_frame * self.latest_frame
         end = self.samples_per_frame * (self.latest_frame + 1)
         
-        voltages = [self.get_voltage_at_sample_index(index) for index in range(start, end)]
-        currents = self.sample_data[start : end]
-        
-        if len(currents) == 0:
+        if start >= len(self.sample_data):
             return
+        
+        if self.conductance.end_index != start:
+            history_start = max(0, start - self.conductance.capacity)
+            self.conductance.clear(history_start)
+            self.conductance.append(self.get_conductance_for_range(history_start, start))
+        
+        self.conductance.append(self.get_conductance_for_range(start, end))
 
-        conductances = currents / voltages
-
-        # This view creates a memory leak which we solve with copy
-        cc = np.concatenate([self.conductance, conductances])
+    def get_frame_samples(self, frame_index):
+        '''Returns the current or conductance for a frame, depending on which
+        signal spikes are detected in.'''
+        start = self.samples_per_frame * frame_index
+        end = self.samples_per_frame * (frame_index + 1)
         
-        self.conductance = cc.copy()
+        if self.use_conductance:
+            return self.get_conductance_window(start, end)
         
-        del cc
+        return self.sample_data[start : end]
+    
+    def before_detecting_frame(self, frame_index):
+        self.spike_detector.spike_threshold = self.get_spike_threshold(
+            self.use_conductance, frame_index)
 
-    # not the most efficient algorithm. And has a memory leak
-    def get_one_frame_conductance_slow(self):
-        start = self.samples_per_frame * self.latest_frame
-        end = self.samples_per_frame * (self.latest_frame + 1)
+    def get_conductance_window(self, start, end):
+        '''Returns the conductance from start to end, as a view of the
+        conductance history if it holds that window and calculated
+        otherwise.'''
+        h = self.conductance
+        if h.start_index <= start and end <= h.end_index:
+            return h.window(start, end)
+        
+        return self.get_conductance_for_range(start, end)
 
-        self.conductance = list(self.conductance)
+    def get_spike_threshold(self, conductance = False, frame_index = None):
+        '''Returns the jump between boxes that end_spike_exists() should
+        treat as a spike, at frame_index (or the present frame). For
+        conductance the current threshold is divided by the bias, so the same
+        jump in current counts either way.'''
+        if not conductance:
+            return Data.SPIKE_THRESHOLD
         
-        for index in range(start, end):
-            voltage = self.get_voltage_at_sample_index(index)
-            current = self.sample_data[index]
-            
-            conductance = current / voltage
-            
-            #logger.debug('current, voltage, conductance: %s, %s, %s', current, voltage, conductance)
-            
-            self.conductance.append(conductance)
+        if frame_index is None:
+            frame_index = self.latest_frame
         
-        # Must convert it into a Numpy array so later-used functions can use
-        # Numpy array methods.
-        self.conductance = np.asarray(self.conductance)
+        sample_index = self.samples_per_frame * frame_index
+        voltage = abs(self.get_voltage_at_sample_index(sample_index))
+        
+        if voltage == 0:
+            return math.inf
+        
+        return Data.SPIKE_THRESHOLD / voltage
     
-    def get_one_frame_joystick(self):
-        # If we are past the end of the data, the joystick isn't being used.
-        if self.latest_frame > len(self.sample_data):
-            return 65535
+    def set_joystick_data(self, joystick_data):
+        '''Stores the joystick updates from meta.json, a list of
+        [sample_index, controls] pairs, as parallel arrays sorted by sample
+        index so the state at any sample can be found by bisection.'''
+        self.joystick_data = joystick_data
+        
+        updates = np.array(joystick_data, dtype='int64').reshape(-1, 2)
+        order = np.argsort(updates[:, 0], kind='stable')
+        self.joystick_indexes = updates[order, 0]
+        self.joystick_values = updates[order, 1]
     
-        # First find the sample index, then use it to look up the most recent
-        # joystick update before that index.
-        samples_per_frame = 1667        
-        current_sample_index = samples_per_frame * self.latest_frame
+    def get_joystick_at_sample_indexes(self, sample_indexes):
+        '''Returns the joystick state at each of sample_indexes (a number or
+        an array of them), i.e. the most recent update at or before it.
         
-        #indexes = [update[0] for update in self.joystick_data]
+        The metadata doesn't specify an initial setting for the joystick.
+        65535 means no buttons pressed on either joystick. Some of the bits
+        are ignored and are supposed to be 0, but that's ok.'''
+        values = np.concatenate([[65535], self.joystick_values])
+        i = np.searchsorted(self.joystick_indexes, sample_indexes, side='right')
         
-        # The metadata doesn't specify an initial setting for the joystick.
-        # This setting means no buttons pressed on either joystick.
-        # Some of the bits are ignored and are supposed to be 0, but that's ok.
-        last_value = 65535
+        return values[i]
+    
+    def get_one_frame_joystick(self):
+        current_sample_index = self.samples_per_frame * self.latest_frame
         
-        if not hasattr(self, "joystick_data"):
+        # If we are past the end of the data, the joystick isn't being used.
+        if current_sample_index >= len(self.sample_data):
             return 65535
         
-        for index, controls in self.joystick_data:
-            if index > current_sample_index:
-                break
-            else:
-                last_value = controls
+        return int(self.get_joystick_at_sample_indexes(current_sample_index))
+    
+    def joystick_states_for_frames(self, start, end):
+        '''Returns an array with the joystick state at the start of each
+        frame from start up to end, for looking at the joystick history over
+        a long stretch in one call. Frames past the end of the data get
+        65535.'''
+        frames = np.arange(start, end)
+        sample_indexes = frames * self.samples_per_frame
+        
+        states = self.get_joystick_at_sample_indexes(sample_indexes)
+        states[sample_indexes >= len(self.sample_data)] = 65535
         
-        return last_value
+        return states
     
     def advance_frame(self):
         self.latest_frame += 1
@@ -548,7 +1234,7 @@ class PrerecordedData(Data):
             
             return cd
         else:
-            gd = self.get_conductance_for_range(start, end)
+            gd = self.get_conductance_window(start, end)
 
             return gd
         
@@ -565,7 +1251,7 @@ class PrerecordedData(Data):
         if not conductance:
             cd = self.sample_data[start : end]
         else:
-            gd = self.get_conductance_for_range(start, end)
+            gd = self.get_conductance_window(start, end)
 
             return gd
             
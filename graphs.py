@@ -3,8 +3,8 @@ import logging
 import pygame
 import time
 
-import util
 import constants
+from minmax_pyramid import MinMaxPyramid
 import data
 import colors
 import game_object
@@ -17,6 +17,45 @@ handler = logging.StreamHandler(sys.stdout)
 handler.formatter = logging.Formatter('%(asctime)s  %(name)s %(levelname)s: %(message)s')
 logger.addHandler(handler)
 
+def scale_to_pixels(values, low, range_, pixels, base = 0):
+    '''Maps an array of values to pixel positions on a graph. Each value v
+    becomes base - int((v - low) / range_ * pixels), so low is at base and
+    low + range_ is pixels further up. Returns an integer array.'''
+    offsets = np.trunc((np.asarray(values, dtype='float64') - low) / range_ * pixels)
+    
+    return (base - offsets).astype(int)
+
+def box_maxes_and_mins(samples, box_width, num_boxes):
+    '''Returns arrays of the max and min of each of the first num_boxes
+    boxes of box_width samples (or as many whole boxes as there are).'''
+    boxes = data.Data.reshape_into_boxes(np.asarray(samples), num_boxes, box_width)
+    
+    return (boxes.max(axis=1).astype('float64'), boxes.min(axis=1).astype('float64'))
+
+def make_static_layer(surface):
+    '''Returns a copy of a surface that's drawn many times without changing,
+    run-length encoded so blitting it skips the transparent pixels. It looks
+    the same, but a mostly transparent image like the torus blits about 10
+    times as fast.'''
+    layer = surface.copy()
+    colorkey = surface.get_colorkey()
+    if surface.get_flags() & pygame.SRCALPHA:
+        layer.set_alpha(255, pygame.RLEACCEL)
+    elif colorkey is not None:
+        layer.set_colorkey(colorkey, pygame.RLEACCEL)
+    
+    return layer
+
+ring_angle_tables = {}
+def get_ring_angle_table(num_boxes):
+    '''Returns arrays of the cosines and sines of the angles of the boxes on
+    a ring of num_boxes boxes. They're only calculated once for each size.'''
+    if num_boxes not in ring_angle_tables:
+        theta = np.radians(np.arange(num_boxes) * 360 / num_boxes)
+        ring_angle_tables[num_boxes] = (np.cos(theta), np.sin(theta))
+    
+    return ring_angle_tables[num_boxes]
+
 class VerticalLineRing:
     '''Draws a vertical-line based signal ring using sample data. It uses
     constants.NUM_BOXES to choose the number of vertical lines on the ring.'''
@@ -44,6 +83,15 @@ class VerticalLineRing:
     
         self.box_is_spike = [False] * constants.NUM_BOXES
         
+        # The brightness of each line goes from dark at the oldest to
+        # bright at the present
+        self.line_colors = []
+        for i in range(0, constants.NUM_BOXES):
+            brightness = int(255 * i / constants.NUM_BOXES)
+            self.line_colors.append((brightness, brightness, 0))
+        
+        (self.cosines, self.sines) = get_ring_angle_table(constants.NUM_BOXES)
+        
         self.amplifier_max = 20000
         self.amplifier_min = -20000
         
@@ -60,21 +108,31 @@ class VerticalLineRing:
         
         #min_ = self.amplifier_min #int(np.min(samples))
         #max_ = self.amplifier_max #int(np.max(samples))
-        min_ = int(np.min(samples))
-        max_ = int(np.max(samples))
+        self.give_maxes_and_mins(maxes, mins, int(np.min(samples)), int(np.max(samples)))
+
+        after = time.perf_counter()
+        #logger.debug('give_samples took %s seconds', after - before)
+
+    def give_maxes_and_mins(self, maxes, mins, min_ = None, max_ = None):
+        '''Sets the lines from the max and min of each box, as returned by
+        Data.calculate_maxes_and_mins(). The lines are scaled to fit from
+        min_ to max_, which default to the lowest min and highest max.'''
+        if min_ is None or max_ is None:
+            if not len(maxes):
+                return
+            
+            min_ = int(np.min(mins))
+            max_ = int(np.max(maxes))
         range_ = max_ - min_ + 1
         
         h = 2*self.line_extent
-        self.tops = np.array([- int((v - min_) / range_ * h) for v in maxes])
-        self.bottoms = np.array([- int((v - min_) / range_ * h) for v in mins])
+        self.tops = scale_to_pixels(maxes, min_, range_, h)
+        self.bottoms = scale_to_pixels(mins, min_, range_, h)
 
         #logger.debug('len(self.tops): %s', len(self.tops))
         #logger.debug('self.tops: %s', self.tops)
         #logger.debug('self.bottoms: %s', self.bottoms)        
 
-        after = time.perf_counter()
-        #logger.debug('give_samples took %s seconds', after - before)
-
     def advance_n_frames(self, n):
         # Remove the spikes from boxes that are being overwritten on the graph.
         for i in range(1, n + 1):
@@ -86,55 +144,56 @@ class VerticalLineRing:
 
     def draw(self):
         before = time.perf_counter()
-        # Draw the vertical lines
+        # Draw the vertical lines. The endpoints of all of them are
+        # calculated at once, and they're drawn straight onto the surface.
         num_lines = len(self.tops)
         data_start_box = (self.present_box - num_lines) % constants.NUM_BOXES
-        for i in range(0, num_lines):
-            brightness = int(255 * i / constants.NUM_BOXES)
-            color = (brightness, brightness, 0)
-            
-            index = (data_start_box + i) % constants.NUM_BOXES
-            if self.box_is_spike[index]:
+        boxes = (data_start_box + np.arange(num_lines)) % constants.NUM_BOXES
+        
+        inner_coords = self.get_ring_coords(boxes, self.tops).tolist()
+        outer_coords = self.get_ring_coords(boxes, self.bottoms).tolist()
+        
+        surface = self.screen.surface
+        line = pygame.draw.line
+        box_is_spike = self.box_is_spike
+        line_colors = self.line_colors
+        for i, box in enumerate(boxes.tolist()):
+            if box_is_spike[box]:
                 color = colors.WHITE
+            else:
+                color = line_colors[i]
             
-            top = self.tops[i]
-            bottom = self.bottoms[i]
-            
-            #print(num_lines)
-            #if top == self.bottoms[i]:
-            #    if num_lines == constants.NUM_BOXES:
-            #        import pdb; pdb.set_trace()
-            
-            angle = ((data_start_box + i) * 360 / constants.NUM_BOXES) % 360
-            self.draw_line(angle, top, bottom, color)
+            line(surface, color, inner_coords[i], outer_coords[i])
         
-        # Draw the red line at present_angle
-        self.draw_line(self.get_present_angle(), -2*self.line_extent, 0, colors.MEDIUM_RED)
+        # Draw the red line at present_box
+        self.draw_line(self.present_box, -2*self.line_extent, 0, colors.MEDIUM_RED)
         
         after = time.perf_counter()
         logger.debug('Drawing VLR took %s seconds', after - before)
         
     def get_present_angle(self):
         return self.present_box * 360 / constants.NUM_BOXES
+    
+    def get_ring_coords(self, boxes, offsets):
+        '''Returns an array of the screen coordinates (rounded to pixels) of
+        points at the angles of an array of boxes, offset from the ring by
+        an array of distances.'''
+        r = self.game.ring_radius + np.asarray(offsets)
+        
+        ga = self.game
+        WIDTH_TO_HEIGHT_RATIO = ga.ring_width / ga.ring_height
+        
+        x = WIDTH_TO_HEIGHT_RATIO * r * self.cosines[boxes] + constants.CENTER[0]
+        y = r * self.sines[boxes] + constants.CENTER[1]
         
-    def draw_line(self, theta, top, bottom, color):
-        # Calculate the coordinates for the inner end of the line
-        r = self.game.ring_radius + top
-        (inner_x, inner_y) = util.pol2cart(r, theta)
-        inner_coords = util.adjust_coords_ring(inner_x, inner_y)
-        
-        # Calculate the coordinates for the outer end of the line
-        r = self.game.ring_radius + bottom
-        (outer_x, outer_y) = util.pol2cart(r, theta)
-        outer_coords = util.adjust_coords_ring(outer_x, outer_y)
-        
-        # Finally draw the line. pygame.draw.line has a bug where it makes
-        # randomly horizontral or vertical lines.
-        #pygame.draw.line(self.screen.surface, color, inner_coords, outer_coords, width = 15)
-        self.screen.draw.line(inner_coords, outer_coords, color)
-        # For debugging
-        #pygame.draw.circle(self.screen.surface, 'white', inner_coords, 1)
-        #pygame.draw.circle(self.screen.surface, 'white', outer_coords, 1)
+        return np.rint(np.stack([x, y], axis=-1)).astype(int)
+        
+    def draw_line(self, box, top, bottom, color):
+        (inner_coords, outer_coords) = self.get_ring_coords([box, box], [top, bottom]).tolist()
+        
+        # pygame.draw.line has a bug where it makes randomly horizontral or
+        # vertical lines when they're wide.
+        pygame.draw.line(self.screen.surface, color, inner_coords, outer_coords)
 
     def add_spike(self):
         '''Sets the box represented by present_box to be a spike.'''
@@ -215,26 +274,17 @@ class SpikeGraph(CornerGraph):
             self.frame_size = 1667
             
     def set_frame(self, frame):
-        global logger
-        
         self.sample_index += self.frame_size
         
         w = self.width
         self.frame = frame
         box_width = self.frame_size // w
-        num_boxes = w
         
-        maxes = np.zeros(num_boxes)
-        mins = np.zeros(num_boxes)
+        (maxes, mins) = box_maxes_and_mins(frame, box_width, w)
         
-        #for i in range(0, box_width):
-        for i in range(0, num_boxes):
-            box_start = box_width * i
-            box_end = box_width * (i + 1)
-            values = frame[box_start : box_end]
-            
-            maxes[i] = values.max()
-            mins[i] = values.min()
+        # The frame is too short to fill the graph
+        if len(maxes) < w:
+            return
             
         max_ = maxes.max()
         min_ = mins.min()
@@ -245,8 +295,8 @@ class SpikeGraph(CornerGraph):
             return
         
         h = self.height
-        self.tops = np.array([h - int((v - min_) / range_ * h) for v in maxes])
-        self.bottoms = np.array([h - int((v - min_) / range_ * h) for v in mins])
+        self.tops = scale_to_pixels(maxes, min_, range_, h, h)
+        self.bottoms = scale_to_pixels(mins, min_, range_, h, h)
         
         #logger.info('tops: %s', self.tops)
         #logger.info('bottoms: %s', self.bottoms)
@@ -259,15 +309,14 @@ class SpikeGraph(CornerGraph):
         BOX = pygame.Rect(self.top_left, (self.width, self.height))
         self.screen.draw.filled_rect(BOX, 'black')
         
-        l = self.screen.draw.line
         # Draw the lines
-        for i in range(0, self.width):
-            (left, top) = self.top_left
-            x = left + i
-            y1 = self.tops[i] + top
-            y2 = self.bottoms[i] + top
-            
-            l((x, y1), (x, y2), 'red')
+        (left, top) = self.top_left
+        surface = self.screen.surface
+        line = pygame.draw.line
+        color = pygame.Color('red')
+        for x, y1, y2 in zip(range(left, left + self.width),
+                             (self.tops + top).tolist(), (self.bottoms + top).tolist()):
+            line(surface, color, (x, y1), (x, y2))
         
         if self.should_draw_axes:
             self.draw_axes()
@@ -290,7 +339,6 @@ class ContinuousGraph(CornerGraph):
         # ever shown at once.
         self.change_time_setting_continuous(10.0)
         self.frames_to_keep = 100 * self.lilith_fps 
-        self.last_frames = []
 
         self.top_left = (1484 + 10, 24 + 10)
         self.bottom_right = (1750 + 10, 214 + 10)
@@ -312,6 +360,20 @@ class ContinuousGraph(CornerGraph):
         else:
             self.frame_size = 1667
         
+        self.make_pyramid()
+    
+    def make_pyramid(self):
+        '''Makes the min/max summaries of the frames at several zoom levels,
+        so drawing the longest time setting is as quick as the shortest.
+        It has a column for each pixel of the graph's width.'''
+        self.pyramid = MinMaxPyramid(self.frames_to_keep * self.frame_size, self.width)
+    
+    def enlarge_on_left(self):
+        super().enlarge_on_left()
+        
+        # The frames so far are summarized for the smaller width
+        self.make_pyramid()
+        
     def change_time_setting_continuous(self, seconds):
         if seconds > 0 and seconds <= 100:
             self.time_setting = seconds
@@ -332,55 +394,32 @@ class ContinuousGraph(CornerGraph):
             self.n_frames = self.time_settings[index] * self.lilith_fps
     
     def set_frame(self, frame):
-        global logger
-        
         self.sample_index += self.frame_size
+        self.frame = frame
+        self.pyramid.append(frame)
         
-        # Add it to the end of last_six_frames
-        if len(self.last_frames) < self.frames_to_keep:
-            self.last_frames.append(frame)
-        else:
-            self.last_frames = self.last_frames[1:] + [frame]
-        
-        last_n_frames = self.last_frames[-self.n_frames:]
+        window = self.pyramid.window(self.frame_size * self.n_frames, self.width)
+        if window is None:
+            return
         
-        all_data = np.concatenate(last_n_frames)
+        mins, maxes, medians, means, mean_ = window
         
-        w = self.width
-        self.frame = frame
-        box_width = (self.frame_size * len(last_n_frames)) // w
-        num_boxes = w
-        
-        maxes = np.zeros(num_boxes)
-        mins = np.zeros(num_boxes)
-        medians = np.zeros(num_boxes)
-        
-        #for i in range(0, box_width):
-        for i in range(0, num_boxes):
-            box_start = box_width * i
-            box_end = box_width * (i + 1)
-            values = all_data[box_start : box_end]
-            
-            maxes[i] = values.max()
-            mins[i] = values.min()
-            medians[i] = np.median(values)
-            
         max_ = maxes.max()
         min_ = mins.min()
         range_ = max_ - min_
 
         h = self.height
         
-        mean_ = np.mean(all_data)
         vertical_center = h / 2
         
         # TODO HACK Why does this happen?!
         if range_ == 0:
             return
         
-        self.tops = np.array([vertical_center - int((v - mean_) / range_ * vertical_center * self.zoom_scale) for v in maxes])
-        self.bottoms = np.array([vertical_center - int((v - mean_) / range_ * vertical_center * self.zoom_scale) for v in mins])
-        self.middles = np.array([vertical_center - int((v - mean_) / range_ * vertical_center * self.zoom_scale) for v in medians])
+        pixels = vertical_center * self.zoom_scale
+        self.tops = scale_to_pixels(maxes, mean_, range_, pixels, vertical_center)
+        self.bottoms = scale_to_pixels(mins, mean_, range_, pixels, vertical_center)
+        self.middles = scale_to_pixels(medians, mean_, range_, pixels, vertical_center)
         
         # Handle zooming while making sure that lines don't go off the edge of the TV
         self.tops = np.maximum(0, np.minimum(h,  self.tops))
@@ -395,53 +434,54 @@ class ContinuousGraph(CornerGraph):
         BOX = pygame.Rect(self.top_left, (self.width, self.height))
         self.screen.draw.filled_rect(BOX, 'black')
         
-        l = self.screen.draw.line
         # Draw the lines
-        for i in range(0, self.width):
-            (left, top) = self.top_left
-            
+        (left, top) = self.top_left
+        surface = self.screen.surface
+        line = pygame.draw.line
+        green = pygame.Color('green')
+        black = pygame.Color('black')
+        middles = (self.middles + top).tolist()
+        for x, y1, y2, my in zip(range(left, left + self.width), (self.tops + top).tolist(),
+                                 (self.bottoms + top).tolist(), middles):
             # Draw the main vertical line
-            x = left + i
-            y1 = self.tops[i] + top
-            y2 = self.bottoms[i] + top
-            
-            l((x, y1), (x, y2), 'green')
+            line(surface, green, (x, y1), (x, y2))
             
             # Draw the median line in the middle of it
-            my1 = self.middles[i] + 2 + top
-            my2 = self.middles[i] - 2 + top
-            
-            l((x, my1), (x, my2), 'black')
-            
-            #print(y1, y2, my1, my2)
+            line(surface, black, (x, my + 2), (x, my - 2))
         
         if self.should_draw_axes:
             self.draw_axes()
 
 class ScatterPlot:
+    '''A scatter plot of the spikes in DataView.
+
+    The points are drawn onto a surface that's kept between frames, so each
+    frame only draws the points added since the last one. The whole surface
+    is only redrawn when the axes change because a point is outside them.
+    Once there are more than DENSITY_THRESHOLD points it shows how many
+    points are at each pixel instead (brighter is more), which costs the
+    same however many points there are.'''
+    DENSITY_THRESHOLD = 10000
+    
     def __init__(self, screen, x_label, y_label, use_test_data = False):
         self.screen = screen
         
         self.x_label = x_label
         self.y_label = y_label
     
-        self.datapoints = []
-
-        self.min_x = None
-        self.min_y = None
-        self.max_x = None
-        self.max_y = None
+        self.set_position(0)
+        
+        self.width = self.bottom_right[0] - self.top_left[0]
+        self.height = self.bottom_right[1] - self.top_left[1]
+        
+        self.surface = None
+        self.clear()
         
         if use_test_data:
             self.add_datapoint((1000, 3))
             self.add_datapoint((500, 2))
             self.add_datapoint((500, 10))
 
-        self.set_position(0)
-        
-        self.width = self.bottom_right[0] - self.top_left[0]
-        self.height = self.bottom_right[1] - self.top_left[1]
-
     def set_position(self, index):
         '''Sets the position on a grid, from 0 to 2.'''
         position_1 = ((882, 66), (1354, 400))
@@ -451,46 +491,126 @@ class ScatterPlot:
         
         self.top_left, self.bottom_right = positions[index]
 
+    def clear(self):
+        self._xs = np.zeros(1024)
+        self._ys = np.zeros(1024)
+        self._num_points = 0
+        
+        self.min_x = None
+        self.min_y = None
+        self.max_x = None
+        self.max_y = None
+        
+        # The points that are on the surface, and the axes they were drawn with
+        self._num_drawn = 0
+        self._drawn_bounds = None
+        # The number of points at each pixel, in density mode
+        self._counts = None
+
+    def __len__(self):
+        return self._num_points
+
+    @property
+    def datapoints(self):
+        '''A list of the (x, y) points.'''
+        return list(zip(self._xs[:self._num_points].tolist(), self._ys[:self._num_points].tolist()))
+
     def add_datapoint(self, datapoint):
         x, y = datapoint
-        if len(self.datapoints) == 0:
-            self.min_x = x
-            self.max_x = x
-            self.min_y = y
-            self.max_y = y
-        else:
-            if x < self.min_x:
-                self.min_x = x
-            if x > self.max_x:
-                self.max_x = x
-            if y < self.min_y:
-                self.min_y = y
-            if y > self.max_y:
-                self.max_y = y
+        self.add_datapoints([x], [y])
 
-        self.datapoints.append(datapoint)
+    def add_datapoints(self, xs, ys):
+        '''Adds the points with x coordinates xs and y coordinates ys.'''
+        xs = np.asarray(xs, dtype='float64')
+        ys = np.asarray(ys, dtype='float64')
+        if len(xs) == 0:
+            return
+        
+        start = self._num_points
+        end = start + len(xs)
+        if end > len(self._xs):
+            size = max(2 * len(self._xs), end)
+            self._xs = np.concatenate([self._xs[:start], np.zeros(size - start)])
+            self._ys = np.concatenate([self._ys[:start], np.zeros(size - start)])
+        
+        self._xs[start : end] = xs
+        self._ys[start : end] = ys
+        self._num_points = end
+        
+        if start == 0:
+            self.min_x = xs.min()
+            self.max_x = xs.max()
+            self.min_y = ys.min()
+            self.max_y = ys.max()
+        else:
+            self.min_x = min(self.min_x, xs.min())
+            self.max_x = max(self.max_x, xs.max())
+            self.min_y = min(self.min_y, ys.min())
+            self.max_y = max(self.max_y, ys.max())
+
+    def to_pixels(self, start, end):
+        '''Returns arrays of the x and y pixels on the surface of the points
+        from start to end.'''
+        data_width = self.max_x - self.min_x + 1
+        data_height = self.max_y - self.min_y + 1
+        
+        xs = (self._xs[start : end] - self.min_x) / data_width * self.width
+        ys = self.height - (self._ys[start : end] - self.min_y) / data_height * self.height
+        
+        return (np.clip(xs.astype(int), 0, self.width - 1),
+                np.clip(ys.astype(int), 0, self.height - 1))
 
-    def draw(self):    
-        BOX = pygame.Rect(self.top_left, (self.width, self.height))
-        self.screen.draw.filled_rect(BOX, 'black')
+    def update_surface(self):
+        '''Draws the points that aren't on the surface yet, or redraws all
+        of them if the axes have changed.'''
+        bounds = (self.min_x, self.max_x, self.min_y, self.max_y)
+        density = self._num_points > self.DENSITY_THRESHOLD
+        
+        if self.surface is None:
+            self.surface = pygame.Surface((self.width, self.height))
         
-        if len(self.datapoints) < 1:
+        if bounds != self._drawn_bounds or density != (self._counts is not None):
+            self.surface.fill('black')
+            self._counts = np.zeros((self.width, self.height), dtype='int64') if density else None
+            self._num_drawn = 0
+            self._drawn_bounds = bounds
+        
+        if self._num_drawn == self._num_points:
             return
         
-        self.draw_axes()
-        self.draw_axis_labels()
+        xs, ys = self.to_pixels(self._num_drawn, self._num_points)
+        self._num_drawn = self._num_points
         
-        left, top =  self.top_left
-        right, bottom = self.bottom_right
+        if density:
+            np.add.at(self._counts, (xs, ys), 1)
+            self.draw_density()
+        else:
+            circle = pygame.draw.circle
+            green = pygame.Color('green')
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                circle(self.surface, green, (x, y), 1)
+
+    def draw_density(self):
+        '''Draws the counts on the surface, with the brightness of each pixel
+        going up with the log of the number of points there.'''
+        brightness = np.log1p(self._counts)
+        brightness *= 175 / brightness.max()
         
-        data_width = self.max_x - self.min_x + 1
-        data_height = self.max_y - self.min_y + 1
+        pixels = np.zeros((self.width, self.height, 3), dtype='uint8')
+        pixels[:, :, 1] = np.where(self._counts > 0, 80 + brightness, 0)
+        pygame.surfarray.blit_array(self.surface, pixels)
+
+    def draw(self):    
+        if self._num_points < 1:
+            BOX = pygame.Rect(self.top_left, (self.width, self.height))
+            self.screen.draw.filled_rect(BOX, 'black')
+            return
         
-        for x, y in self.datapoints:
-            x_screen = (x - self.min_x) / data_width * self.width + left
-            y_screen = (y - self.min_y) / data_height * -self.height + bottom
-            
-            self.screen.draw.filled_circle((x_screen, y_screen), 1, 'green')
+        self.update_surface()
+        self.screen.blit(self.surface, self.top_left)
+        
+        self.draw_axes()
+        self.draw_axis_labels()
         
     def draw_axes(self):
         '''Draw the x and y axes.'''
@@ -504,11 +624,11 @@ class ScatterPlot:
         coords = (self.top_left[0] - 50, self.bottom_right[1] - 25)
         self.screen.draw.text(text, coords)
         
-        text = str(self.min_x)
+        text = f'{self.min_x:g}'
         coords = (self.top_left[0], self.bottom_right[1])
         self.screen.draw.text(text, coords)
         
-        text = str(self.max_x)
+        text = f'{self.max_x:g}'
         coords = (self.bottom_right[0], self.bottom_right[1])
         self.screen.draw.text(text, coords)
 
@@ -586,17 +706,17 @@ def draw_graph(i, d, graph_type, screen, STANDALONE):
             rect = Rect((10 + 300.0 / constants.NUM_BOXES * x, y_coord), (3, 1))
             screen.draw.filled_rect(rect, color)
 
+# The torus scaled to its size, as a static layer
 torus_image = None
 def draw_torus(screen, images):
     global torus_image
     ga = game_object.game
-    if not torus_image:
+    scale = (ga.torus_outer_width, ga.torus_outer_height)
+    if not torus_image or torus_image.get_size() != scale:
         #image_width = 629
         #image_height = 470
-        scale = (ga.torus_outer_width, ga.torus_outer_height)
-        
         surf = images.torus
-        torus_image = pygame.transform.scale(surf, scale)
+        torus_image = make_static_layer(pygame.transform.scale(surf, scale))
         
     left = constants.CENTER[0] - ga.torus_outer_width // 2
     top = constants.CENTER[1] - ga.torus_outer_height // 2
@@ -55,7 +55,7 @@ INDEX = 4
 metadata = {}
 pressed = []
 channel = 0
-q = queue.Queue()
+q = None # A SampleQueue, made by setup_queue() below
 state_q = queue.Queue()
 ws = None
 ws_connected = False
@@ -190,6 +190,9 @@ class SampleData:
     '''self.start is equivalent to a uint64. It's broken into start_high for the high bits
     and start_low for the low bits.'''
     def __init__(self, message):
+        # For metrics.LiveMetrics
+        self.received_at = time.perf_counter()
+        
         format_string = '!HHIII'
         s = struct.Struct(format_string)
         u = s.unpack(message[0:16])
@@ -251,21 +254,96 @@ def consume_samples():
         
         time.sleep(1.0 / 60.0)
 
-def consume_latest_samples(q):
+def consume_latest_samples(q, max_items = None):
     '''A non-blocking function that returns a list of any SampleData/
     JoystickData/StatusData objects that are on the queue (and removes them 
-    from the queue).'''
+    from the queue). If max_items is given, it takes at most that many and
+    leaves the rest for next time.'''
     sd_list = []
 
-    while True:
+    while max_items is None or len(sd_list) < max_items:
         try:
             sample_data = q.get(False)
             sd_list.append(sample_data)  
             # If `False`, the program is not blocked. `Queue.Empty` is thrown if 
             # the queue is empty
         except queue.Empty:
-            return sd_list
+            break
+    
+    return sd_list
+
+class SampleQueue(queue.Queue):
+    '''The queue of messages from Lilith, which the game empties every
+    frame. If maxsize is more than 0, policy says what to do when it's full
+    and another message arrives:
+
+        block           wait for the game to take a message, which holds up
+                        receiving from the websocket (and so Lilith)
+        drop-oldest     drop the oldest message
+        coalesce        add the samples onto the newest SampleData if they
+                        follow straight on from it and it would have no
+                        more than max_coalesced_samples, so no samples are
+                        lost but the game has fewer messages to process;
+                        otherwise drop the oldest message
+
+    dropped and coalesced count the messages that were dropped or added
+    onto another one.'''
+    POLICIES = ['block', 'drop-oldest', 'coalesce']
+    
+    # A second of samples
+    MAX_COALESCED_SAMPLES = 20 * constants.LIVE_SAMPLES_PER_MESSAGE
     
+    def __init__(self, maxsize = 0, policy = 'block', max_coalesced_samples = MAX_COALESCED_SAMPLES):
+        if policy not in self.POLICIES:
+            raise ValueError(f'Unknown queue policy: {policy}')
+        
+        super().__init__(maxsize)
+        self.policy = policy
+        self.max_coalesced_samples = max_coalesced_samples
+        self.dropped = 0
+        self.coalesced = 0
+    
+    def put(self, item, block = True, timeout = None):
+        if self.policy == 'block' or self.maxsize <= 0:
+            return super().put(item, block, timeout)
+        
+        with self.not_full:
+            if self._qsize() >= self.maxsize:
+                if self.policy == 'coalesce' and self._coalesce(item):
+                    return
+                
+                self.queue.popleft()
+                self.dropped += 1
+            
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+    
+    def _coalesce(self, item):
+        '''Adds item's samples onto the newest message if they follow on
+        from it and there's room. Returns whether it did.'''
+        newest = self.queue[-1]
+        if not (isinstance(item, SampleData) and isinstance(newest, SampleData)):
+            return False
+        if newest.start + len(newest.samples) != item.start:
+            return False
+        if len(newest.samples) + len(item.samples) > self.max_coalesced_samples:
+            return False
+        
+        newest.samples = np.concatenate([newest.samples, item.samples])
+        newest.sample_count = len(newest.samples)
+        newest.end = item.end
+        self.coalesced += 1
+        
+        return True
+
+def setup_queue(maxsize = 0, policy = 'block'):
+    '''Makes the queue of messages from Lilith. Call it before main().'''
+    global q
+    q = SampleQueue(maxsize, policy)
+
+setup_queue()
+
 
 def get_metadata(key, ws):
     format_string = '!HH' + ('s' * len(key))
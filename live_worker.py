@@ -0,0 +1,169 @@
+'''Live spike detection, either on the game's thread or in a DetectionWorker
+thread (maxine.py --detection-thread).
+
+Each time the live data is processed the results are put in a LiveSummary,
+along with everything the game draws from the signal (already reduced to
+what's drawn) and the joystick state. With the worker, the game only takes
+the finished summaries each frame, so a slow frame doesn't hold up the
+detection and a burst of packets doesn't hold up the frame.'''
+import collections
+import logging
+import queue
+import threading
+import time
+
+import constants
+import data
+import lilith_client
+
+logger = logging.getLogger(__name__)
+
+# The number of recent samples summarized for the graphs: the 5 seconds the
+# VerticalLineRing shows, which includes the second for the RMS
+HISTORY_SAMPLES = max(20 * 5 * constants.LIVE_SAMPLES_PER_MESSAGE, constants.SAMPLE_RATE)
+
+class LiveSummary:
+    '''What the game needs from one or more batches of live packets.'''
+    def __init__(self, spikes = 0, completed_spikes = None, received_frames = None,
+                 recent_frames_contain_spikes = None, frame = None, packets = None,
+                 queue_depth = 0, maxes_mins = None, rms_last_second = None, pressed = None):
+        # The number of frames with spikes
+        self.spikes = spikes
+        # The Spikes found by the spike detector, for the catalog
+        self.completed_spikes = completed_spikes or []
+        # The samples of each frame received, in the order they arrived
+        self.received_frames = received_frames or []
+        # Whether each frame received has a spike
+        self.recent_frames_contain_spikes = recent_frames_contain_spikes or []
+        # The samples of the latest frame (a copy), or None
+        self.frame = frame
+        # The SampleData packets, with their timestamps for metrics.LiveMetrics
+        self.packets = packets or []
+        # The most messages that were waiting on the queue when it was
+        # read, including ones left for later by max_packets
+        self.queue_depth = queue_depth
+        # The max and min of each frame of the last HISTORY_SAMPLES samples
+        # by absolute index (with 0s for the frames that haven't arrived),
+        # from Data.calculate_maxes_and_mins(), or None
+        self.maxes_mins = maxes_mins
+        # The RMS of the last second of those samples, or None
+        self.rms_last_second = rms_last_second
+        # The joystick switches pressed, or None if there was no joystick
+        # message
+        self.pressed = pressed
+
+def summarize_packets(live_data, d_list = None, max_packets = None, queue_depth = None):
+    '''Processes the messages in d_list (or up to max_packets of the ones
+    waiting on lilith_client.q) with live_data and runs the spike detector.
+    queue_depth is the number of messages that were waiting on the queue
+    when d_list was taken off it, which defaults to len(d_list). Returns a
+    LiveSummary.'''
+    if d_list is None:
+        queue_depth = lilith_client.q.qsize()
+        d_list = lilith_client.consume_latest_samples(lilith_client.q, max_packets)
+    if queue_depth is None:
+        queue_depth = len(d_list)
+    
+    packets = [m for m in d_list if isinstance(m, lilith_client.SampleData)]
+    now = time.perf_counter()
+    for packet in packets:
+        packet.dequeued_at = now
+    
+    spikes = live_data.load_received_samples_and_count_spikes(d_list)
+    completed_spikes = live_data.detect_spikes()
+    
+    pressed = None
+    joystick = [m for m in d_list if isinstance(m, lilith_client.JoystickData)]
+    if joystick:
+        pressed = list(joystick[-1].pressed)
+    
+    now = time.perf_counter()
+    for packet in packets:
+        packet.detected_at = now
+
+    frame = live_data.get_frame()
+    maxes_mins = rms_last_second = None
+    if frame is not None:
+        # It's a view of the ring, which the next packet can overwrite
+        frame = frame.copy()
+        
+        # The graphs are drawn from these, so the game never reads the ring
+        recent_samples = live_data.get_last_n_samples(HISTORY_SAMPLES)
+        maxes_mins = data.Data.calculate_maxes_and_mins(recent_samples,
+                                                        constants.LIVE_SAMPLES_PER_MESSAGE)
+        rms_last_second = data.Data.rms(recent_samples[-constants.SAMPLE_RATE:])
+
+    return LiveSummary(spikes, completed_spikes, live_data.get_received_frames(),
+                       live_data.get_recent_frames_contain_spikes(), frame, packets, queue_depth,
+                       maxes_mins, rms_last_second, pressed)
+
+def combine_summaries(summaries):
+    '''Returns one LiveSummary for a list of them in the order they were
+    made.'''
+    combined = LiveSummary()
+    for summary in summaries:
+        combined.spikes += summary.spikes
+        combined.completed_spikes += summary.completed_spikes
+        combined.received_frames += summary.received_frames
+        combined.recent_frames_contain_spikes += summary.recent_frames_contain_spikes
+        if summary.frame is not None:
+            combined.frame = summary.frame
+        if summary.maxes_mins is not None:
+            combined.maxes_mins = summary.maxes_mins
+            combined.rms_last_second = summary.rms_last_second
+        if summary.pressed is not None:
+            combined.pressed = summary.pressed
+        combined.packets += summary.packets
+        combined.queue_depth = max(combined.queue_depth, summary.queue_depth)
+
+    return combined
+
+class DetectionWorker:
+    '''Processes the live packets in a background thread as they arrive.
+    Only this thread uses live_data after start() is called.
+
+    The summaries are handed to the game through a deque, which the worker
+    appends to and take_summaries() pops from, so neither side waits for a
+    lock held by the other.'''
+    def __init__(self, live_data, packet_queue = None, max_packets = None):
+        self.live_data = live_data
+        self.packet_queue = lilith_client.q if packet_queue is None else packet_queue
+        # The most packets to process at once
+        self.max_packets = max_packets
+        self._summaries = collections.deque()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            # Wait for a packet, then take the rest that have arrived
+            try:
+                first = self.packet_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # Including the one just taken off it
+            queue_depth = 1 + self.packet_queue.qsize()
+            max_items = None if self.max_packets is None else self.max_packets - 1
+            d_list = [first] + lilith_client.consume_latest_samples(self.packet_queue, max_items)
+            try:
+                self._summaries.append(summarize_packets(self.live_data, d_list,
+                                                         queue_depth = queue_depth))
+            except Exception:
+                logger.exception('Live spike detection failed')
+
+    def take_summaries(self):
+        '''Returns the summaries made since the last call, oldest first.'''
+        summaries = []
+        while True:
+            try:
+                summaries.append(self._summaries.popleft())
+            except IndexError:
+                return summaries
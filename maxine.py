@@ -26,7 +26,11 @@ import components
 import game_object
 import controls_object
 import world_map
-import spike_object
+import spike_writer
+import spike_index
+import live_worker
+import metrics
+from ring_buffer import RingBuffer
 
 # Set up logger for this module
 logger = logging.getLogger('maxine')
@@ -55,6 +59,17 @@ playing_music = False
 '''Vertical Line Ring'''
 vlr = None
 
+# The recent samples of the prerecorded signal shown on the graphs. It's a
+# RingBuffer, so the graphs all read views of the same samples instead of
+# each keeping or rebuilding their own copies. Live data comes with its
+# recent samples in each live_worker.LiveSummary.
+signal_history = None
+# The prerecorded frame that's at the end of signal_history
+signal_history_frame = None
+# The joystick switches pressed in live mode, from the latest
+# live_worker.LiveSummary that had them
+live_pressed = []
+
 # Temporary development tool
 dev_control = None
 
@@ -123,6 +138,13 @@ skirt = Actor('skirt')
 skirt.center = (WIDTH/2, HEIGHT-38)
 
 def draw():
+    draw_frame()
+    
+    if METRICS is not None:
+        METRICS.draw(screen)
+        METRICS.frame_drawn()
+
+def draw_frame():
     global rotation, dev_control
     global challenger_image, console_image
     global game, lwm, maze
@@ -257,16 +279,27 @@ def draw_dataview():
         
     controls.draw_dataview()
 
+living_background = None
 def draw_living_background():
-    global step_count
+    '''Draws the scrolling tiled background. The tiles are put together on
+    one surface the first time, so each frame is one blit instead of one per
+    tile.'''
+    global step_count, living_background
     
     tile_size = 144
     
+    if living_background is None:
+        tile = images.background_living_tissue
+        columns = len(range(-tile_size, WIDTH, tile_size))
+        rows = len(range(-tile_size, HEIGHT, tile_size))
+        living_background = pygame.Surface((columns * tile_size, rows * tile_size)).convert()
+        for x in range(0, columns * tile_size, tile_size):
+            for y in range(0, rows * tile_size, tile_size):
+                living_background.blit(tile, (x, y))
+    
     offset = step_count % tile_size
-
-    for x in range(-tile_size, WIDTH, tile_size):
-        for y in range(-tile_size, HEIGHT, tile_size):
-            screen.blit('background_living_tissue', (x + offset, y + offset))
+    
+    screen.blit(living_background, (offset - tile_size, offset - tile_size))
 
 def draw_metal_background():
     surface = getattr(images, 'bg_cut')
@@ -301,7 +334,8 @@ def update():
     global i, step_count, d, space_pressed_before, button_pressed_before
     global logger
     global playing_music
-    global sg, cg, vlr
+    global sg, cg, vlr, signal_history, signal_history_frame
+    global live_pressed
     global controls
     global data_number
     global game
@@ -330,6 +364,11 @@ def update():
             vlr = graphs.VerticalLineRing(screen, game, LIVE, 20 * 5)
         else:
             vlr = graphs.VerticalLineRing(screen, game, LIVE, constants.NUM_BOXES)
+            
+            # Also keep a second of samples for the RMS. The conductance
+            # already has a history in d.
+            if not CONDUCTANCE:
+                signal_history = RingBuffer(max(vlr.samples_to_show, 100000))
     
     if not controls:
         controls = controls_object.Controls(
@@ -346,24 +385,39 @@ def update():
     # If we're in STANDALONE mode, a timer will make the monster appear.
     if DATADIR:
         d.get_one_frame_current()
-        #d.get_one_frame_conductance()
+        if CONDUCTANCE:
+            d.get_one_frame_conductance()
 
         last_second = d.get_last_n_samples(100000)
         game.rms_last_second = data.Data.rms(last_second)
 
-        frame = d.get_frame(conductance = False)
-                
-        last_n_samples = d.get_last_n_samples(1667*constants.NUM_BOXES, conductance = False)
+        # The graphs and spike detection use either the current or the
+        # conductance (current / bias) signal.
+        frame = d.get_frame(conductance = CONDUCTANCE)
+        
+        if CONDUCTANCE:
+            # get_one_frame_conductance() keeps it up to date
+            history = d.conductance
+        else:
+            if signal_history_frame is not None and d.latest_frame == signal_history_frame + 1:
+                signal_history.append(frame)
+            else:
+                # At the start, or after jumping, fill it from the data
+                signal_history.clear()
+                signal_history.append(d.get_last_n_samples(signal_history.capacity))
+            signal_history_frame = d.latest_frame
+            history = signal_history
+        
+        last_n_samples = history.last(vlr.samples_to_show)
         vlr.give_samples(last_n_samples)
 
-        maxes_mins = data.Data.calculate_maxes_and_mins(last_n_samples, 1667)
-        sudden_change = data.Data.end_spike_exists(maxes_mins)
-        deviation_from_mean = data.Data.statistical_end_spike_exists(last_n_samples, constants.NUM_BOXES)
-        
-        spike_exists = sudden_change and deviation_from_mean
+        # The spike detector chosen with --detector decides whether this
+        # frame is a spike, and finds the spikes for the catalog.
+        add_spikes_to_catalog(d.detect_spikes())
+        spike_exists = d.frame_triggered
         
         if spike_exists:
-            controls.sg.set_frame(frame)
+            controls.sg.set_frame(history.last(len(frame)))
         
         # The length of the frame must be 1667. At the end of the data it will
         # be less, so we skip the last partial frame.
@@ -372,11 +426,11 @@ def update():
         if frame is not None and len(frame) == 1667:
             controls.cg.set_frame(frame)
         else:
-            # Save the spike statistics to an ARFF file at the end of
-            # prerecorded data.
-            if not spike_object.spikes.get_has_saved():
-                spike_object.spikes.save_separate_spikes_as_arff(d.get_data_dir())
-                logger.info('Saved ARFF file if we have spikes.')
+            # Finish the spike catalog files at the end of prerecorded data.
+            if SPIKE_WRITER is not None and not SPIKE_WRITER.closed:
+                add_spikes_to_catalog(d.finish_spike_detection())
+                SPIKE_WRITER.close()
+                logger.info('Saved the spike catalog in %s', d.get_data_dir())
         
         if spike_exists:
             vlr.add_spike()
@@ -385,6 +439,7 @@ def update():
         vlr.advance_n_frames(1)
         
         if playing_music:
+            maxes_mins = data.Data.calculate_maxes_and_mins(last_n_samples, 1667)
             #music_ops.current_to_frequency(frame)
             #music_ops.current_to_volume(frame)
             music_ops.stats_to_frequency(maxes_mins)
@@ -394,31 +449,33 @@ def update():
         if PLAYER == 'maxine' and spike_exists and not DATAVIEW:
             angle = vlr.get_present_angle()
             add_cell(angle)
-            
-        if spike_exists:
-            spikes = data.Data.find_spikes_in_last_frame(last_n_samples, len(last_n_samples)//1667)
-            
-            for spike in spikes:
-                spike_object.spikes.add_spike(spike)
-                
-                datapoint = (spike.duration(), spike.peak())
-                controls.sp0.add_datapoint(datapoint)
-                
-                K = spike.kurtosis()
-                if not math.isnan(K):
-                    datapoint = (spike.duration(), K)
-                    controls.sp1.add_datapoint(datapoint)
 
     elif LIVE:
         MONSTERS_PER_SPIKE = 1
         #lilith_client.request_data(lilith_client.ws, 1)
     
-        spikes = d.load_received_samples_and_count_spikes()
-    
-        last_second = d.get_last_n_frames(100000 // constants.LIVE_SAMPLES_PER_MESSAGE)
-        game.rms_last_second = data.Data.rms(last_second)
+        # With --detection-thread the packets have already been processed
+        if DETECTION_WORKER is not None:
+            summary = live_worker.combine_summaries(DETECTION_WORKER.take_summaries())
+        else:
+            summary = live_worker.summarize_packets(d, max_packets = args.max_packets)
+        
+        spikes = summary.spikes
+        add_spikes_to_catalog(summary.completed_spikes)
+        
+        if METRICS is not None:
+            METRICS.add_packets(summary.packets, summary.queue_depth)
+        
+        # The summary has the graphs and the RMS worked out already, from
+        # the samples by absolute index, so frames that arrive late or not
+        # at all don't shift them
+        if summary.rms_last_second is not None:
+            game.rms_last_second = summary.rms_last_second
+        
+        if summary.pressed is not None:
+            live_pressed = summary.pressed
 
-        frame = d.get_frame()
+        frame = summary.frame
         
         if spikes > 0:
             controls.sg.set_frame(frame)
@@ -432,19 +489,19 @@ def update():
                 add_cell(angle)
                 
         # 5 seconds at 20 FPS
-        last_n_samples = d.get_last_n_frames(20 * 5)
-        vlr.give_samples(last_n_samples)
+        if summary.maxes_mins is not None:
+            vlr.give_maxes_and_mins(*summary.maxes_mins)
         
         data_number += spikes
         
-        booleans = d.get_recent_frames_contain_spikes()
+        booleans = summary.recent_frames_contain_spikes
         for b in booleans:
             vlr.advance_n_frames(1)
             if b:
                 vlr.add_spike()
         
-        if playing_music:
-            maxes_mins = data.Data.calculate_maxes_and_mins(last_n_samples, constants.LIVE_SAMPLES_PER_MESSAGE)
+        if playing_music and summary.maxes_mins is not None:
+            maxes_mins = summary.maxes_mins
             #music_ops.current_to_frequency(frame)
             #music_ops.current_to_volume(frame)
             music_ops.stats_to_frequency(maxes_mins)
@@ -489,6 +546,79 @@ def update():
             game.load_arena_from_dict(wrapper)
             logger.debug('loaded arena state from the internet')
 
+# The start indexes of the recent spikes in the catalog, so the spikes found
+# again when the spike detector starts again (e.g. after jumping back with
+# PAGEUP) aren't added twice
+catalogued_spikes = set()
+def add_spikes_to_catalog(spikes):
+    '''Writes the spikes found by the spike detector to the catalog files
+    and adds them to the DataView scatter plots (unless they already show
+    every spike from the spike index). Spikes that are already in the
+    catalog are skipped.'''
+    global catalogued_spikes
+    
+    show_spike_index()
+    
+    # Forget the spikes that are too old for the detector to find again
+    oldest = d.detection_start_frame() * d.samples_per_frame
+    if any(start_index < oldest for start_index in catalogued_spikes):
+        catalogued_spikes = {i for i in catalogued_spikes if i >= oldest}
+    
+    for spike in spikes:
+        if spike.start_index is not None:
+            if spike.start_index in catalogued_spikes:
+                continue
+            catalogued_spikes.add(spike.start_index)
+        
+        if SPIKE_WRITER is not None:
+            SPIKE_WRITER.add_spike(spike)
+        
+        if spike_index_shown:
+            continue
+        
+        datapoint = (spike.duration(), spike.peak())
+        controls.sp0.add_datapoint(datapoint)
+        
+        K = spike.kurtosis()
+        if not math.isnan(K):
+            datapoint = (spike.duration(), K)
+            controls.sp1.add_datapoint(datapoint)
+
+spike_index_shown = False
+def show_spike_index():
+    '''Once the spike index for the prerecorded data is ready, replaces the
+    spikes in the DataView scatter plots with every spike in the recording.'''
+    global spike_index_shown
+    
+    if spike_index_shown or SPIKE_INDEX_LOADER is None or SPIKE_INDEX_LOADER.index is None:
+        return
+    
+    records = SPIKE_INDEX_LOADER.index.records
+    controls.sp0.clear()
+    controls.sp1.clear()
+    controls.sp0.add_datapoints(records['duration'], records['peak'])
+    has_kurtosis = ~np.isnan(records['kurtosis'])
+    controls.sp1.add_datapoints(records['duration'][has_kurtosis], records['kurtosis'][has_kurtosis])
+    
+    spike_index_shown = True
+
+def jump_to_spike(direction):
+    '''Moves the prerecorded data to the next spike (if direction is 1) or
+    the previous one (if it's -1), using the spike index.'''
+    if SPIKE_INDEX_LOADER is None or SPIKE_INDEX_LOADER.index is None:
+        return
+    
+    index = SPIKE_INDEX_LOADER.index
+    spf = d.samples_per_frame
+    if direction > 0:
+        record = index.next_spike(spf * (d.latest_frame + 1))
+    else:
+        record = index.previous_spike(spf * d.latest_frame)
+    
+    if record is not None:
+        d.latest_frame = int(record['start_index']) // spf
+        logger.info('Jumped to the spike at sample %s', record['start_index'])
+
 pressed_before = set()
 def update_for_console_player():
     '''Allows the console player to use either the joystick or the keyboard
@@ -499,7 +629,7 @@ def update_for_console_player():
 
     # Determine the list of pressed joystick switches
     if LIVE:
-        pressed = d.pressed
+        pressed = live_pressed
     elif DATADIR:
         joystick_binary = d.get_one_frame_joystick()
         pressed = util.process_joystick_data(joystick_binary)
@@ -976,6 +1106,16 @@ def on_key_down(key):
     # Temporary hack so you can test out levels more easily
     if key == keys.N:
         finished_level()
+    
+    # Show the live data timing
+    if key == keys.I and METRICS is not None:
+        METRICS.show_overlay = not METRICS.show_overlay
+    
+    # Jump between the spikes in prerecorded data
+    if key == keys.PAGEDOWN:
+        jump_to_spike(1)
+    if key == keys.PAGEUP:
+        jump_to_spike(-1)
 
     # Move maxine around a grid (maze)
     if hasattr(game.maxine, 'gridnav'):
@@ -1437,6 +1577,22 @@ if args.level:
 
 DATAVIEW = args.dataview
 
+# Conductance is calculated from the bias history in meta.json, so it's
+# only available for prerecorded data.
+CONDUCTANCE = args.conductance and bool(DATADIR)
+
+DETECTOR = args.detector
+
+# Writes the spikes to files in the data directory, or in --spike-dir for
+# live data
+SPIKE_WRITER = None
+# Loads (or builds) the index of every spike in the prerecorded data
+SPIKE_INDEX_LOADER = None
+# Runs the live spike detection in its own thread (--detection-thread)
+DETECTION_WORKER = None
+# Times the live data path (see metrics.py)
+METRICS = None
+
 constants.VIDEO_FILE = args.video
 
 if args.monster_ratio:
@@ -1452,14 +1608,17 @@ if DATADIR:
         start_at = 0
     else:
         start_at = int(args.start_at)
-    d = data.PrerecordedData(constants.NUM_BOXES, start_at)
+    d = data.PrerecordedData(constants.NUM_BOXES, start_at, CONDUCTANCE, DETECTOR)
     d.load_files(DATADIR)
+    SPIKE_WRITER = spike_writer.SpikeWriter(DATADIR)
+    SPIKE_INDEX_LOADER = spike_index.IndexLoader(DATADIR, CONDUCTANCE, DETECTOR)
 
     TITLE += f' ({DATADIR})'
 
 elif LIVE:
     lilith_client.MAC = BOARD
     lilith_client.setup()
+    lilith_client.setup_queue(args.queue_size, args.queue_policy)
 
     # Run the Lilith interaction loop in another thread
     t = threading.Thread(target=lilith_client.main)
@@ -1467,7 +1626,14 @@ elif LIVE:
     t.setDaemon(True)
     t.start()
     
-    d = data.LiveData(constants.NUM_BOXES)
+    d = data.LiveData(constants.NUM_BOXES, DETECTOR)
+    METRICS = metrics.LiveMetrics(args.metrics, packet_queue = lilith_client.q)
+    if args.spike_dir:
+        SPIKE_WRITER = spike_writer.SpikeWriter(args.spike_dir)
+    
+    if args.detection_thread:
+        DETECTION_WORKER = live_worker.DetectionWorker(d, max_packets = args.max_packets)
+        DETECTION_WORKER.start()
 
 if MULTIPLAYER and not LIVE:
     lilith_client.MAC = '04e9e50cc5b9'
@@ -0,0 +1,185 @@
+'''Timing of the live data path, to find out whether lag comes from the
+network, queueing, detection or drawing.
+
+Each SampleData gets timestamps (from time.perf_counter()) as it goes
+through the game:
+
+    received_at     when lilith_client made it from the websocket message
+    dequeued_at     when it was taken off lilith_client.q
+    detected_at     when the spike detection on it finished
+    drawn_at        when the first frame after that was drawn
+
+LiveMetrics keeps the recent times between them, and the messages the
+lilith_client.SampleQueue dropped or coalesced. It shows their
+percentiles in an overlay (the I key) and in a CSV file (--metrics FILE)
+with a row every few seconds.'''
+import csv
+import logging
+import os
+import time
+
+import numpy as np
+
+import constants
+from ring_buffer import RingBuffer
+
+logger = logging.getLogger(__name__)
+
+# The name of each latency and the timestamps it's between
+LATENCIES = [('queue', 'received_at', 'dequeued_at'),
+             ('detection', 'dequeued_at', 'detected_at'),
+             ('draw', 'detected_at', 'drawn_at'),
+             ('total', 'received_at', 'drawn_at')]
+
+PERCENTILES = [50, 95, 99]
+
+class RollingPercentiles:
+    '''The percentiles of the last size values added.'''
+    def __init__(self, size = 1000):
+        self.values = RingBuffer(size)
+
+    def add(self, values):
+        self.values.append(np.asarray(values, dtype='float64'))
+
+    def percentiles(self):
+        '''Returns a list of the PERCENTILES of the values, or NaNs if there
+        aren't any.'''
+        if len(self.values) == 0:
+            return [float('nan')] * len(PERCENTILES)
+
+        return np.percentile(self.values.last(len(self.values)), PERCENTILES).tolist()
+
+class LiveMetrics:
+    def __init__(self, filename = None, write_interval = 5.0, packet_queue = None):
+        self.filename = filename
+        # The SampleQueue to report the dropped and coalesced messages of
+        self.packet_queue = packet_queue
+        self.write_interval = write_interval
+        self.latencies = {name: RollingPercentiles() for name, start, end in LATENCIES}
+        self.packet_gaps = RollingPercentiles()
+        self.show_overlay = False
+
+        self.packets = 0
+        # The frames in the packets, which is more than the packets if the
+        # queue coalesced them
+        self.frames = 0
+        # Frames that never arrived, or arrived after a later one
+        self.skipped_frames = 0
+        self.late_frames = 0
+        # The number of packets waiting each time the queue was emptied
+        self.queue_depths = RollingPercentiles()
+        self.max_queue_depth = 0
+        self._last_frame = None
+        self._last_received_at = None
+
+        # Packets that have been processed but not drawn yet
+        self._pending = []
+        self._last_write = time.perf_counter()
+
+        if filename is not None and not os.path.exists(filename):
+            with open(filename, 'w', newline='') as f:
+                csv.writer(f).writerow(self.columns())
+
+    def add_packets(self, packets, queue_depth):
+        '''Counts packets (SampleData in the order they were taken off the
+        queue) that have been through the spike detection. queue_depth is
+        the most messages that were waiting on the queue when it was read,
+        including any left there for the next frame.'''
+        self.packets += len(packets)
+        self.queue_depths.add([queue_depth])
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+        gaps = []
+        for packet in packets:
+            # A packet has more than one frame if the queue coalesced them
+            first = packet.start // constants.LIVE_SAMPLES_PER_MESSAGE
+            last = (packet.start + max(1, len(packet.samples)) - 1) // constants.LIVE_SAMPLES_PER_MESSAGE
+            self.frames += last - first + 1
+            
+            if self._last_frame is not None:
+                self.skipped_frames += max(0, first - self._last_frame - 1)
+                self.late_frames += max(0, min(last, self._last_frame) - first + 1)
+            if self._last_frame is None or last > self._last_frame:
+                self._last_frame = last
+
+            received_at = getattr(packet, 'received_at', None)
+            if received_at is not None and self._last_received_at is not None:
+                gaps.append(received_at - self._last_received_at)
+            self._last_received_at = received_at
+
+        self.packet_gaps.add(np.array(gaps) * 1000)
+        self._pending += packets
+
+    def frame_drawn(self):
+        '''Called after every frame is drawn. Records the latencies of the
+        packets that were waiting to be drawn.'''
+        now = time.perf_counter()
+        for packet in self._pending:
+            packet.drawn_at = now
+
+        for name, start, end in LATENCIES:
+            times = [getattr(p, end) - getattr(p, start) for p in self._pending
+                     if hasattr(p, start) and hasattr(p, end)]
+            self.latencies[name].add(np.array(times) * 1000)
+        self._pending = []
+
+        if self.filename is not None and now - self._last_write >= self.write_interval:
+            self._last_write = now
+            self.write()
+
+    def columns(self):
+        columns = ['time', 'packets', 'frames', 'skipped_frames', 'late_frames', 'max_queue_depth',
+                   'dropped', 'coalesced']
+        for name in ['gap', 'queue_depth'] + [name for name, start, end in LATENCIES]:
+            columns += [f'{name}_p{p}' for p in PERCENTILES]
+
+        return columns
+
+    def row(self):
+        row = [time.time(), self.packets, self.frames, self.skipped_frames, self.late_frames,
+               self.max_queue_depth]
+        row += self.queue_counts()
+        row += self.packet_gaps.percentiles() + self.queue_depths.percentiles()
+        for name, start, end in LATENCIES:
+            row += self.latencies[name].percentiles()
+
+        return row
+
+    def write(self):
+        '''Adds a row with the present metrics to the CSV file.'''
+        try:
+            with open(self.filename, 'a', newline='') as f:
+                csv.writer(f).writerow(self.row())
+        except OSError as e:
+            logger.warning('Could not write the metrics to %s: %s', self.filename, e)
+
+    def queue_counts(self):
+        '''Returns the numbers of messages the queue dropped and coalesced.'''
+        if self.packet_queue is None:
+            return [0, 0]
+
+        return [self.packet_queue.dropped, self.packet_queue.coalesced]
+
+    def overlay_lines(self):
+        '''Returns the lines of text for the overlay.'''
+        dropped, coalesced = self.queue_counts()
+        lines = [f'packets {self.packets}  frames {self.frames}  skipped {self.skipped_frames}  '
+                 f'late {self.late_frames}  max queue {self.max_queue_depth}  dropped {dropped}  coalesced {coalesced}']
+        # The queue depth is a number of messages, and the rest are times
+        depths = ''.join(f'{value:8.1f}' for value in self.queue_depths.percentiles())
+        lines += ['messages     p50     p95     p99', f'{"queue depth":11}{depths}',
+                  'ms           p50     p95     p99']
+        rows = [('gap', self.packet_gaps)]
+        rows += [(name, self.latencies[name]) for name, start, end in LATENCIES]
+        for name, percentiles in rows:
+            values = ''.join(f'{value:8.1f}' for value in percentiles.percentiles())
+            lines.append(f'{name:11}{values}')
+
+        return lines
+
+    def draw(self, screen):
+        if not self.show_overlay:
+            return
+
+        for i, line in enumerate(self.overlay_lines()):
+            screen.draw.text(line, (20, 300 + 22 * i), fontsize=24, color='yellow')
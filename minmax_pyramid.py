@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+class MinMaxPyramid:
+    '''Summaries of the recent samples of a signal at several resolutions,
+    for drawing a zoomable graph of it.
+
+    Level 0 has the min, max, median and mean of each bucket of
+    bucket_size samples. Each level above has buckets twice as big, made
+    by combining pairs of buckets from the level below (the median of a
+    bucket above level 0 is estimated as the mean of the two medians).
+    The buckets are added as the samples arrive, so a sample is only looked
+    at once.
+
+    window() reads about 1 to 2 buckets per column from the level whose
+    buckets are closest to the column width, so drawing any window costs
+    the same however many samples it covers. Each level keeps enough
+    buckets for max_columns columns, and there are enough levels for
+    windows up to max_samples.'''
+    def __init__(self, max_samples, max_columns, bucket_size = 64):
+        self.bucket_size = bucket_size
+        self.max_samples = max_samples
+        self.max_columns = max_columns
+
+        # The top level must fit a window of max_samples in 2 * max_columns
+        # buckets
+        top_buckets = max(1, max_samples / (2 * max_columns * bucket_size))
+        self.num_levels = 1 + max(0, math.ceil(math.log2(top_buckets)))
+
+        capacity = 2 * max_columns + 2
+        self._levels = [[RingBuffer(capacity) for channel in range(0, 4)]
+                        for level in range(0, self.num_levels)]
+        self.clear()
+
+    def clear(self):
+        for level in self._levels:
+            for ring in level:
+                ring.clear()
+
+        # Samples that don't fill a level 0 bucket yet
+        self._pending = np.zeros(0)
+        # A bucket at each level waiting for its pair
+        self._carry = [None] * self.num_levels
+        self.end_index = 0
+
+    def append(self, samples):
+        '''Adds samples after the last ones.'''
+        self.end_index += len(samples)
+
+        samples = np.concatenate([self._pending, np.asarray(samples, dtype='float64')])
+        full = len(samples) // self.bucket_size * self.bucket_size
+        self._pending = samples[full:]
+
+        if full == 0:
+            return
+
+        buckets = samples[:full].reshape(-1, self.bucket_size)
+        self._add_buckets(0, (buckets.min(axis=1), buckets.max(axis=1),
+                              np.median(buckets, axis=1), buckets.mean(axis=1)))
+
+    def _add_buckets(self, level, channels):
+        '''Adds buckets (a tuple of their mins, maxes, medians and means) to
+        a level, and the buckets they complete to the levels above.'''
+        for ring, values in zip(self._levels[level], channels):
+            ring.append(values)
+
+        if level + 1 == self.num_levels:
+            return
+
+        carry = self._carry[level]
+        if carry is not None:
+            channels = tuple(np.concatenate([[c], values]) for c, values in zip(carry, channels))
+
+        n = len(channels[0])
+        pairs = n // 2
+        self._carry[level] = tuple(values[-1] for values in channels) if n % 2 else None
+
+        if pairs == 0:
+            return
+
+        mins, maxes, medians, means = (values[:2 * pairs].reshape(-1, 2) for values in channels)
+        self._add_buckets(level + 1, (mins.min(axis=1), maxes.max(axis=1),
+                                      medians.mean(axis=1), means.mean(axis=1)))
+
+    def window(self, num_samples, num_columns):
+        '''Summarizes the last num_samples samples (up to the end of the
+        last complete bucket) in num_columns columns. Returns arrays of the
+        mins, maxes, median estimates and means of the columns, and the
+        mean of the whole window, or None if there's no data yet.
+        num_columns can't be more than max_columns.'''
+        if num_columns > self.max_columns:
+            raise ValueError(f'{num_columns} columns is more than the {self.max_columns} '
+                             'the pyramid was made for')
+
+        samples_per_column = num_samples / num_columns
+        level = int(math.floor(math.log2(max(1, samples_per_column / self.bucket_size))))
+        level = min(level, self.num_levels - 1)
+        bucket_size = self.bucket_size << level
+
+        rings = self._levels[level]
+        n = min(math.ceil(num_samples / bucket_size), len(rings[0]))
+        if n == 0:
+            return None
+
+        end = rings[0].end_index
+        mins, maxes, medians, means = (ring.window(end - n, end) for ring in rings)
+
+        # The first bucket of each column. If there are fewer buckets than
+        # columns, reduceat repeats them.
+        boundaries = np.arange(num_columns) * n // num_columns
+        sizes = np.maximum(1, np.diff(boundaries, append=n))
+
+        return (np.minimum.reduceat(mins, boundaries),
+                np.maximum.reduceat(maxes, boundaries),
+                np.add.reduceat(medians, boundaries) / sizes,
+                np.add.reduceat(means, boundaries) / sizes,
+                means.mean())
@@ -1,5 +1,8 @@
 import argparse
 
+import data
+import lilith_client
+
 parser = argparse.ArgumentParser(description='Play Maxine\'s Quest.')
 parser.add_argument('--datadir', action='store')
 parser.add_argument('--start-at', action='store')
@@ -12,3 +15,18 @@ parser.add_argument('--video', action='store')
 parser.add_argument('--monster-ratio', action='store')
 parser.add_argument('--doors', action='store')
 parser.add_argument('--dataview', action='store_true')
+parser.add_argument('--conductance', action='store_true')
+parser.add_argument('--detector', action='store', default='threshold',
+                    choices=sorted(data.DETECTORS))
+parser.add_argument('--spike-dir', action='store')
+# Run the live spike detection in a separate thread from the game
+parser.add_argument('--detection-thread', action='store_true')
+# Save the live data timing to a CSV file every few seconds
+parser.add_argument('--metrics', action='store')
+# How many messages from Lilith can wait for the game, and what to do when
+# there are more (see lilith_client.SampleQueue)
+parser.add_argument('--queue-size', action='store', type=int, default=200)
+parser.add_argument('--queue-policy', action='store', default='drop-oldest',
+                    choices=lilith_client.SampleQueue.POLICIES)
+# The most live packets to process in one frame of the game
+parser.add_argument('--max-packets', action='store', type=int, default=20)
@@ -0,0 +1,107 @@
+import numpy as np
+
+class RingBuffer:
+    '''A fixed-capacity buffer holding the most recent samples of a signal.
+
+    The storage is twice the capacity and every sample is written to both
+    halves, so the newest n samples (for any n up to the capacity) are
+    always one contiguous slice. Reads return views instead of copies. A
+    view is only valid until the next append, which may overwrite it.
+
+    end_index is the absolute index of the sample after the newest one
+    (i.e. the number of samples appended since the last clear), so windows
+    can be requested by absolute sample index.'''
+    def __init__(self, capacity, dtype = 'float64'):
+        self.capacity = int(capacity)
+        self._storage = np.zeros(2 * self.capacity, dtype = dtype)
+        self.clear()
+
+    def clear(self, end_index = 0):
+        '''Empties the buffer. The next sample appended will have the
+        absolute index end_index.'''
+        self._head = 0
+        self._size = 0
+        self.end_index = end_index
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def start_index(self):
+        '''The absolute index of the oldest sample still in the buffer.'''
+        return self.end_index - self._size
+
+    def append(self, samples):
+        '''Appends samples after the newest sample. If there are more samples
+        than the capacity only the last capacity samples are kept.'''
+        n = len(samples)
+        if n == 0:
+            return
+
+        if n > self.capacity:
+            samples = samples[n - self.capacity : ]
+
+        self._write_at(self._head, samples)
+
+        self._head = (self._head + len(samples)) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+        self.end_index += n
+
+    def write(self, start_index, samples):
+        '''Writes samples starting at absolute index start_index, e.g. for
+        data that can arrive out of order. Samples that are already in the
+        buffer are overwritten and ones after the newest sample are
+        appended. A gap between the newest sample and start_index is filled
+        with 0s. Samples older than the oldest one in the buffer are
+        dropped.'''
+        end = start_index + len(samples)
+        
+        if start_index > self.end_index:
+            gap = start_index - self.end_index
+            if gap >= self.capacity:
+                self.clear(start_index)
+            else:
+                self.append(np.zeros(gap, dtype = self._storage.dtype))
+        
+        # The part that overwrites samples in the buffer
+        overlap_start = max(start_index, self.start_index)
+        overlap_end = min(end, self.end_index)
+        if overlap_start < overlap_end:
+            position = (self._head - (self.end_index - overlap_start)) % self.capacity
+            self._write_at(position, samples[overlap_start - start_index : overlap_end - start_index])
+        
+        if end > self.end_index:
+            self.append(samples[self.end_index - start_index : ])
+
+    def _write_at(self, position, samples):
+        '''Copies samples into the ring starting at position, wrapping
+        around the end and updating both halves of the storage.'''
+        cap = self.capacity
+        first = min(len(samples), cap - position)
+
+        for start, chunk in [(position, samples[:first]), (0, samples[first:])]:
+            end = start + len(chunk)
+            self._storage[start : end] = chunk
+            self._storage[start + cap : end + cap] = chunk
+
+    def last(self, n):
+        '''Returns a view of the newest n samples (or all of them if there
+        are fewer than n).'''
+        n = min(n, self._size)
+        end = self._head + self.capacity
+
+        return self._storage[end - n : end]
+
+    def window(self, start, end):
+        '''Returns a view of the samples from absolute index start up to end,
+        clipped to the samples that are still in the buffer.'''
+        start = max(start, self.start_index)
+        end = min(end, self.end_index)
+
+        if end <= start:
+            return self._storage[0:0]
+
+        buffer_end = self._head + self.capacity
+        offset = self.end_index - end
+
+        return self._storage[buffer_end - offset - (end - start) : buffer_end - offset]
@@ -0,0 +1,225 @@
+'''An index of all the spikes in a recording, saved next to poredata.bin in
+spike_index.npz. It has the start index, mean and features of every spike
+(the records from spike_writer.make_records()), so DataView can show all of
+them as soon as a recording is opened and the game can jump to any spike.
+
+The index is only built the first time a recording is opened with a given
+spike detector. It's rebuilt if poredata.bin's size or modification time
+changes, or the detector, --conductance or VERSION does.
+
+IndexLoader finds the spikes by running this module in another Python
+process, so the game doesn't have to share the GIL with the detection:
+
+python3 spike_index.py DIR RECORDS_FILE [--conductance] [--detector NAME]'''
+import argparse
+import atexit
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+import analyze_spikes
+import data
+import spike_writer
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'spike_index.npz'
+
+# Change this when the spike detection or features change, so old indexes
+# are rebuilt
+VERSION = 1
+
+class SpikeIndex:
+    def __init__(self, records):
+        '''records is an array of spike_writer.RECORD_DTYPE records in order
+        of start_index.'''
+        self.records = records
+        self.start_indexes = records['start_index']
+
+    def __len__(self):
+        return len(self.records)
+
+    def next_spike(self, sample_index):
+        '''Returns the record of the first spike starting at or after
+        sample_index, or None if there isn't one.'''
+        i = np.searchsorted(self.start_indexes, sample_index, side='left')
+        if i == len(self.records):
+            return None
+
+        return self.records[i]
+
+    def previous_spike(self, sample_index):
+        '''Returns the record of the last spike starting before
+        sample_index, or None if there isn't one.'''
+        i = np.searchsorted(self.start_indexes, sample_index, side='left')
+        if i == 0:
+            return None
+
+        return self.records[i - 1]
+
+    def spikes_between(self, start, end):
+        '''Returns the records of the spikes starting from sample index
+        start up to end.'''
+        first, last = np.searchsorted(self.start_indexes, [start, end], side='left')
+
+        return self.records[first : last]
+
+def source_key(data_dir, conductance, detector):
+    '''Returns what the index for data_dir depends on, to check whether a
+    saved index is still valid.'''
+    stat = os.stat(os.path.join(data_dir, 'poredata.bin'))
+
+    return {'version': VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'conductance': bool(conductance), 'detector': detector}
+
+def load(data_dir, conductance = False, detector = 'threshold'):
+    '''Returns the saved SpikeIndex for data_dir, or None if there isn't one
+    or it's out of date.'''
+    filename = os.path.join(data_dir, INDEX_FILENAME)
+    if not os.path.exists(filename):
+        return None
+
+    key = source_key(data_dir, conductance, detector)
+    try:
+        with np.load(filename) as npz:
+            saved_key = {name: npz[name].item() for name in key}
+            if saved_key != key:
+                logger.info('%s is out of date', filename)
+                return None
+
+            records = np.zeros(len(npz['start_index']), dtype=spike_writer.RECORD_DTYPE)
+            for name in spike_writer.RECORD_DTYPE.names:
+                records[name] = npz[name]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('Could not read %s: %s', filename, e)
+        return None
+
+    return SpikeIndex(records)
+
+def save(data_dir, records, conductance = False, detector = 'threshold'):
+    '''Saves the spike records for data_dir as its index. The file is
+    written under another name and then renamed, so a half-written index is
+    never loaded.'''
+    filename = os.path.join(data_dir, INDEX_FILENAME)
+    temporary_filename = filename + '.tmp.npz'
+
+    key = source_key(data_dir, conductance, detector)
+    columns = {name: records[name] for name in spike_writer.RECORD_DTYPE.names}
+    np.savez(temporary_filename, **key, **columns)
+    os.replace(temporary_filename, filename)
+
+def find_records(data_dir, conductance = False, detector = 'threshold'):
+    '''Returns the records of all the spikes in the recording.'''
+    records, samples = analyze_spikes.analyze_shard(data_dir, 0, None, conductance, detector)
+
+    return records
+
+def find_records_in_subprocess(data_dir, conductance = False, detector = 'threshold', started = None):
+    '''Returns find_records() from another Python process running this
+    module. started is called with the subprocess.Popen once it's running,
+    so it can be stopped (see IndexLoader.close()).'''
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'records.npy')
+        command = [sys.executable, os.path.abspath(__file__), data_dir, filename,
+                   '--detector', detector]
+        if conductance:
+            command.append('--conductance')
+
+        process = subprocess.Popen(command)
+        if started is not None:
+            started(process)
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+        return np.load(filename)
+
+def build(data_dir, conductance = False, detector = 'threshold', in_subprocess = False, started = None):
+    '''Finds all the spikes in the recording (in another process if
+    in_subprocess is True, and then started works the same as in
+    find_records_in_subprocess()), saves the index and returns it. If the
+    index can't be saved, e.g. because the directory is read-only, it's
+    still returned.'''
+    if in_subprocess:
+        records = find_records_in_subprocess(data_dir, conductance, detector, started)
+    else:
+        records = find_records(data_dir, conductance, detector)
+    logger.info('Built the spike index for %s: %s spikes', data_dir, len(records))
+
+    try:
+        save(data_dir, records, conductance, detector)
+    except OSError as e:
+        logger.warning('Could not save the spike index for %s: %s', data_dir, e)
+
+    return SpikeIndex(records)
+
+def load_or_build(data_dir, conductance = False, detector = 'threshold', in_subprocess = False,
+                  started = None):
+    '''Returns the index for data_dir, building it if necessary.'''
+    index = load(data_dir, conductance, detector)
+    if index is None:
+        index = build(data_dir, conductance, detector, in_subprocess, started)
+
+    return index
+
+class IndexLoader:
+    '''Loads a recording's index in a background thread, or builds it in
+    another process, so the game can start straight away. index is None
+    until it's ready, and stays None if it can't be loaded or built.
+
+    If Maxine quits while the index is being built, close() is called at
+    exit and stops the other process, which would otherwise carry on
+    without it and leave its temporary directory behind.'''
+    def __init__(self, data_dir, conductance = False, detector = 'threshold'):
+        self.index = None
+        self._process = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(data_dir, conductance, detector), daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        '''Stops building the index if it's still going, and waits for the
+        thread to finish.'''
+        with self._lock:
+            self._closed = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _started(self, process):
+        with self._lock:
+            self._process = process
+            if self._closed:
+                process.terminate()
+
+    def _run(self, data_dir, conductance, detector):
+        try:
+            self.index = load_or_build(data_dir, conductance, detector, in_subprocess = True,
+                                       started = self._started)
+        except Exception:
+            if not self._closed:
+                logger.exception('Could not load or build the spike index for %s', data_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the spikes for a recording\'s index.')
+    parser.add_argument('data_dir')
+    parser.add_argument('records_file')
+    parser.add_argument('--conductance', action='store_true')
+    parser.add_argument('--detector', action='store', default='threshold',
+                        choices=sorted(data.DETECTORS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    np.save(args.records_file, find_records(args.data_dir, args.conductance, args.detector))
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,20 @@
 import numpy as np
-import os
 import math
 
 from util import memoized
 
 class Spike:
-    def __init__(self, data, mean):
+    __slots__ = ['data', 'mean', 'start_index', '_cache']
+
+    def __init__(self, data, mean, start_index = None):
         '''Create a spike based on the data for the spike and the mean at the
         time of the spike. The data is the height at each sample in the spike
-        minus the mean.'''
+        minus the mean. start_index is the absolute sample index of the start
+        of the spike, if it's known.'''
         self.data = np.array(data, dtype='double')
         self.mean = mean
+        self.start_index = start_index
+        self._cache = {}
 
     @memoized
     def peak(self):
@@ -111,76 +115,166 @@ class Spike:
 
         return means
 
-class Spikes:
-    '''Stores all the spikes in a dataset or live data session.'''
-    def __init__(self):
-        self._spikes = []
-        self._has_saved = False
-        
-    def add_spike(self, spike):
-        self._spikes.append(spike)
+# The features of each spike, in the order they're saved in the ARFF file
+FEATURE_NAMES = (['peak', 'duration', 'skewness', 'kurtosis', 'objectivity'] +
+                 [f'time{part}' for part in range(1, 10 + 1)] +
+                 [f'current{part}' for part in range(1, 20 + 1)])
+
+FEATURE_DTYPE = np.dtype([('peak', 'int64'), ('duration', 'int64')] +
+                         [(name, 'float64') for name in FEATURE_NAMES[2:]])
+
+def pack_spike_data(spikes):
+    '''Concatenates the data of a list of Spikes into one flat array.
+    Returns (flat, offsets), where spike i is flat[offsets[i] : offsets[i + 1]].'''
+    lengths = [len(s.data) for s in spikes]
+    offsets = np.zeros(len(spikes) + 1, dtype='int64')
+    np.cumsum(lengths, out=offsets[1:])
+    
+    if len(spikes) == 0:
+        return np.zeros(0), offsets
     
-    def save_separate_spikes_as_arff(self, data_dir):
-        if len(self._spikes) == 0:
-            return
+    return np.concatenate([s.data for s in spikes]), offsets
+
+def calculate_features(flat, offsets):
+    '''Calculates the features of many spikes at once, giving the same
+    values as the Spike methods. The spikes are packed as returned by
+    pack_spike_data() and must have at least 1 sample each. Returns a
+    structured array with one row per spike and a field per name in
+    FEATURE_NAMES.'''
+    flat = np.asarray(flat, dtype='double')
+    offsets = np.asarray(offsets, dtype='int64')
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    num_spikes = len(lengths)
+    
+    features = np.zeros(num_spikes, dtype=FEATURE_DTYPE)
+    if num_spikes == 0:
+        return features
     
-        string = self.separate_spikes_to_arff_string()
+    # Which spike each sample belongs to, and its index within the spike
+    spike_ids = np.repeat(np.arange(num_spikes), lengths)
+    positions = np.arange(len(flat)) - starts[spike_ids]
     
-        filename = os.path.join(data_dir, 'separate_spikes.arff')
-        with open(filename, mode='w') as f:
-            f.write(string)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peaks = np.maximum.reduceat(flat, starts)
+        means = np.add.reduceat(flat, starts) / lengths
+        deviations = flat - means[spike_ids]
+        sds = np.sqrt(np.add.reduceat(deviations**2, starts) / lengths)
+        moment_4 = np.add.reduceat(deviations**4, starts) / lengths
+        
+        # Sort the samples within each spike to find the medians
+        ordered = flat[np.lexsort((flat, spike_ids))]
+        medians = (ordered[starts + (lengths - 1) // 2] + ordered[starts + lengths // 2]) / 2
         
-        self._has_saved = True
+        # The first index of the maximum in each spike
+        peak_indexes = np.minimum.reduceat(
+            np.where(flat == peaks[spike_ids], positions, len(flat)), starts)
+        
+        features['peak'] = np.trunc(peaks)
+        features['duration'] = lengths
+        features['skewness'] = 3 * (means - medians) / sds
+        features['kurtosis'] = moment_4 / sds**4
+        features['objectivity'] = peak_indexes / (lengths - 1 - peak_indexes)
+    
+    for part, values in enumerate(_time_ten_values(flat, starts, lengths, spike_ids, means), 1):
+        features[f'time{part}'] = values
+    
+    current = _current_twenty_values(flat, lengths, spike_ids, positions, peak_indexes, means)
+    for part, values in enumerate(current, 1):
+        features[f'current{part}'] = values
+    
+    return features
+
+def _time_ten_values(flat, starts, lengths, spike_ids, means):
+    '''Returns a 10 x num_spikes array of Spike.time_ten_values() for each
+    spike. The sections are the same as np.array_split() makes: the first
+    length % 10 sections have one extra sample.'''
+    k = np.arange(10)[:, np.newaxis]
+    section_starts = starts + k * (lengths // 10) + np.minimum(k, lengths % 10)
+    section_lengths = lengths // 10 + (k < lengths % 10)
+    
+    # Spikes shorter than 10 samples have empty sections, and use the mean
+    short = lengths < 10
+    indexes = np.minimum(section_starts.ravel(order='F'), len(flat) - 1)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums = np.add.reduceat(flat, indexes).reshape(-1, 10).T
+        values = sums / section_lengths
+    
+    values[:, short] = means[short]
+    
+    return values
+
+def _current_twenty_values(flat, lengths, spike_ids, positions, peak_indexes, means):
+    '''Returns a 20 x num_spikes array of Spike.current_twenty_values() for
+    each spike, bucketing all the samples at once.'''
+    num_spikes = len(lengths)
+    NUM_BUCKETS = 10
+    
+    values = np.repeat(means[np.newaxis, :], 2 * NUM_BUCKETS, axis=0)
     
-    def get_has_saved(self):
-        return self._has_saved
+    # Spikes with fewer than 10 samples before or after the peak just use
+    # the mean
+    full = (peak_indexes >= 10) & (lengths - peak_indexes >= 10)
+    if not np.any(full):
+        return values
+    
+    # Each spike is split into 2 sections, before and after the peak
+    in_full = full[spike_ids]
+    samples = flat[in_full]
+    sections = 2 * spike_ids[in_full] + (positions[in_full] >= peak_indexes[spike_ids[in_full]])
+    
+    section_starts = np.flatnonzero(np.diff(sections, prepend=-1))
+    minimums = np.minimum.reduceat(samples, section_starts)
+    bucket_sizes = (np.maximum.reduceat(samples, section_starts) - minimums) / NUM_BUCKETS
+    
+    # The section number counts every section, not just the ones with
+    # samples in them, so turn it into an index into section_starts
+    section_indexes = np.cumsum(np.diff(sections, prepend=-1) != 0) - 1
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        locations = np.floor_divide(samples - minimums[section_indexes],
+                                    bucket_sizes[section_indexes])
+    # A section where every sample is the same goes in the first bucket
+    locations = np.nan_to_num(locations, nan=0)
+    locations = np.minimum(NUM_BUCKETS - 1, locations).astype('int64')
     
-    def separate_spikes_to_arff_string(self):
-        # Make ARFF header
-        header = '''
+    buckets = sections * NUM_BUCKETS + locations
+    num_buckets = 2 * num_spikes * NUM_BUCKETS
+    sums = np.bincount(buckets, weights=samples, minlength=num_buckets)
+    counts = np.bincount(buckets, minlength=num_buckets)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bucket_means = (sums / counts).reshape(num_spikes, 2 * NUM_BUCKETS).T
+    
+    values[:, full] = bucket_means[:, full]
+    
+    return values
+
+def arff_header():
+    '''Returns the ARFF header for a file of separate spikes, up to and
+    including the @DATA line.'''
+    header = '''
 % Auto-generated Molecular Reality file containing separate spikes.
 @RELATION spikes
 
-@ATTRIBUTE peak NUMERIC
-@ATTRIBUTE duration NUMERIC
-@ATTRIBUTE skewness NUMERIC
-@ATTRIBUTE kurtosis NUMERIC
-@ATTRIBUTE objectivity NUMERIC
 '''
-        for part in range(1, 10 + 1):
-            header += self._make_attribute(f'time{part}', 'NUMERIC')
-        for part in range(1, 20 + 1):
-            header += self._make_attribute(f'current{part}', 'NUMERIC')
-        
-        header += '@ATTRIBUTE class {fourmicron, pacman}\n'
-        
-        # Make ARFF data section
-        data_section = '@DATA\n'
-        
-        def m(number):
-            '''Replace nan and inf with '?'.'''
-            if math.isnan(number) or math.isinf(number):
-                return '?'
-            else:
-                return number
-        
-        for s in self._spikes:
-            # TODO determine the class
-            entry = f'{s.peak()},{s.duration()},{m(s.skewness())},{m(s.kurtosis())},{m(s.objectivity())},{self._list_to_arff(s.time_ten_values())},{self._list_to_arff(s.current_twenty_values())},fourmicron\n'
-            data_section += entry
-            
-        return f'{header}\n{data_section}'
-        
-    def _make_attribute(self, name, datatype):
-        return f'@ATTRIBUTE {name} {datatype}\n'
-        
-    def _list_to_arff(self, L):
-        out = ''
-        for i, value in enumerate(L):
-            out += str(value)
-            if i != len(L) - 1:
-                out += ','
-        return out
-
-spikes = Spikes()
+    for name in FEATURE_NAMES:
+        header += f'@ATTRIBUTE {name} NUMERIC\n'
+    
+    header += '@ATTRIBUTE class {fourmicron, pacman}\n'
+    
+    return header + '\n@DATA\n'
 
+def arff_lines(features):
+    '''Returns a list of ARFF data lines for an array from
+    calculate_features(). nan and inf are replaced with '?'.'''
+    def m(value):
+        if math.isnan(value) or math.isinf(value):
+            return '?'
+        else:
+            return str(value)
+    
+    # TODO determine the class
+    return [','.join(m(value) for value in row) + ',fourmicron\n'
+            for row in features.tolist()]
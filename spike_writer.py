@@ -0,0 +1,246 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+
+import numpy as np
+
+import spike_object
+
+logger = logging.getLogger(__name__)
+
+# One record per spike in the .records.bin file, before it's turned into
+# the .npz file
+RECORD_DTYPE = np.dtype([('start_index', 'int64'), ('mean', 'float64')] +
+                        spike_object.FEATURE_DTYPE.descr)
+
+class SpikeWriter:
+    '''Writes the spike catalog to files as the spikes are detected, instead
+    of all at once at the end:
+
+        NAME.arff         the features, for Weka
+        NAME.csv          the start index and the features
+        NAME.npz          every column of the CSV plus the spike samples
+
+    add_spike() only puts the spike on a queue, so it never makes the game
+    wait for the disk. A background thread calculates the features and
+    appends them every flush_interval seconds. The ARFF and CSV files are
+    complete up to the last flush even if Maxine crashes. The .npz file is
+    made by close() from NAME.records.bin and NAME.samples.bin, which are
+    left behind (and can be converted with records_to_npz()) if it
+    doesn't get that far. close() is also called at exit.
+
+    The files are only opened when the first spikes are written, so a
+    session without spikes doesn't leave empty files behind. If they're
+    already there (e.g. Maxine was restarted on the same data) the new
+    spikes are appended to them instead of replacing them, unless append
+    is False. Spikes whose start index is already in the files are left
+    out, so playing a recording again (or from --start-at, or after
+    jumping back) doesn't add its spikes twice.
+
+    If the background thread fails to write the spikes, the error is
+    logged and raised again by close().'''
+    def __init__(self, directory, name = 'separate_spikes', flush_interval = 1.0, append = True):
+        self.path = os.path.join(directory, name)
+        self.flush_interval = flush_interval
+        self.append = append
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        # Held while writing, in case flush() is called from another thread
+        self._lock = threading.Lock()
+        # The files, once they've been opened
+        self._files = None
+        # The start indexes of the spikes in the files
+        self._start_indexes = set()
+        # The first exception from the background thread, for close()
+        self._error = None
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def add_spike(self, spike):
+        '''Queues a spike to be written at the next flush.'''
+        self._queue.put(spike)
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            self._flush_in_background()
+
+        # Write the spikes that were added before close() was called
+        self._flush_in_background()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.exception('Could not write the spikes to %s', self.path)
+            if self._error is None:
+                self._error = e
+
+    def flush(self):
+        '''Writes the spikes that are waiting on the queue. The background
+        thread calls this every flush_interval seconds.'''
+        with self._lock:
+            self._write_queued_spikes()
+
+    def _write_queued_spikes(self):
+        spikes = []
+        while True:
+            try:
+                spikes.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if len(spikes) == 0:
+            return
+
+        self._write_records(*make_records(spikes))
+
+    def write_records(self, records, samples):
+        '''Appends records from make_records() (e.g. ones that were made in
+        another process) straight to the files.'''
+        with self._lock:
+            self._write_records(records, samples)
+
+    def _open(self):
+        '''Opens the files to append to (or replaces them if append is
+        False), writing the ARFF and CSV headers if they're new.'''
+        if not self.append and os.path.exists(self.path + '.npz'):
+            os.remove(self.path + '.npz')
+
+        mode = 'a' if self.append else 'w'
+        if self.append:
+            self._start_indexes = read_start_indexes(self.path)
+
+        new_arff = not self.append or not os.path.exists(self.path + '.arff')
+        new_csv = not self.append or not os.path.exists(self.path + '.csv')
+
+        arff_file = open(self.path + '.arff', mode)
+        if new_arff:
+            arff_file.write(spike_object.arff_header())
+        csv_file = open(self.path + '.csv', mode)
+        if new_csv:
+            csv_file.write(','.join(RECORD_DTYPE.names) + '\n')
+
+        self._files = [arff_file, csv_file, open(self.path + '.records.bin', mode + 'b'),
+                       open(self.path + '.samples.bin', mode + 'b')]
+
+    def _write_records(self, records, samples):
+        if self._files is None:
+            self._open()
+
+        records, samples = self._leave_out_written(records, samples)
+        if len(records) == 0:
+            return
+
+        arff_file, csv_file, records_file, samples_file = self._files
+        features = records[list(spike_object.FEATURE_NAMES)]
+
+        arff_file.writelines(spike_object.arff_lines(features))
+        csv_file.writelines(','.join(str(value) for value in row) + '\n'
+                            for row in records.tolist())
+        records.tofile(records_file)
+        samples.tofile(samples_file)
+
+        for f in self._files:
+            f.flush()
+
+        logger.debug('Wrote %s spikes to %s', len(records), self.path)
+
+    def _leave_out_written(self, records, samples):
+        '''Returns the records (and their samples) whose start index isn't
+        in the files yet, and adds them to _start_indexes. Spikes without a
+        start index (-1) are always written.'''
+        keep = np.array([index == -1 or index not in self._start_indexes
+                         for index in records['start_index'].tolist()], dtype=bool)
+        self._start_indexes.update(records['start_index'][keep].tolist())
+        if keep.all():
+            return records, samples
+
+        offsets = np.zeros(len(records) + 1, dtype='int64')
+        np.cumsum(records['duration'], out=offsets[1:])
+        samples = np.concatenate([samples[offsets[i] : offsets[i + 1]] for i in np.flatnonzero(keep)]
+                                 + [np.zeros(0)])
+
+        return records[keep], samples
+
+    def close(self):
+        '''Writes the remaining spikes, closes the files and makes the .npz
+        file. Raises the exception if writing the spikes failed. It's safe
+        to call more than once.'''
+        if self.closed:
+            return
+
+        self._closed.set()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+
+            records_to_npz(self.path)
+
+        if self._error is not None:
+            raise self._error
+
+def make_records(spikes):
+    '''Calculates the features of a list of Spikes. Returns an array of
+    RECORD_DTYPE records for them and the samples of all of them packed
+    together.'''
+    flat, offsets = spike_object.pack_spike_data(spikes)
+    features = spike_object.calculate_features(flat, offsets)
+
+    records = np.zeros(len(spikes), dtype=RECORD_DTYPE)
+    for name in spike_object.FEATURE_NAMES:
+        records[name] = features[name]
+    records['start_index'] = [-1 if s.start_index is None else s.start_index for s in spikes]
+    records['mean'] = [s.mean for s in spikes]
+
+    return records, flat
+
+def read_start_indexes(path):
+    '''Returns the set of start indexes in path.csv, or an empty set if
+    there isn't one.'''
+    if not os.path.exists(path + '.csv'):
+        return set()
+
+    with open(path + '.csv') as f:
+        # Skip the header
+        next(f, None)
+        return {int(line.split(',', 1)[0]) for line in f if line.strip()}
+
+def records_to_npz(path):
+    '''Turns path.records.bin and path.samples.bin into path.npz, with an
+    array for each field of RECORD_DTYPE, the samples of all the spikes in
+    'samples', and 'offsets' where spike i is samples[offsets[i] : offsets[i + 1]].
+    The spikes already in path.npz are kept, before the new ones. Removes
+    the .bin files afterwards. Does nothing if there aren't any.'''
+    if not os.path.exists(path + '.records.bin'):
+        return
+
+    records = np.fromfile(path + '.records.bin', dtype=RECORD_DTYPE)
+    samples = np.fromfile(path + '.samples.bin', dtype='float64')
+
+    if os.path.exists(path + '.npz'):
+        with np.load(path + '.npz') as npz:
+            old_records = np.zeros(len(npz['offsets']) - 1, dtype=RECORD_DTYPE)
+            for name in RECORD_DTYPE.names:
+                old_records[name] = npz[name]
+            records = np.concatenate([old_records, records])
+            samples = np.concatenate([npz['samples'], samples])
+
+    offsets = np.zeros(len(records) + 1, dtype='int64')
+    np.cumsum(records['duration'], out=offsets[1:])
+
+    columns = {name: records[name] for name in RECORD_DTYPE.names}
+    np.savez(path + '.npz', samples=samples, offsets=offsets, **columns)
+
+    os.remove(path + '.records.bin')
+    os.remove(path + '.samples.bin')
@@ -0,0 +1,83 @@
+import csv
+import os
+import tempfile
+
+import numpy as np
+
+import analyze_spikes
+import data
+
+def make_recording(directory, seed, num_frames = 400):
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(-300, 300, 1667 * num_frames).astype('int16')
+    # Spikes in the middle of frames, and one across each border between
+    # 100-frame shards
+    for start in list(rng.integers(1667 * 310, 1667 * 395, 20)) + [1667 * 200 - 10, 1667 * 300 - 5]:
+        samples[start : start + 30] += 3000
+    samples.tofile(os.path.join(directory, 'poredata.bin'))
+    
+    return samples
+
+def detect_sequentially(directory, detector = 'threshold', num_frames = 400):
+    d = data.PrerecordedData(300, 0, detector = detector)
+    d.load_files(directory)
+    
+    spikes = []
+    for frame in range(0, num_frames):
+        d.latest_frame = frame
+        spikes += d.detect_spikes()
+    spikes += d.finish_spike_detection()
+    
+    return spikes
+
+def test_shards_match_sequential_detection():
+    with tempfile.TemporaryDirectory() as directory:
+        samples = make_recording(directory, 15, 800)
+        # A long blockade, which cusum and adaptive leave out of their
+        # baseline, and then a smaller spike that they only find if the last
+        # shard's detector is primed the same way
+        samples[1667 * 650 : 1667 * 670] += 800
+        samples[1667 * 705 + 100 : 1667 * 705 + 130] += 700
+        samples.tofile(os.path.join(directory, 'poredata.bin'))
+        
+        shards = analyze_spikes.make_shards([directory], 100, 1667)
+        assert [shard[1:] for shard in shards] == [(i, i + 100) for i in range(0, 800, 100)]
+        
+        for detector in data.DETECTORS:
+            expected = detect_sequentially(directory, detector, 800)
+            
+            records = np.concatenate([analyze_spikes.analyze_shard(*shard, detector = detector)[0]
+                                      for shard in shards])
+            
+            assert list(records['start_index']) == [s.start_index for s in expected], detector
+            assert list(records['duration']) == [s.duration() for s in expected], detector
+
+def test_analyze():
+    with tempfile.TemporaryDirectory() as parent:
+        directories = []
+        for i in range(0, 2):
+            directory = os.path.join(parent, f'recording{i}')
+            os.mkdir(directory)
+            make_recording(directory, 16 + i)
+            directories.append(directory)
+        
+        summary_filename = os.path.join(parent, 'summary.csv')
+        # The second run replaces the files from the first
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(0, 2):
+                analyze_spikes.analyze(directories, processes = 2, shard_seconds = 1,
+                                       summary_filename = summary_filename)
+        
+        with open(summary_filename) as f:
+            rows = list(csv.DictReader(f))
+        
+        for directory, row in zip(directories, rows):
+            assert row['data_dir'] == directory
+            
+            with np.load(os.path.join(directory, 'separate_spikes.npz')) as npz:
+                assert len(npz['start_index']) == int(row['spikes']) == len(detect_sequentially(directory))
+            assert os.path.exists(os.path.join(directory, 'separate_spikes.arff'))
+
+if __name__ == '__main__':
+    test_shards_match_sequential_detection()
+    test_analyze()
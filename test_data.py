@@ -1,3 +1,10 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import constants
 import data
 
 def test_find_spikes_in_last_frame():
@@ -18,4 +25,560 @@ def test_find_spikes_in_last_frame():
         s = spikes[0]
         print(f'Peak: {s.peak()} Duration: {s.duration()} Mean: {s.mean}')
     
-test_find_spikes_in_last_frame()
+    assert len(spikes) == 1
+    assert spikes[0].duration() == 500
+
+def reference_find_spikes(last_samples, num_boxes):
+    '''The sample-by-sample loops that find_spikes_in_last_frame used to
+    use. Returns (start, end, sign) for each spike.'''
+    index = - len(last_samples) // num_boxes
+    last_box = last_samples[index:]
+    earlier_samples = last_samples[:index]
+    mean = np.mean(earlier_samples)
+    sd = np.std(earlier_samples)
+    
+    found = []
+    for sign in [1, -1]:
+        j = 0
+        while j < len(last_box):
+            if sign * last_box[j] > sign * mean + sd * 3:
+                start = j
+                j += 1
+                while j < len(last_box) and sign * last_box[j] > sign * mean + sd * 3:
+                    j += 1
+                found.append((start, j, sign))
+            j += 1
+    
+    return (found, last_box, mean)
+
+def test_find_spikes_matches_loop():
+    rng = np.random.default_rng(8)
+    
+    for trial in range(0, 20):
+        samples = rng.integers(-300, 300, 1667 * 300).astype('int16')
+        
+        # Dense positive and negative spikes in the last box, including
+        # ones that touch either end of it.
+        last_box = samples[-1667:]
+        for k in range(0, 40):
+            start = int(rng.integers(0, 1667))
+            length = int(rng.integers(1, 60))
+            last_box[start : start + length] += int(rng.choice([-2000, 2000]))
+        last_box[:3] += 2000
+        last_box[-3:] -= 2000
+        
+        spikes = data.Data.find_spikes_in_last_frame(samples, 300)
+        found, box, mean = reference_find_spikes(samples, 300)
+        
+        assert len(spikes) == len(found)
+        for spike, (start, end, sign) in zip(spikes, found):
+            assert np.array_equal(spike.data, box[start : end] - mean)
+            assert spike.mean == mean
+
+def make_data_dir(directory, samples, meta = None):
+    '''Writes a poredata.bin file (and optionally a meta.json file) into
+    directory, the way Lilith saves a recording.'''
+    samples = np.asarray(samples, dtype='int16')
+    samples.tofile(os.path.join(directory, 'poredata.bin'))
+    
+    if meta is not None:
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+def test_load_files_maps_samples():
+    samples = np.arange(1667 * 10, dtype='int16')
+    
+    with tempfile.TemporaryDirectory() as directory:
+        make_data_dir(directory, samples)
+    
+        d = data.PrerecordedData(300, 0)
+        d.load_files(directory)
+        
+        assert isinstance(d.sample_data, np.memmap)
+        
+        d.advance_frame()
+        d.advance_frame()
+        assert np.array_equal(d.get_frame(), samples[1667 * 2 : 1667 * 3])
+        assert np.array_equal(d.get_last_n_samples(2000), samples[1667 * 3 - 2000 : 1667 * 3])
+        
+        d.get_one_frame_current()
+        assert d.boxes[-1] == 1667 * 2
+        
+        # Release the map before the directory is removed
+        del d
+
+def test_load_files_empty_file():
+    with tempfile.TemporaryDirectory() as directory:
+        make_data_dir(directory, [])
+    
+        d = data.PrerecordedData(300, 0)
+        d.load_files(directory)
+        
+        assert len(d.get_frame()) == 0
+        d.get_one_frame_current()
+        assert d.no_more_data
+
+def test_voltages_for_range():
+    d = data.PrerecordedData(300, 0)
+    d.set_voltage_data([[100, 50], [0, 200], [300, -100], [300, 25]])
+    
+    # Each bias applies from its index until the next change, and the later
+    # of two changes at the same index wins.
+    expected = np.array([200] * 100 + [50] * 200 + [25] * 100)
+    assert np.array_equal(d.get_voltages_for_range(0, 400), expected)
+    assert np.array_equal(d.get_voltages_for_range(150, 350), expected[150:350])
+    
+    for index in [0, 99, 100, 299, 300, 1000]:
+        assert d.get_voltage_at_sample_index(index) == expected[min(index, 399)]
+    
+    # Samples before the first bias change use the first bias
+    d.set_voltage_data([[10, 5]])
+    assert np.array_equal(d.get_voltages_for_range(0, 20), [5] * 20)
+
+def test_conductance_for_range():
+    samples = np.arange(-500, 500, dtype='int16')
+    
+    with tempfile.TemporaryDirectory() as directory:
+        meta = {'bias_settings_history': [[0, 0], [200, 100], [600, -50]]}
+        make_data_dir(directory, samples, meta)
+    
+        d = data.PrerecordedData(300, 0)
+        d.load_files(directory)
+        
+        g = d.get_conductance_for_range(0, 1000)
+        
+        # There's no conductance while the bias is 0
+        assert np.all(g[:200] == 0)
+        assert np.allclose(g[200:600], samples[200:600] / 100)
+        assert np.allclose(g[600:], samples[600:] / -50)
+        
+        # Ranges past the end of the data are cut short
+        assert len(d.get_conductance_for_range(900, 2000)) == 100
+        
+        del d
+
+def test_conductance_history():
+    samples = np.arange(1667 * 400, dtype='int16') % 3000
+    
+    with tempfile.TemporaryDirectory() as directory:
+        make_data_dir(directory, samples, {'bias_settings_history': [[0, 100]]})
+    
+        # Start partway in so the history has to be filled in first
+        d = data.PrerecordedData(300, 0)
+        d.load_files(directory)
+        d.latest_frame = 350
+        
+        for i in range(0, 3):
+            d.get_one_frame_conductance()
+            
+            n = 1667 * 300
+            window = d.get_last_n_samples(n, conductance = True)
+            end = 1667 * (d.latest_frame + 1)
+            assert np.shares_memory(window, d.conductance._storage)
+            assert np.allclose(window, samples[end - n : end] / 100)
+            
+            # The present frame comes from the history too
+            frame = d.get_frame(conductance = True)
+            assert np.shares_memory(frame, d.conductance._storage)
+            assert np.allclose(frame, samples[end - 1667 : end] / 100)
+            
+            d.advance_frame()
+        
+        # The history never grows past its capacity
+        assert len(d.conductance) == d.conductance.capacity
+        
+        del d
+
+def test_joystick_states():
+    samples = np.zeros(1667 * 10, dtype='int16')
+    
+    with tempfile.TemporaryDirectory() as directory:
+        # Updates can be out of order in the file
+        meta = {'joystick': [[1667 * 5 + 3, 7], [1667 * 2, 5]]}
+        make_data_dir(directory, samples, meta)
+    
+        d = data.PrerecordedData(300, 0)
+        d.load_files(directory)
+        
+        expected = [65535, 65535, 5, 5, 5, 5, 7, 7, 7, 7, 65535, 65535]
+        assert list(d.joystick_states_for_frames(0, 12)) == expected
+        
+        for frame, state in enumerate(expected):
+            d.latest_frame = frame
+            assert d.get_one_frame_joystick() == state
+        
+        del d
+
+def reference_maxes_and_mins(samples, frame_size):
+    '''The box-by-box loop that calculate_maxes_and_mins used to use.'''
+    samples_to_show = frame_size * constants.NUM_BOXES
+    num_used_lines = int(len(samples) / samples_to_show * constants.NUM_BOXES)
+    box_width = samples_to_show // constants.NUM_BOXES
+
+    maxes = np.zeros(num_used_lines)
+    mins = np.zeros(num_used_lines)
+    
+    for i in range(0, num_used_lines):
+        values = samples[box_width * i : box_width * (i + 1)]
+        maxes[i] = values.max()
+        mins[i] = values.min()
+    
+    return (maxes, mins)
+
+def test_calculate_maxes_and_mins():
+    rng = np.random.default_rng(5)
+    
+    for frame_size in [1667, 5120, 7]:
+        for num_frames in [1, 2, 99, 100, 299, 300]:
+            # Include a ragged tail that isn't a whole box
+            n = frame_size * num_frames + int(rng.integers(0, frame_size))
+            samples = rng.integers(-32768, 32767, n).astype('int16')
+            
+            maxes, mins = data.Data.calculate_maxes_and_mins(samples, frame_size)
+            expected_maxes, expected_mins = reference_maxes_and_mins(samples, frame_size)
+            
+            assert maxes.dtype == expected_maxes.dtype
+            assert np.array_equal(maxes, expected_maxes)
+            assert np.array_equal(mins, expected_mins)
+    
+    # Conductance data is floating point
+    samples = rng.normal(size=1667 * 300)
+    maxes, mins = data.Data.calculate_maxes_and_mins(samples, 1667)
+    expected_maxes, expected_mins = reference_maxes_and_mins(samples, 1667)
+    assert np.array_equal(maxes, expected_maxes)
+    assert np.array_equal(mins, expected_mins)
+    
+    assert data.Data.calculate_maxes_and_mins([], 1667) == ([], [])
+
+def test_rolling_statistics():
+    rng = np.random.default_rng(6)
+    frames = [rng.integers(-2000, 2000, 100).astype('int16') for i in range(0, 20)]
+    float_frames = [f / 7 + 1000 for f in frames]
+    
+    for fs in [frames, float_frames]:
+        stats = data.RollingStatistics(5)
+        
+        for i, frame in enumerate(fs):
+            stats.add_frame(frame)
+            
+            window = np.concatenate(fs[max(0, i - 4) : i + 1])
+            assert stats.count == len(window)
+            assert np.isclose(stats.mean(), np.mean(window), rtol=1e-12)
+            assert np.isclose(stats.sd(), np.std(window), rtol=1e-9)
+
+def test_baseline_statistics():
+    rng = np.random.default_rng(7)
+    samples = rng.integers(-300, 300, 1667 * 320).astype('int16')
+    # A spike in frame 310
+    samples[1667 * 310 + 100 : 1667 * 310 + 300] += 3000
+    
+    with tempfile.TemporaryDirectory() as directory:
+        make_data_dir(directory, samples)
+    
+        d = data.PrerecordedData(300, 0)
+        d.load_files(directory)
+        d.latest_frame = 305
+        
+        while d.latest_frame < 315:
+            last_n_samples = d.get_last_n_samples(1667 * 300)
+            baseline = d.get_baseline_statistics()
+            
+            earlier_samples = last_n_samples[:-1667]
+            assert np.isclose(baseline.mean(), np.mean(earlier_samples))
+            assert np.isclose(baseline.sd(), np.std(earlier_samples))
+            
+            start_index = 1667 * (d.latest_frame + 1) - len(last_n_samples)
+            assert baseline.window == (start_index, start_index + len(earlier_samples))
+            with_baseline = data.Data.statistical_end_spike_exists(last_n_samples, 300, baseline, start_index)
+            without = data.Data.statistical_end_spike_exists(last_n_samples, 300)
+            assert with_baseline == without
+            
+            # The same number of samples from somewhere else doesn't use
+            # the baseline
+            other_samples = last_n_samples + 1000.0
+            mean, sd = data.Data.baseline_mean_and_sd(other_samples, -1667, baseline, start_index - 1667)
+            assert np.isclose(mean, np.mean(earlier_samples) + 1000)
+            assert with_baseline == (d.latest_frame == 310)
+            
+            d.advance_frame()
+        
+        del d, last_n_samples, earlier_samples
+
+def test_spike_detector_matches_last_frame():
+    '''Spikes that don't cross frame boundaries are the same as the ones
+    find_spikes_in_last_frame() finds in each frame.'''
+    rng = np.random.default_rng(9)
+    frame_size = 500
+    frames = [rng.integers(-300, 300, frame_size).astype('int16') for i in range(0, 120)]
+    for frame in frames[60:]:
+        for k in range(0, 3):
+            start = int(rng.integers(1, frame_size - 60))
+            frame[start : start + int(rng.integers(1, 50))] += int(rng.choice([-2000, 2000]))
+    
+    detector = data.SpikeDetector(99, spike_threshold = None)
+    
+    for i, frame in enumerate(frames):
+        spikes = detector.process_frame(frame)
+        
+        window = np.concatenate(frames[max(0, i - 99) : i + 1])
+        if len(window) - frame_size < 20000:
+            assert spikes == []
+            continue
+        
+        found, box, mean = reference_find_spikes(window, len(window) // frame_size)
+        found.sort()
+        
+        assert len(spikes) == len(found)
+        for spike, (start, end, sign) in zip(spikes, found):
+            assert spike.start_index == i * frame_size + start
+            assert np.allclose(spike.data, box[start : end] - mean)
+
+def test_spike_detector_straddling_spike():
+    rng = np.random.default_rng(10)
+    samples = rng.integers(-300, 300, 1000 * 50).astype('int16')
+    # One spike across the boundary between frames 40 and 41
+    samples[40950 : 41030] += 3000
+    
+    detector = data.SpikeDetector(30)
+    spikes = []
+    for i in range(0, 50):
+        spikes += detector.process_frame(samples[i * 1000 : (i + 1) * 1000])
+    spikes += detector.flush()
+    
+    assert len(spikes) == 1
+    assert spikes[0].start_index == 40950
+    assert spikes[0].duration() == 80
+
+def test_prerecorded_detect_spikes():
+    rng = np.random.default_rng(11)
+    samples = rng.integers(-300, 300, 1667 * 400).astype('int16')
+    samples[1667 * 350 + 10 : 1667 * 350 + 40] += 3000
+    samples[1667 * 399 + 1600 :] -= 3000
+    
+    with tempfile.TemporaryDirectory() as directory:
+        make_data_dir(directory, samples)
+    
+        d = data.PrerecordedData(300, 0)
+        d.load_files(directory)
+        d.latest_frame = 340
+        
+        spikes = []
+        while d.latest_frame < 400:
+            spikes += d.detect_spikes()
+            d.advance_frame()
+        spikes += d.finish_spike_detection()
+        
+        assert [s.start_index for s in spikes] == [1667 * 350 + 10, 1667 * 399 + 1600]
+        assert [s.duration() for s in spikes] == [30, 67]
+        
+        del d
+
+def run_detector(detector, frames):
+    spikes = []
+    for frame in frames:
+        spikes += detector.process_frame(frame)
+    spikes += detector.flush()
+    
+    return spikes
+
+def test_detectors_find_spikes():
+    '''Every detector in DETECTORS finds large spikes in noise, and only
+    those.'''
+    rng = np.random.default_rng(12)
+    frame_size = 500
+    frames = [rng.integers(-300, 300, frame_size).astype('int16') for i in range(0, 120)]
+    starts = []
+    for i in range(60, 120, 6):
+        start = int(rng.integers(50, frame_size - 100))
+        frames[i][start : start + 40] += 4000
+        starts.append(i * frame_size + start)
+    
+    for name in data.DETECTORS:
+        detector = data.make_spike_detector(name, 99)
+        spikes = run_detector(detector, frames)
+        
+        assert len(spikes) == len(starts), name
+        for spike, start in zip(spikes, starts):
+            # The CUSUM can start a few samples late and end a few late
+            assert abs(spike.start_index - start) <= 5, name
+            assert abs(spike.duration() - 40) <= 10, name
+
+def test_adaptive_detector_ignores_bias_change():
+    rng = np.random.default_rng(13)
+    frame_size = 500
+    frames = [rng.integers(-300, 300, frame_size).astype('int16') for i in range(0, 120)]
+    # The bias changes in the middle of frame 80 and the current goes up
+    step = 80 * frame_size + 200
+    samples = np.concatenate(frames)
+    samples[step:] += 5000
+    frames = np.split(samples, 120)
+    
+    detector = data.make_spike_detector('adaptive', 99)
+    detector.set_bias_changes([step])
+    assert run_detector(detector, frames) == []
+    
+    # The threshold detector does count it as a spike
+    assert run_detector(data.make_spike_detector('threshold', 99), frames) != []
+
+def test_cusum_cumulative_sum():
+    rng = np.random.default_rng(14)
+    increments = rng.normal(0, 1, 1000)
+    
+    expected = []
+    s = 2.0
+    for x in increments:
+        s = max(0, s + x)
+        expected.append(s)
+    
+    assert np.allclose(data.CusumDetector.cumulative_sum(increments, 2.0), expected)
+    
+    # With a limit, and increments big enough to hit both bounds often
+    increments = rng.normal(0, 4, 1000)
+    expected = []
+    s = 0.0
+    for x in increments:
+        s = min(10, max(0, s + x))
+        expected.append(s)
+    
+    assert np.allclose(data.CusumDetector.cumulative_sum(increments, 0.0, 10), expected)
+
+def test_live_frames_by_index():
+    d = data.LiveData(constants.NUM_BOXES)
+    d.frames_to_keep = 4
+    d.samples = data.RingBuffer(4 * d.samples_per_frame, dtype='int16')
+    frame_size = d.samples_per_frame
+    
+    def receive(frame_index):
+        d.store_frame(frame_index, np.full(frame_size, frame_index + 1, dtype='int16'))
+        d.latest_frame = max(d.latest_frame, frame_index)
+    
+    receive(0)
+    receive(1)
+    # Frame 2 arrives late
+    receive(3)
+    assert d.missing_frames == {2}
+    assert list(d.get_last_n_frames(100)[::frame_size]) == [1, 2, 0, 4]
+    receive(2)
+    assert d.missing_frames == set()
+    assert list(d.get_last_n_frames(2)[::frame_size]) == [3, 4]
+    assert d.get_frame()[0] == 4
+    
+    # Older frames drop out of the ring, and read as 0s
+    receive(6)
+    assert d.missing_frames == {4, 5}
+    receive(7)
+    receive(8)
+    assert d.missing_frames == {5}
+    assert list(d.get_last_n_frames(6)[::frame_size]) == [0, 0, 0, 7, 8, 9]
+    assert d.get_frame_samples(1)[0] == 0
+
+def test_live_trigger_uses_detector():
+    '''In live mode each new frame is checked by the detector chosen with
+    --detector, and triggers exactly when that detector's frame_triggered
+    would for the same frames.'''
+    rng = np.random.default_rng(3)
+    frame_size = constants.LIVE_SAMPLES_PER_MESSAGE
+    frames = []
+    for frame_index in range(150):
+        samples = rng.normal(1000, 5, frame_size).astype('int16')
+        if frame_index in [40, 120]:
+            samples[-200:-100] += 1000
+        frames.append(samples)
+    
+    for name in data.DETECTORS:
+        d = data.LiveData(constants.NUM_BOXES, name)
+        detector = data.make_spike_detector(name, d.window_frames - 1)
+        
+        results = []
+        for frame_index, samples in enumerate(frames):
+            triggered = d.receive_frame(frame_index, samples)
+            detector.process_frame(samples)
+            assert triggered == detector.frame_triggered, name
+            results.append(triggered)
+        
+        assert [i for i, spike in enumerate(results) if spike] == [40, 120], name
+
+def test_live_detection_per_frame():
+    '''Each live frame costs the detector one frame of work, whichever
+    detector it is. cusum and adaptive leave their spikes out of the
+    baseline, so nothing should fall back to recalculating the statistics
+    of the whole window.'''
+    rng = np.random.default_rng(4)
+    frame_size = constants.LIVE_SAMPLES_PER_MESSAGE
+    baseline_mean_and_sd = data.Data.baseline_mean_and_sd
+    
+    def fail(*args):
+        raise AssertionError('the window was scanned again')
+    
+    data.Data.baseline_mean_and_sd = staticmethod(fail)
+    try:
+        for name in data.DETECTORS:
+            d = data.LiveData(constants.NUM_BOXES, name)
+            processed = []
+            process_frame = d.spike_detector.process_frame
+            d.spike_detector.process_frame = lambda frame: processed.append(len(frame)) or process_frame(frame)
+            
+            for frame_index in range(130):
+                samples = rng.normal(1000, 5, frame_size).astype('int16')
+                if frame_index == 110:
+                    samples[-200:-100] += 1000
+                d.receive_frame(frame_index, samples)
+            
+            assert processed == [frame_size] * 130, name
+            assert d.detect_spikes() != [], name
+    finally:
+        data.Data.baseline_mean_and_sd = baseline_mean_and_sd
+
+def test_live_coalesced_frames():
+    '''A packet with several frames in it (from a coalescing queue) is split
+    into frames, and each one is checked for a spike.'''
+    d = data.LiveData(constants.NUM_BOXES)
+    frame_size = d.samples_per_frame
+    
+    packet = object.__new__(data.lilith_client.SampleData)
+    packet.start = 5 * frame_size
+    packet.samples = np.repeat(np.arange(3, dtype='int16'), frame_size)
+    
+    d.load_received_samples_and_count_spikes([packet])
+    assert d.latest_frame == 7
+    assert len(d.get_received_frames()) == 3
+    assert d.get_recent_frames_contain_spikes() == [False, False, False]
+    assert [d.get_frame_samples(i)[0] for i in [5, 6, 7]] == [0, 1, 2]
+    
+    # A spike in the middle of a packet is found
+    d = data.LiveData(constants.NUM_BOXES)
+    rng = np.random.default_rng(6)
+    packets = []
+    for start, num_frames in [(0, 20), (20, 3)]:
+        packet = object.__new__(data.lilith_client.SampleData)
+        packet.start = start * frame_size
+        packet.samples = rng.normal(1000, 5, num_frames * frame_size).astype('int16')
+        packets.append(packet)
+    packets[1].samples[2 * frame_size - 200 : 2 * frame_size - 100] += 1000
+    
+    assert d.load_received_samples_and_count_spikes(packets[:1]) == 0
+    assert d.load_received_samples_and_count_spikes(packets[1:]) == 1
+    assert d.get_recent_frames_contain_spikes() == [False, True, False]
+
+if __name__ == '__main__':
+    test_find_spikes_in_last_frame()
+    test_find_spikes_matches_loop()
+    test_load_files_maps_samples()
+    test_load_files_empty_file()
+    test_voltages_for_range()
+    test_conductance_for_range()
+    test_conductance_history()
+    test_joystick_states()
+    test_calculate_maxes_and_mins()
+    test_rolling_statistics()
+    test_baseline_statistics()
+    test_spike_detector_matches_last_frame()
+    test_spike_detector_straddling_spike()
+    test_prerecorded_detect_spikes()
+    test_detectors_find_spikes()
+    test_adaptive_detector_ignores_bias_change()
+    test_cusum_cumulative_sum()
+    test_live_frames_by_index()
+    test_live_trigger_uses_detector()
+    test_live_detection_per_frame()
+    test_live_coalesced_frames()
@@ -0,0 +1,117 @@
+import numpy as np
+import pygame
+
+import graphs
+
+def test_scale_to_pixels_matches_int():
+    values = np.array([-7.5, -3, 0, 0.4, 12.9, 100])
+    low, range_, pixels, base = -7.5, 108.5, 37, 50
+    
+    expected = [base - int((v - low) / range_ * pixels) for v in values]
+    assert list(graphs.scale_to_pixels(values, low, range_, pixels, base)) == expected
+    
+    # Values below low round towards the base, like int() does
+    expected = [- int((v - 10) / 20 * 100) for v in values]
+    assert list(graphs.scale_to_pixels(values, 10, 20, 100)) == expected
+
+def test_box_maxes_and_mins():
+    samples = np.array([3, -1, 4, 1, -5, 9, 2, 6, 5, 3], dtype='int16')
+    
+    (maxes, mins) = graphs.box_maxes_and_mins(samples, 3, 3)
+    assert list(maxes) == [4, 9, 6]
+    assert list(mins) == [-1, -5, 2]
+    # Big ranges don't overflow int16
+    assert maxes.dtype == np.float64
+    
+    # Only whole boxes
+    (maxes, mins) = graphs.box_maxes_and_mins(samples, 4, 5)
+    assert list(maxes) == [4, 9]
+
+class FakeScreen:
+    '''Records what's blitted instead of drawing it.'''
+    class Draw:
+        def text(self, *args):
+            pass
+        
+        def filled_rect(self, *args):
+            pass
+    
+    def __init__(self):
+        self.draw = self.Draw()
+        self.blitted = []
+    
+    def blit(self, surface, position):
+        self.blitted.append((surface, position))
+
+def test_scatter_plot_draws_new_points_only():
+    plot = graphs.ScatterPlot(FakeScreen(), 'dt', 'dI')
+    plot.add_datapoints([0, 100], [0, 10])
+    plot.draw()
+    assert plot._num_drawn == 2
+    surface = plot.surface
+    
+    # Inside the axes, so it's added to the same surface
+    plot.add_datapoint((50, 5))
+    xs, ys = plot.to_pixels(2, 3)
+    assert (list(xs), list(ys)) == ([233], [182])
+    plot.draw()
+    assert plot.surface is surface
+    assert plot._drawn_bounds == (0, 100, 0, 10)
+    assert surface.get_at((233, 182))[1] > 0
+    
+    # Outside them, so everything is redrawn with the new axes
+    plot.add_datapoint((200, 5))
+    plot.draw()
+    assert plot._drawn_bounds == (0, 200, 0, 10)
+    assert surface.get_at((233, 182))[1] == 0
+    assert len(plot) == 4
+    assert plot.datapoints[-1] == (200, 5)
+
+def test_continuous_graph_pyramid_fits_width():
+    graph = graphs.ContinuousGraph(FakeScreen(), False)
+    assert graph.pyramid.max_columns == graph.width
+    
+    graph.enlarge_on_left()
+    assert graph.pyramid.max_columns == graph.width
+    
+    for i in range(0, 3):
+        graph.set_frame(np.arange(graph.frame_size))
+    assert len(graph.tops) == graph.width
+
+def test_vertical_line_ring_maxes_and_mins():
+    '''The ring's lines are the same from the maxes and mins as from the
+    samples.'''
+    samples = np.random.default_rng(4).integers(-3000, 3000, 100 * 5120)
+    from_samples = graphs.VerticalLineRing(FakeScreen(), None, True, 100)
+    from_samples.give_samples(samples)
+    
+    from_maxes = graphs.VerticalLineRing(FakeScreen(), None, True, 100)
+    from_maxes.give_maxes_and_mins(*graphs.data.Data.calculate_maxes_and_mins(samples, 5120))
+    
+    assert np.array_equal(from_samples.tops, from_maxes.tops)
+    assert np.array_equal(from_samples.bottoms, from_maxes.bottoms)
+
+def test_scatter_plot_density():
+    plot = graphs.ScatterPlot(FakeScreen(), 'dt', 'K')
+    plot.DENSITY_THRESHOLD = 100
+    rng = np.random.default_rng(1)
+    plot.add_datapoints(rng.integers(0, 1000, 500), rng.normal(0, 1, 500))
+    # Lots of points in one place
+    plot.add_datapoints([0] * 300, [plot.min_y] * 300)
+    plot.draw()
+    
+    assert plot._counts.sum() == 800
+    xs, ys = plot.to_pixels(799, 800)
+    assert plot.surface.get_at((xs[0], ys[0]))[1] == 255
+    
+    plot.clear()
+    plot.draw()
+    assert len(plot) == 0
+
+if __name__ == '__main__':
+    test_scale_to_pixels_matches_int()
+    test_box_maxes_and_mins()
+    test_scatter_plot_draws_new_points_only()
+    test_continuous_graph_pyramid_fits_width()
+    test_vertical_line_ring_maxes_and_mins()
+    test_scatter_plot_density()
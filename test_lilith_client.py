@@ -1,5 +1,10 @@
+import queue
+import struct
+
 import numpy as np
 
+import lilith_client
+
 def test_reading_int16s():
     message = b'\x01\x02\x03\x04'
 
@@ -10,6 +15,67 @@ def test_reading_int16s():
     print(samples[0] == 258)
     print(samples[1] == 772)
     
+def make_sample_data(start, samples):
+    '''Makes a SampleData from a message like the ones Lilith sends.'''
+    header = struct.pack('!HHIII', 0, 0, 1, start >> 32, start & 0xffffffff)
+    
+    return lilith_client.SampleData(header + np.array(samples, dtype='>i2').tobytes())
+
+def test_queue_drop_oldest():
+    q = lilith_client.SampleQueue(3, 'drop-oldest')
+    for i in range(5):
+        q.put(make_sample_data(i * 2, [i, i]))
+    
+    d_list = lilith_client.consume_latest_samples(q)
+    assert [d.start for d in d_list] == [4, 6, 8]
+    assert q.dropped == 2
+
+def test_queue_coalesce():
+    q = lilith_client.SampleQueue(2, 'coalesce')
+    for i in range(4):
+        q.put(make_sample_data(i * 2, [i, i]))
+    # Not straight after the newest one, so the oldest is dropped instead
+    q.put(make_sample_data(100, [9, 9]))
+    
+    d_list = lilith_client.consume_latest_samples(q)
+    assert q.coalesced == 2 and q.dropped == 1
+    assert [d.start for d in d_list] == [2, 100]
+    assert list(d_list[0].samples) == [1, 1, 2, 2, 3, 3]
+    assert d_list[0].end == 8
+
+def test_queue_coalesce_limit():
+    '''Once the newest message has max_coalesced_samples, the oldest is
+    dropped instead.'''
+    q = lilith_client.SampleQueue(2, 'coalesce', max_coalesced_samples = 4)
+    for i in range(5):
+        q.put(make_sample_data(i * 2, [i, i]))
+    
+    d_list = lilith_client.consume_latest_samples(q)
+    assert q.coalesced == 2 and q.dropped == 1
+    assert [list(d.samples) for d in d_list] == [[1, 1, 2, 2], [3, 3, 4, 4]]
+
+def test_queue_block():
+    q = lilith_client.SampleQueue(1, 'block')
+    q.put(make_sample_data(0, [1]))
+    try:
+        q.put(make_sample_data(1, [1]), timeout=0.01)
+        assert False
+    except queue.Full:
+        pass
+
+def test_consume_at_most():
+    q = lilith_client.SampleQueue()
+    for i in range(5):
+        q.put(make_sample_data(i, [i]))
+    
+    assert len(lilith_client.consume_latest_samples(q, 3)) == 3
+    assert len(lilith_client.consume_latest_samples(q, 3)) == 2
+
 if __name__ == '__main__':
     test_reading_int16s()
+    test_queue_drop_oldest()
+    test_queue_coalesce()
+    test_queue_coalesce_limit()
+    test_queue_block()
+    test_consume_at_most()
 
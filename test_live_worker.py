@@ -0,0 +1,152 @@
+import queue
+import time
+
+import numpy as np
+
+import constants
+import data
+import lilith_client
+import live_worker
+
+def make_packet(frame_index, samples):
+    '''A SampleData like the ones lilith_client puts on its queue.'''
+    packet = object.__new__(lilith_client.SampleData)
+    packet.start = frame_index * constants.LIVE_SAMPLES_PER_MESSAGE
+    packet.samples = samples
+    
+    return packet
+
+def make_frames(num_frames, spike_frames):
+    rng = np.random.default_rng(5)
+    frames = []
+    for i in range(num_frames):
+        samples = rng.normal(1000, 5, constants.LIVE_SAMPLES_PER_MESSAGE).astype('int16')
+        if i in spike_frames:
+            samples[-200:-100] += 1000
+        frames.append(samples)
+    
+    return frames
+
+def test_worker_matches_game_thread():
+    frames = make_frames(60, [30, 50])
+    
+    # Processed on the game's thread, a few packets at a time
+    d = data.LiveData(constants.NUM_BOXES)
+    expected = [live_worker.summarize_packets(d, [make_packet(i, frames[i]) for i in range(start, start + 6)])
+                for start in range(0, 60, 6)]
+    expected = live_worker.combine_summaries(expected)
+    
+    packets = queue.Queue()
+    worker = live_worker.DetectionWorker(data.LiveData(constants.NUM_BOXES), packets)
+    worker.start()
+    for i, samples in enumerate(frames):
+        packets.put(make_packet(i, samples))
+    
+    summaries = []
+    deadline = time.time() + 10
+    while sum(len(s.received_frames) for s in summaries) < 60 and time.time() < deadline:
+        summaries += worker.take_summaries()
+        time.sleep(0.01)
+    worker.stop()
+    
+    summary = live_worker.combine_summaries(summaries)
+    assert summary.spikes == expected.spikes == 2
+    assert summary.recent_frames_contain_spikes == expected.recent_frames_contain_spikes
+    assert np.array_equal(summary.frame, frames[-1])
+    assert len(summary.completed_spikes) == len(expected.completed_spikes)
+
+def test_summary_frame_is_a_copy():
+    d = data.LiveData(constants.NUM_BOXES)
+    frames = make_frames(2, [])
+    
+    summary = live_worker.summarize_packets(d, [make_packet(0, frames[0])])
+    live_worker.summarize_packets(d, [make_packet(0, frames[1])])
+    assert np.array_equal(summary.frame, frames[0])
+
+def test_graphs_by_index():
+    '''Frames that arrive out of order go in their own places on the graphs,
+    and frames that never arrive are 0s.'''
+    frames = [np.full(constants.LIVE_SAMPLES_PER_MESSAGE, i + 1, dtype='int16') for i in range(5)]
+    d = data.LiveData(constants.NUM_BOXES)
+    
+    summary = live_worker.summarize_packets(d, [make_packet(i, frames[i]) for i in [0, 2, 1, 4]])
+    maxes, mins = summary.maxes_mins
+    assert list(maxes) == list(mins) == [1, 2, 3, 0, 5]
+    assert np.array_equal(d.get_last_n_samples(10**6),
+                          np.concatenate(frames[:3] + [np.zeros_like(frames[3]), frames[4]]))
+    
+    # Frame 3 arrives late, after frame 4
+    later = live_worker.summarize_packets(d, [make_packet(3, frames[3])])
+    assert list(later.maxes_mins[0]) == [1, 2, 3, 4, 5]
+    assert list(maxes) == [1, 2, 3, 0, 5]
+    
+    combined = live_worker.combine_summaries([summary, later, live_worker.LiveSummary()])
+    assert combined.maxes_mins is later.maxes_mins
+
+def test_rms_window():
+    '''The RMS is of the last second of samples up to the latest frame,
+    wherever the frames arrived from.'''
+    n = constants.LIVE_SAMPLES_PER_MESSAGE
+    num_frames = live_worker.HISTORY_SAMPLES // n + 5
+    frames = [np.full(n, i, dtype='int16') for i in range(num_frames)]
+    d = data.LiveData(constants.NUM_BOXES)
+    
+    # The last frames arrive in reverse order
+    order = list(range(num_frames - 5)) + list(range(num_frames - 1, num_frames - 6, -1))
+    summary = live_worker.summarize_packets(d, [make_packet(i, frames[i]) for i in order])
+    
+    assert len(summary.maxes_mins[0]) == live_worker.HISTORY_SAMPLES // n
+    assert summary.maxes_mins[0][-1] == num_frames - 1
+    expected = np.concatenate(frames)[-constants.SAMPLE_RATE:]
+    assert np.isclose(summary.rms_last_second, data.Data.rms(expected))
+
+def test_summary_pressed():
+    '''The joystick state comes with the summary, and stays the same when
+    there isn't a joystick message.'''
+    d = data.LiveData(constants.NUM_BOXES)
+    frames = make_frames(2, [])
+    
+    first = live_worker.summarize_packets(d, [lilith_client.JoystickData(['js1_left']),
+                                              make_packet(0, frames[0]),
+                                              lilith_client.JoystickData(['js1_up'])])
+    second = live_worker.summarize_packets(d, [make_packet(1, frames[1])])
+    assert first.pressed == ['js1_up']
+    assert second.pressed is None
+    assert live_worker.combine_summaries([first, second]).pressed == ['js1_up']
+
+def test_queue_depth():
+    '''The queue depth is how many messages were waiting, not how many
+    were taken off the queue.'''
+    frames = make_frames(30, [])
+    packet_queue = lilith_client.SampleQueue()
+    for i, samples in enumerate(frames):
+        packet_queue.put(make_packet(i, samples))
+    
+    old_queue = lilith_client.q
+    lilith_client.q = packet_queue
+    try:
+        summary = live_worker.summarize_packets(data.LiveData(constants.NUM_BOXES), max_packets = 10)
+    finally:
+        lilith_client.q = old_queue
+    assert len(summary.packets) == 10
+    assert summary.queue_depth == 30
+    
+    worker = live_worker.DetectionWorker(data.LiveData(constants.NUM_BOXES), packet_queue, 5)
+    worker.start()
+    summaries = []
+    deadline = time.time() + 10
+    while sum(len(s.packets) for s in summaries) < 20 and time.time() < deadline:
+        summaries += worker.take_summaries()
+        time.sleep(0.01)
+    worker.stop()
+    
+    assert [len(s.packets) for s in summaries] == [5] * 4
+    assert [s.queue_depth for s in summaries] == [20, 15, 10, 5]
+
+if __name__ == '__main__':
+    test_worker_matches_game_thread()
+    test_summary_frame_is_a_copy()
+    test_graphs_by_index()
+    test_rms_window()
+    test_summary_pressed()
+    test_queue_depth()
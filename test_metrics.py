@@ -0,0 +1,91 @@
+import csv
+import os
+import tempfile
+
+import numpy as np
+
+import constants
+import lilith_client
+import metrics
+import test_lilith_client
+
+class Packet:
+    def __init__(self, frame_index, received_at, num_frames = 1):
+        self.start = frame_index * constants.LIVE_SAMPLES_PER_MESSAGE
+        self.samples = np.zeros(num_frames * constants.LIVE_SAMPLES_PER_MESSAGE, dtype='int16')
+        self.received_at = received_at
+        self.dequeued_at = received_at + 0.002
+        self.detected_at = received_at + 0.005
+
+def test_rolling_percentiles():
+    p = metrics.RollingPercentiles(size = 100)
+    assert all(np.isnan(p.percentiles()))
+    
+    p.add(np.arange(1000))
+    # Only the last 100 values are kept
+    assert p.percentiles() == np.percentile(np.arange(900, 1000), metrics.PERCENTILES).tolist()
+
+def test_counts_and_latencies():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'metrics.csv')
+        packet_queue = lilith_client.SampleQueue(1, 'drop-oldest')
+        packet_queue.put('a')
+        packet_queue.put('b')
+        m = metrics.LiveMetrics(filename, write_interval = 0, packet_queue = packet_queue)
+        
+        # Frame 2 is late and 5 never arrives
+        packets = [Packet(i, 0.05 * n) for n, i in enumerate([0, 1, 3, 2, 4, 6])]
+        m.add_packets(packets, 6)
+        assert (m.packets, m.frames, m.skipped_frames, m.late_frames) == (6, 6, 2, 1)
+        assert m.max_queue_depth == 6
+        assert np.allclose(m.packet_gaps.percentiles(), 50)
+        
+        m.frame_drawn()
+        assert np.allclose(m.latencies['queue'].percentiles(), 2)
+        assert np.allclose(m.latencies['detection'].percentiles(), 3)
+        assert all(p.drawn_at > p.detected_at for p in packets)
+        
+        # Nothing new to draw
+        m.frame_drawn()
+        assert len(m.latencies['total'].values) == 6
+        
+        with open(filename) as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == m.columns()
+        assert len(rows) == 3
+        assert rows[1][1:8] == ['6', '6', '2', '1', '6', '1', '0']
+        
+        lines = m.overlay_lines()
+        assert len(lines) == 1 + 2 + 2 + len(metrics.LATENCIES)
+        assert lines[1].startswith('messages') and lines[2].startswith('queue depth')
+        assert lines[3].startswith('ms')
+
+def test_coalesced_packets():
+    '''The frames in packets from a coalescing queue are all counted, and
+    aren't taken for skipped frames.'''
+    n = constants.LIVE_SAMPLES_PER_MESSAGE
+    packet_queue = lilith_client.SampleQueue(2, 'coalesce')
+    for i in range(6):
+        packet = test_lilith_client.make_sample_data(i * n, np.full(n, i))
+        packet.received_at = 0.05 * i
+        packet_queue.put(packet)
+    packets = lilith_client.consume_latest_samples(packet_queue)
+    assert len(packets) == 2 and packet_queue.coalesced == 4
+    
+    m = metrics.LiveMetrics(packet_queue = packet_queue)
+    m.add_packets(packets, 2)
+    assert (m.packets, m.frames, m.skipped_frames, m.late_frames) == (2, 6, 0, 0)
+    
+    # The next packet follows on from the last coalesced frame
+    m.add_packets([Packet(6, 0.3)], 1)
+    assert (m.frames, m.skipped_frames, m.late_frames) == (7, 0, 0)
+    
+    # A packet overlapping ones already counted is late, and one after a
+    # gap skips frames
+    m.add_packets([Packet(5, 0.35, 3), Packet(12, 0.4)], 2)
+    assert (m.frames, m.skipped_frames, m.late_frames) == (11, 4, 2)
+
+if __name__ == '__main__':
+    test_rolling_percentiles()
+    test_counts_and_latencies()
+    test_coalesced_packets()
@@ -0,0 +1,65 @@
+import numpy as np
+
+from minmax_pyramid import MinMaxPyramid
+
+def test_window_matches_samples():
+    rng = np.random.default_rng(4)
+    samples = rng.integers(-1000, 1000, 4 * 1024 * 10).astype('int16')
+    
+    pyramid = MinMaxPyramid(len(samples), 16, bucket_size = 4)
+    # Frames that don't line up with the buckets
+    for chunk in np.array_split(samples, 37):
+        pyramid.append(chunk)
+    assert pyramid.end_index == len(samples)
+    
+    for samples_per_column in [4, 8, 64, 1024]:
+        num_samples = 10 * samples_per_column
+        mins, maxes, medians, means, mean = pyramid.window(num_samples, 10)
+        
+        columns = samples[-num_samples:].reshape(10, -1)
+        assert np.array_equal(mins, columns.min(axis=1))
+        assert np.array_equal(maxes, columns.max(axis=1))
+        assert np.allclose(means, columns.mean(axis=1))
+        assert np.isclose(mean, columns.mean())
+        
+        if samples_per_column == 4:
+            assert np.array_equal(medians, np.median(columns, axis=1))
+
+def test_window_cost_is_bounded():
+    '''Every level keeps only about 2 buckets per column, but windows up to
+    max_samples still work.'''
+    pyramid = MinMaxPyramid(10**6, 100, bucket_size = 64)
+    pyramid.append(np.arange(10**6))
+    
+    for level in pyramid._levels:
+        assert level[0].capacity <= 2 * 100 + 2
+    
+    mins, maxes, medians, means, mean = pyramid.window(10**6, 100)
+    assert len(mins) == 100
+    # Up to the end of the last complete bucket at that level
+    assert mins[0] < 10**4 and maxes[-1] > 0.99 * 10**6
+
+def test_fewer_buckets_than_columns():
+    pyramid = MinMaxPyramid(1000, 10, bucket_size = 4)
+    assert pyramid.window(100, 10) is None
+    
+    pyramid.append(np.arange(8))
+    mins, maxes, medians, means, mean = pyramid.window(8, 10)
+    assert list(mins) == [0] * 5 + [4] * 5
+
+def test_too_many_columns():
+    pyramid = MinMaxPyramid(1000, 10, bucket_size = 4)
+    pyramid.append(np.arange(100))
+    
+    try:
+        pyramid.window(100, 11)
+    except ValueError:
+        pass
+    else:
+        assert False, 'window() should raise ValueError'
+
+if __name__ == '__main__':
+    test_window_matches_samples()
+    test_window_cost_is_bounded()
+    test_fewer_buckets_than_columns()
+    test_too_many_columns()
@@ -0,0 +1,77 @@
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+def test_last_and_window():
+    ring = RingBuffer(10, dtype='int16')
+    
+    ring.append(np.arange(0, 7))
+    assert len(ring) == 7
+    assert np.array_equal(ring.last(3), [4, 5, 6])
+    assert np.array_equal(ring.last(100), np.arange(0, 7))
+    
+    # Wrap around the end of the storage
+    ring.append(np.arange(7, 16))
+    assert len(ring) == 10
+    assert ring.start_index == 6 and ring.end_index == 16
+    assert np.array_equal(ring.last(10), np.arange(6, 16))
+    assert np.array_equal(ring.window(8, 12), np.arange(8, 12))
+    
+    # Windows are clipped to what's still in the buffer
+    assert np.array_equal(ring.window(0, 8), [6, 7])
+    assert len(ring.window(20, 30)) == 0
+
+def test_reads_are_views():
+    ring = RingBuffer(4)
+    ring.append(np.ones(3))
+    
+    assert np.shares_memory(ring.last(3), ring._storage)
+
+def test_append_more_than_capacity():
+    ring = RingBuffer(5)
+    ring.append(np.arange(3))
+    ring.append(np.arange(100, 112))
+    
+    assert ring.end_index == 15
+    assert np.array_equal(ring.last(5), np.arange(107, 112))
+
+def test_clear():
+    ring = RingBuffer(5)
+    ring.append(np.arange(3))
+    ring.clear(1000)
+    
+    assert len(ring) == 0
+    ring.append([1, 2])
+    assert ring.start_index == 1000
+    assert np.array_equal(ring.window(1000, 1002), [1, 2])
+
+def test_write_at_index():
+    ring = RingBuffer(10, dtype='int16')
+    ring.write(3, np.arange(3, 6))
+    # Nothing came before index 3
+    assert ring.start_index == 0 and ring.end_index == 6
+    assert np.array_equal(ring.last(10), [0, 0, 0, 3, 4, 5])
+    
+    # A gap is filled with 0s, then a late write fills it in
+    ring.write(8, np.arange(8, 12))
+    assert np.array_equal(ring.window(4, 12), [4, 5, 0, 0, 8, 9, 10, 11])
+    ring.write(6, np.arange(6, 8))
+    assert np.array_equal(ring.last(10), np.arange(2, 12) * (np.arange(2, 12) > 2))
+    
+    # Overlapping the end, and too old to keep
+    ring.write(10, np.arange(20, 24))
+    ring.write(0, np.arange(100, 106))
+    assert ring.start_index == 4 and ring.end_index == 14
+    assert np.array_equal(ring.last(10), [104, 105, 6, 7, 8, 9, 20, 21, 22, 23])
+    
+    # A gap longer than the buffer starts it again
+    ring.write(100, np.arange(3))
+    assert ring.start_index == 100 and ring.end_index == 103
+    assert np.array_equal(ring.last(10), np.arange(3))
+
+if __name__ == '__main__':
+    test_last_and_window()
+    test_reads_are_views()
+    test_append_more_than_capacity()
+    test_clear()
+    test_write_at_index()
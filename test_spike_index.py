@@ -0,0 +1,93 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import spike_index
+import test_analyze_spikes
+
+def test_build_and_load():
+    with tempfile.TemporaryDirectory() as directory:
+        test_analyze_spikes.make_recording(directory, 15)
+        expected = test_analyze_spikes.detect_sequentially(directory)
+        
+        assert spike_index.load(directory) is None
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            built = spike_index.load_or_build(directory)
+        assert list(built.start_indexes) == [s.start_index for s in expected]
+        
+        loaded = spike_index.load(directory)
+        for name in loaded.records.dtype.names:
+            assert np.array_equal(loaded.records[name], built.records[name], equal_nan=True)
+        
+        # Another detector needs another index
+        assert spike_index.load(directory, detector = 'cusum') is None
+        
+        # So does a changed recording
+        filename = os.path.join(directory, 'poredata.bin')
+        stat = os.stat(filename)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert spike_index.load(directory) is None
+
+def test_build_in_subprocess():
+    '''Building in another process finds the same spikes, and the index is
+    still returned when it can't be saved.'''
+    with tempfile.TemporaryDirectory() as directory:
+        test_analyze_spikes.make_recording(directory, 15)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = spike_index.build(directory)
+        os.remove(os.path.join(directory, spike_index.INDEX_FILENAME))
+        
+        # The index can't be written over a directory
+        os.mkdir(os.path.join(directory, spike_index.INDEX_FILENAME + '.tmp.npz'))
+        built = spike_index.build(directory, in_subprocess = True)
+        
+        assert list(built.start_indexes) == list(expected.start_indexes)
+        assert spike_index.load(directory) is None
+
+def test_index_loader():
+    with tempfile.TemporaryDirectory() as directory:
+        # Without a recording the index can't be built
+        loader = spike_index.IndexLoader(directory)
+        loader._thread.join()
+        assert loader.index is None
+
+def test_index_loader_close():
+    '''Closing the loader (which happens at exit) stops the process that's
+    building the index, and its temporary directory is removed.'''
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as temporary:
+        test_analyze_spikes.make_recording(directory, 15)
+        
+        tempfile.tempdir = temporary
+        try:
+            loader = spike_index.IndexLoader(directory)
+            while loader._process is None and loader._thread.is_alive():
+                time.sleep(0.01)
+            loader.close()
+        finally:
+            tempfile.tempdir = None
+        
+        assert loader._process.poll() is not None
+        assert not loader._thread.is_alive()
+        assert os.listdir(temporary) == []
+
+def test_next_and_previous_spike():
+    records = np.zeros(3, dtype=spike_index.spike_writer.RECORD_DTYPE)
+    records['start_index'] = [100, 200, 300]
+    index = spike_index.SpikeIndex(records)
+    
+    assert index.next_spike(0)['start_index'] == 100
+    assert index.next_spike(200)['start_index'] == 200
+    assert index.next_spike(301) is None
+    assert index.previous_spike(100) is None
+    assert index.previous_spike(201)['start_index'] == 200
+    assert list(index.spikes_between(150, 300)['start_index']) == [200]
+
+if __name__ == '__main__':
+    test_build_and_load()
+    test_build_in_subprocess()
+    test_index_loader()
+    test_index_loader_close()
+    test_next_and_previous_spike()
@@ -1,16 +1,46 @@
+import numpy as np
+
 import spike_object
 
-def test_separate_spikes_to_arff_string():
-    spikes = spike_object.Spikes()
-    
+def test_arff_lines():
     data = [1000,2000,1000]
     mean = 500
     spike = spike_object.Spike(data, mean)
     
-    spikes.add_spike(spike)
-    
-    string = spikes.separate_spikes_to_arff_string()
+    features = spike_object.calculate_features(*spike_object.pack_spike_data([spike]))
+    string = spike_object.arff_header() + ''.join(spike_object.arff_lines(features))
     print(string)
+    
+    assert string.splitlines()[-1].startswith('2000,3,')
 
-test_separate_spikes_to_arff_string()
+def test_calculate_features_matches_spike_methods():
+    rng = np.random.default_rng(1)
+    spikes = []
+    for length in [1, 2, 5, 9, 10, 11, 19, 20, 21, 37, 100, 1000]:
+        for i in range(0, 3):
+            data = rng.integers(-3000, 3000, length)
+            spikes.append(spike_object.Spike(data, 0))
+    
+    features = spike_object.calculate_features(*spike_object.pack_spike_data(spikes))
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for spike, row in zip(spikes, features):
+            assert row['peak'] == spike.peak()
+            assert row['duration'] == spike.duration()
+            
+            expected = [spike.skewness(), spike.kurtosis(), spike.objectivity()]
+            expected += list(spike.time_ten_values()) + list(spike.current_twenty_values())
+            actual = [row[name] for name in spike_object.FEATURE_NAMES[2:]]
+            
+            assert np.allclose(actual, expected, equal_nan=True)
+
+def test_spike_caches_features_in_itself():
+    spike = spike_object.Spike([1000, 2000, 1000], 500)
+    
+    assert spike.peak() == 2000
+    assert spike._cache == {'peak': 2000}
 
+if __name__ == '__main__':
+    test_arff_lines()
+    test_calculate_features_matches_spike_methods()
+    test_spike_caches_features_in_itself()
@@ -0,0 +1,155 @@
+import os
+import tempfile
+
+import numpy as np
+
+import spike_object
+import spike_writer
+
+def make_spikes():
+    rng = np.random.default_rng(3)
+    spikes = []
+    for i in range(0, 50):
+        data = rng.integers(-3000, 3000, int(rng.integers(1, 100)))
+        spikes.append(spike_object.Spike(data, 100.0, start_index = 1000 * i))
+    
+    return spikes
+
+def test_spike_writer():
+    spikes = make_spikes()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        writer = spike_writer.SpikeWriter(directory, flush_interval = 0.01)
+        for spike in spikes:
+            writer.add_spike(spike)
+        writer.close()
+        # Closing again does nothing
+        writer.close()
+        
+        path = os.path.join(directory, 'separate_spikes')
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            features = spike_object.calculate_features(*spike_object.pack_spike_data(spikes))
+            expected = spike_object.arff_header() + ''.join(spike_object.arff_lines(features))
+        with open(path + '.arff') as f:
+            assert f.read() == expected
+        
+        with open(path + '.csv') as f:
+            lines = f.read().splitlines()
+        assert lines[0].startswith('start_index,mean,peak,duration,')
+        assert len(lines) == len(spikes) + 1
+        
+        with np.load(path + '.npz') as npz:
+            assert list(npz['start_index']) == [s.start_index for s in spikes]
+            assert list(npz['duration']) == [s.duration() for s in spikes]
+            offsets = npz['offsets']
+            for i, spike in enumerate(spikes):
+                assert np.array_equal(npz['samples'][offsets[i] : offsets[i + 1]], spike.data)
+        
+        assert not os.path.exists(path + '.records.bin')
+        assert not os.path.exists(path + '.samples.bin')
+
+def test_spike_writer_flush():
+    '''The ARFF file has every spike that was flushed before close().'''
+    spikes = make_spikes()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        # Only flush when asked to
+        writer = spike_writer.SpikeWriter(directory, flush_interval = 1000)
+        for spike in spikes[:10]:
+            writer.add_spike(spike)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            writer.flush()
+        
+        with open(os.path.join(directory, 'separate_spikes.arff')) as f:
+            data_lines = f.read().split('@DATA\n')[1].splitlines()
+        assert len(data_lines) == 10
+        
+        writer.close()
+
+def test_spike_writer_without_spikes():
+    '''No files are made if there weren't any spikes.'''
+    with tempfile.TemporaryDirectory() as directory:
+        writer = spike_writer.SpikeWriter(directory, flush_interval = 0.01)
+        writer.close()
+        
+        assert os.listdir(directory) == []
+
+def test_spike_writer_appends():
+    '''A second writer on the same directory keeps the spikes written by
+    the first.'''
+    spikes = make_spikes()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for part in [spikes[:20], spikes[20:]]:
+                writer = spike_writer.SpikeWriter(directory, flush_interval = 0.01)
+                for spike in part:
+                    writer.add_spike(spike)
+                writer.close()
+        
+        path = os.path.join(directory, 'separate_spikes')
+        
+        with open(path + '.arff') as f:
+            string = f.read()
+        assert string.count('@DATA') == 1
+        assert len(string.split('@DATA\n')[1].splitlines()) == len(spikes)
+        
+        with open(path + '.csv') as f:
+            lines = f.read().splitlines()
+        assert len(lines) == len(spikes) + 1
+        
+        with np.load(path + '.npz') as npz:
+            assert list(npz['start_index']) == [s.start_index for s in spikes]
+            assert npz['offsets'][-1] == len(npz['samples'])
+
+def test_spike_writer_replay():
+    '''Playing a recording again, or from part of the way through, doesn't
+    add the spikes that are already in the files.'''
+    spikes = make_spikes()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for part in [spikes, spikes[20:], spikes[:30]]:
+                writer = spike_writer.SpikeWriter(directory, flush_interval = 0.01)
+                for spike in part:
+                    writer.add_spike(spike)
+                writer.close()
+        
+        path = os.path.join(directory, 'separate_spikes')
+        
+        with open(path + '.arff') as f:
+            assert len(f.read().split('@DATA\n')[1].splitlines()) == len(spikes)
+        with open(path + '.csv') as f:
+            assert len(f.read().splitlines()) == len(spikes) + 1
+        
+        with np.load(path + '.npz') as npz:
+            assert list(npz['start_index']) == [s.start_index for s in spikes]
+            offsets = npz['offsets']
+            for i, spike in enumerate(spikes):
+                assert np.array_equal(npz['samples'][offsets[i] : offsets[i + 1]], spike.data)
+
+def test_spike_writer_error():
+    '''close() raises the exception from writing the spikes in the
+    background.'''
+    with tempfile.TemporaryDirectory() as directory:
+        missing = os.path.join(directory, 'missing')
+        writer = spike_writer.SpikeWriter(missing, flush_interval = 0.01)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            writer.add_spike(make_spikes()[0])
+        
+        try:
+            writer.close()
+        except OSError:
+            pass
+        else:
+            assert False, 'close() should raise the error'
+        assert writer.closed
+
+if __name__ == '__main__':
+    test_spike_writer()
+    test_spike_writer_flush()
+    test_spike_writer_without_spikes()
+    test_spike_writer_appends()
+    test_spike_writer_replay()
+    test_spike_writer_error()
@@ -90,33 +90,28 @@ def all_zeros(a):
     az = np.all(are_zeros)
     return az and len(a)
 
-# Memoized class from the Python Decorator Library
 import collections
 import functools
 
-class memoized(object):
-   '''Decorator. Caches a function's return value each time it is called.
-   If called later with the same arguments, the cached value is returned
-   (not reevaluated).
-   '''
-   def __init__(self, func):
-      self.func = func
-      self.cache = {}
-   def __call__(self, *args):
-      if not isinstance(args, collections.abc.Hashable):
-         # uncacheable. a list, for instance.
-         # better to not cache than blow up.
-         return self.func(*args)
-      if args in self.cache:
-         return self.cache[args]
-      else:
-         value = self.func(*args)
-         self.cache[args] = value
-         return value
-   def __repr__(self):
-      '''Return the function's docstring.'''
-      return self.func.__doc__
-   def __get__(self, obj, objtype):
-      '''Support instance methods.'''
-      return functools.partial(self.__call__, obj)
+def memoized(method):
+    '''Decorator for a method. Caches its return value for each set of
+    arguments in the object's _cache dictionary, so the cache is freed along
+    with the object (a cache in the decorator would keep every object it's
+    called with alive). The object must have a _cache attribute.'''
+    name = method.__name__
+    
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        key = (name,) + args if args else name
+        if not isinstance(key, collections.abc.Hashable):
+            # Uncacheable, e.g. a list
+            return method(self, *args)
+        
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = method(self, *args)
+            return value
+    
+    return wrapper
 